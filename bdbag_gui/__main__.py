@@ -1,5 +1,6 @@
 import sys
 import traceback
+import multiprocessing
 from PyQt5 import QtCore
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QApplication, QStyleFactory, QMessageBox
@@ -24,6 +25,7 @@ def excepthook(etype, value, tb):
 
 
 def main():
+    multiprocessing.freeze_support()
     sys.excepthook = excepthook
     QApplication.setDesktopSettingsAware(False)
     QApplication.setStyle(QStyleFactory.create("Fusion"))
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from urllib.request import urlopen
+
+from bdbag import BAG_PROFILE_TAG, bdbagit
+from bdbag.bdbag_config import read_config, BAG_CONFIG_TAG, BAG_METADATA_TAG, DEFAULT_BAG_ALGORITHMS
+from bdbag_gui.impl.hashing import HASH_BLOCK_SIZE, HashingInterruptedError
+
+# the manifest algorithms bdbag itself offers (its --checksum choices), in the order they are offered: a bag made
+# with any other could not be updated or checked with bdbag the same way
+BAG_ALGORITHMS = [alg for alg in ["md5", "sha1", "sha256", "sha512"] if alg in bdbagit.CHECKSUM_ALGOS]
+
+ALGORITHM_PRESETS = [
+    ("Default (md5, sha256)", list(DEFAULT_BAG_ALGORITHMS)),
+    ("Interoperable (sha256)", ["sha256"]),
+    ("Staging, fast on 64-bit (sha512)", ["sha512"]),
+    ("Checksum only (md5)", ["md5"])
+]
+ALGORITHM_PRESET_CUSTOM = "Custom"
+
+DEFAULT_BENCHMARK_BYTES = 32 * 1024 * 1024
+DEFAULT_PROFILE_TIMEOUT = 10
+
+
+def supported_algorithms(algorithms):
+    return [alg for alg in BAG_ALGORITHMS if alg in algorithms]
+
+
+def preset_name(algorithms):
+    for name, preset in ALGORITHM_PRESETS:
+        if sorted(preset) == sorted(algorithms):
+            return name
+    return ALGORITHM_PRESET_CUSTOM
+
+
+def benchmark_algorithm(alg, nbytes=DEFAULT_BENCHMARK_BYTES, block_size=HASH_BLOCK_SIZE):
+    # hashes the same in-memory block repeatedly, so the result is the algorithm throughput without any I/O
+    block = os.urandom(block_size)
+    hasher = hashlib.new(alg)
+    remaining = nbytes
+    start = time.perf_counter()
+    while remaining > 0:
+        hasher.update(block if remaining >= block_size else block[:remaining])
+        remaining -= block_size
+    hasher.hexdigest()
+    return nbytes / max(time.perf_counter() - start, 1e-9)
+
+
+def set_throughput(throughput, algorithms):
+    # every digest of a set is fed from a single read pass, so the cost per byte of the set is the sum of its members
+    costs = [1.0 / throughput[alg] for alg in algorithms if throughput.get(alg)]
+    return 1.0 / sum(costs) if costs else 0.0
+
+
+def load_profile_manifests(profile_url, timeout=DEFAULT_PROFILE_TIMEOUT):
+    # returns the (required, allowed) payload manifest algorithms of a BagIt profile; allowed is None if unrestricted
+    if os.path.isfile(profile_url):
+        with open(profile_url, encoding="utf-8") as profile_file:
+            profile = json.load(profile_file)
+    else:
+        with urlopen(profile_url, timeout=timeout) as response:
+            profile = json.loads(response.read().decode("utf-8"))
+    required = [alg.lower() for alg in profile.get("Manifests-Required", [])]
+    allowed = profile.get("Manifests-Allowed")
+    return required, [alg.lower() for alg in allowed] if allowed is not None else None
+
+
+def recommend_algorithms(throughput, required=None, allowed=None):
+    # the algorithms a profile requires are always part of the set; without any, the fastest allowed one is enough
+    if required:
+        return list(required)
+    candidates = [alg for alg in throughput if allowed is None or alg in allowed]
+    if not candidates:
+        return list(DEFAULT_BAG_ALGORITHMS)
+    return [max(candidates, key=lambda alg: throughput[alg])]
+
+
+def benchmark_algorithms(config_file=None, algorithms=None, nbytes=DEFAULT_BENCHMARK_BYTES, callback=None):
+    algorithms = list(algorithms or BAG_ALGORITHMS)
+    throughput = dict()
+    for index, alg in enumerate(algorithms):
+        if callback is not None and not callback(index, len(algorithms)):
+            raise HashingInterruptedError("Benchmark interrupted.")
+        throughput[alg] = benchmark_algorithm(alg, nbytes)
+        logging.debug("Checksum benchmark: %s %.1f MB/s" % (alg, throughput[alg] / (1024 * 1024)))
+
+    required = allowed = None
+    bag_config = read_config(config_file)[BAG_CONFIG_TAG]
+    profile_url = bag_config.get(BAG_METADATA_TAG, {}).get(BAG_PROFILE_TAG)
+    if profile_url:
+        try:
+            required, allowed = load_profile_manifests(profile_url)
+        except Exception as e:
+            logging.warning("Unable to read the manifest requirements of BagIt profile %s: %s" % (profile_url, e))
+    unavailable = [alg for alg in required or [] if alg not in throughput]
+    if unavailable:
+        logging.warning("BagIt profile %s requires unsupported algorithms: %s" % (profile_url, ", ".join(unavailable)))
+        required = [alg for alg in required if alg in throughput]
+    recommended = recommend_algorithms(throughput, required, allowed)
+    return {
+        "throughput": throughput,
+        "profile": profile_url,
+        "required": required,
+        "allowed": allowed,
+        "recommended": recommended,
+        "recommended_throughput": set_throughput(throughput, recommended)
+    }
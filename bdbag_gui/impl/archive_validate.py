@@ -0,0 +1,322 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import tarfile
+import zipfile
+
+from bdbag import bdbagit, bdbag_api as bdb, urlunquote
+from bdbag.bdbag_config import DEFAULT_BAG_ALGORITHMS
+from bdbag_gui.impl.bag_validate import PayloadValidationError, PayloadOxumMismatch, finish_report, report_note
+from bdbag_gui.impl.hashing import HashProgress, HashingInterruptedError, HASH_BLOCK_SIZE, hash_stream
+from bdbag_gui.impl.payload import normalize_name
+from bdbag_gui.impl.progress import format_bytes
+from bdbag_gui.impl.report import ValidationReport, DEFAULT_REPORT_DIR, REPORT_OK, REPORT_MISMATCH, REPORT_MISSING, \
+    REPORT_UNEXPECTED
+
+# tag files are kept in memory while the archive is read, since the manifests may only follow the payload
+MAX_TAG_FILE_SIZE = 256 * 1024 * 1024
+PAYLOAD_DIR = "data/"
+
+
+class CountingReader(object):
+    # progress of a compressed tar stream is measured in the archive bytes read, as its unpacked size is unknown
+
+    def __init__(self, f, progress):
+        self.f = f
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if not self.progress.add(len(data)):
+            raise HashingInterruptedError("Archive validation interrupted.")
+        return data
+
+
+def zip_members(archive_path, progress, tags_only=None):
+    # yields (name, size, file object) of every file member; a zip archive is indexed, so tag files (or payload
+    # files) can be read on their own
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            if tags_only is not None and is_tag_name(info.filename) != tags_only:
+                continue
+            with archive.open(info) as f:
+                yield info.filename, info.file_size, f
+
+
+def tar_members(archive_path, progress, tags_only=None):
+    # a compressed tar is read as a single stream, so members are yielded in archive order
+    with open(archive_path, "rb") as raw, tarfile.open(fileobj=CountingReader(raw, progress), mode="r|*") as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, member.size, archive.extractfile(member)
+            elif not member.isdir():
+                logging.warning("Skipping archive member %s: links and special files are not verified" % member.name)
+
+
+def strip_root(name):
+    # bag archives hold a single directory, the bag itself
+    if name.startswith("./"):
+        name = name[2:]
+    parts = name.split("/", 1)
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+def is_tag_name(name):
+    return not strip_root(name).startswith(PAYLOAD_DIR)
+
+
+def parse_manifest(text):
+    entries = dict()
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or line.startswith("\ufeff#"):
+            continue
+        entry = line.lstrip("\ufeff").split(None, 1)
+        if len(entry) != 2:
+            logging.error("Invalid manifest entry: %s" % line)
+            continue
+        entries[normalize_name(bdbagit._decode_filename(entry[1]))] = entry[0].lower()
+    return entries
+
+
+def parse_tag_value(text, tag):
+    match = re.search(r"^%s:\s*(.*)$" % re.escape(tag), text, re.MULTILINE | re.IGNORECASE)
+    return match.group(1).strip() if match else None
+
+
+def manifest_algorithm(name):
+    match = re.match(r"^(tag)?manifest-(\w+)\.txt$", name)
+    return (bool(match.group(1)), match.group(2)) if match else (None, None)
+
+
+class ArchiveContents(object):
+
+    def __init__(self, algorithms, on_block=None, on_payload=None):
+        self.algorithms = set(algorithms)
+        self.on_block = on_block
+        self.on_payload = on_payload
+        self.tags = dict()
+        self.payload = dict()
+        self.sizes = dict()
+        self.seconds = dict()
+
+    def read(self, name, size, f):
+        rel_path = normalize_name(strip_root(name))
+        if not rel_path.startswith(PAYLOAD_DIR):
+            if size > MAX_TAG_FILE_SIZE:
+                raise bdbagit.BagError("Tag file %s is too large to validate in place (%s)" %
+                                       (rel_path, format_bytes(size)))
+            self.tags[rel_path] = f.read()
+            if self.on_block is not None and not self.on_block(size):
+                raise HashingInterruptedError("Archive validation interrupted.")
+            is_tag, alg = manifest_algorithm(rel_path)
+            # payload read from now on is also hashed with the algorithm of every manifest seen so far
+            if is_tag is False and alg in hashlib.algorithms_available:
+                self.algorithms.add(alg)
+            return
+        self.hash(rel_path, f, sorted(self.algorithms))
+        self.sizes[rel_path] = size
+        if self.on_payload is not None:
+            self.on_payload(rel_path)
+
+    def hash(self, rel_path, f, algorithms):
+        start = time.perf_counter()
+        hashers = [(alg, hashlib.new(alg)) for alg in algorithms]
+        hash_stream(f, [hasher for alg, hasher in hashers], HASH_BLOCK_SIZE, self.on_block, rel_path)
+        self.payload.setdefault(rel_path, dict()).update((alg, hasher.hexdigest()) for alg, hasher in hashers)
+        # the time spent in a member includes decompressing it
+        self.seconds[rel_path] = self.seconds.get(rel_path, 0.0) + time.perf_counter() - start
+
+    def text(self, rel_path):
+        return self.tags[rel_path].decode("utf-8-sig") if rel_path in self.tags else None
+
+    def manifests(self, complete=False):
+        # the payload manifests by algorithm. Unless complete (every tag file has been read), None until all of them
+        # have been read, which the tag manifests tell as they list every manifest of the bag.
+        names = set(rel_path for rel_path in self.tags if manifest_algorithm(rel_path)[0] is False)
+        if not complete:
+            listed = set()
+            for rel_path in self.tags:
+                if manifest_algorithm(rel_path)[0]:
+                    listed.update(name for name in parse_manifest(self.text(rel_path))
+                                  if manifest_algorithm(name)[0] is False)
+            if not listed or not listed.issubset(names):
+                return None
+        return dict((manifest_algorithm(rel_path)[1], parse_manifest(self.text(rel_path))) for rel_path in names)
+
+
+def report_file(report, name, manifests, digests, sizes, seconds=None, remote=()):
+    expected = dict((alg, entries[name]) for alg, entries in manifests.items() if name in entries)
+    found = digests.get(name)
+    elapsed = seconds.get(name) if seconds else None
+    if found is None:
+        if name not in remote:
+            report.add(name, REPORT_MISSING, expected=expected)
+    elif not expected:
+        report.add(name, REPORT_UNEXPECTED, sizes.get(name), elapsed, actual=found)
+    else:
+        actual = dict((alg, found.get(alg)) for alg in expected)
+        report.add(name, REPORT_OK if actual == expected else REPORT_MISMATCH, sizes.get(name), elapsed,
+                   expected, actual)
+
+
+def report_files(report, manifests, digests, sizes, seconds=None, remote=(), reported=()):
+    # the files not already reported as they were read: missing files, tag files and payload read before its
+    # manifests are only known once the whole archive has been read
+    names = set(digests).union(*[entries.keys() for entries in manifests.values()])
+    for name in sorted(names):
+        if name not in reported:
+            report_file(report, name, manifests, digests, sizes, seconds, remote)
+
+
+def validate_archive(archive_path, callback=None, algorithms=None, report_dir=DEFAULT_REPORT_DIR):
+    # validates a bag archive without extracting it: every member is streamed from the archive through the digests,
+    # and only the tag files are kept (in memory). Payload read before its manifests is hashed with the given (or the
+    # default) algorithms; a manifest of any other algorithm then needs a second pass over just those files.
+    archive_path = os.path.abspath(archive_path)
+    logging.info("Validating bag archive in place: %s" % archive_path)
+    report = None
+    start = time.monotonic()
+    try:
+        is_zip = zipfile.is_zipfile(archive_path)
+        if is_zip:
+            with zipfile.ZipFile(archive_path) as archive:
+                total_bytes = sum(info.file_size for info in archive.infolist())
+        elif tarfile.is_tarfile(archive_path):
+            total_bytes = os.path.getsize(archive_path)
+        else:
+            raise bdbagit.BagError("Unsupported archive format: %s" % archive_path)
+        members = zip_members if is_zip else tar_members
+        progress = HashProgress(total_bytes, callback)
+        report = ValidationReport.create(archive_path, "archive", report_dir) if report_dir else None
+        known_manifests = dict()
+        reported = set()
+
+        def report_payload(rel_path):
+            # a payload file is reported as soon as it is hashed if the manifests have all been read by then, so the
+            # report holds every file checked even if validation stops part way through the archive
+            if report is None:
+                return
+            if not known_manifests:
+                known_manifests.update(contents.manifests() or {})
+                if not known_manifests:
+                    return
+            report_file(report, rel_path, known_manifests, contents.payload, contents.sizes, contents.seconds)
+            reported.add(rel_path)
+
+        # zip members report their unpacked bytes as they are hashed, tar streams the archive bytes read
+        contents = ArchiveContents(algorithms or DEFAULT_BAG_ALGORITHMS, progress.add if is_zip else None,
+                                   report_payload)
+
+        def read_members(tags_only=None):
+            for name, size, f in members(archive_path, progress, tags_only):
+                contents.read(name, size, f)
+
+        if is_zip:
+            # the tag files come first, so the payload is hashed with exactly the algorithms of its manifests
+            read_members(True)
+            known_manifests.update(contents.manifests(complete=True))
+            contents.algorithms = set(alg for alg in known_manifests if alg in hashlib.algorithms_available)
+            read_members(False)
+        else:
+            read_members()
+
+        if "bagit.txt" not in contents.tags:
+            raise bdbagit.BagError("Archive %s does not contain a bag: bagit.txt not found" % archive_path)
+        manifests = contents.manifests(complete=True)
+        tag_manifests = dict()
+        for rel_path in contents.tags:
+            is_tag, alg = manifest_algorithm(rel_path)
+            if is_tag:
+                tag_manifests[alg] = parse_manifest(contents.text(rel_path))
+        if not manifests:
+            raise bdbagit.BagError("No payload manifest found in archive %s" % archive_path)
+        unsupported = [alg for alg in list(manifests) + list(tag_manifests) if alg not in hashlib.algorithms_available]
+        if unsupported:
+            raise bdbagit.BagError("Unsupported manifest algorithms: %s" % ", ".join(unsupported))
+
+        # payload hashed before one of the manifests was read is hashed again for that manifest
+        rehash = dict()
+        for alg, entries in manifests.items():
+            for rel_path in entries:
+                if rel_path in contents.payload and alg not in contents.payload[rel_path]:
+                    rehash.setdefault(rel_path, list()).append(alg)
+        if rehash:
+            logging.info("Reading %d payload files a second time for checksums first seen after them" % len(rehash))
+            progress.total_bytes += total_bytes
+            for name, size, f in members(archive_path, progress, False if is_zip else None):
+                rel_path = normalize_name(strip_root(name))
+                if rel_path in rehash:
+                    contents.hash(rel_path, f, rehash[rel_path])
+        progress.finish()
+
+        errors = list()
+        fetch_text = contents.text("fetch.txt") or ""
+        remote = set(normalize_name(urlunquote(line.split(None, 2)[2]))
+                     for line in fetch_text.splitlines() if len(line.split(None, 2)) == 3)
+        listed = set()
+        for alg, entries in sorted(manifests.items()):
+            for rel_path, expected in sorted(entries.items()):
+                found = contents.payload.get(rel_path)
+                if found is None:
+                    if rel_path not in remote and rel_path not in listed:
+                        errors.append(bdbagit.FileMissing(rel_path))
+                elif found.get(alg) != expected:
+                    errors.append(bdbagit.ChecksumMismatch(rel_path, alg, expected, found.get(alg)))
+                listed.add(rel_path)
+        errors.extend(bdbagit.UnexpectedFile(rel_path) for rel_path in sorted(contents.payload)
+                      if rel_path not in listed)
+        for alg, entries in sorted(tag_manifests.items()):
+            for rel_path, expected in sorted(entries.items()):
+                if rel_path not in contents.tags:
+                    errors.append(bdbagit.FileMissing(rel_path))
+                    continue
+                found = hashlib.new(alg, contents.tags[rel_path]).hexdigest()
+                if found != expected:
+                    errors.append(bdbagit.ChecksumMismatch(rel_path, alg, expected, found))
+
+        payload_bytes = sum(contents.sizes.values())
+        found_oxum = "%d.%d" % (payload_bytes, len(contents.sizes))
+        expected_oxum = parse_tag_value(contents.text("bag-info.txt") or "", "Payload-Oxum")
+        if expected_oxum and not remote and expected_oxum != found_oxum:
+            errors.append(PayloadOxumMismatch(expected_oxum, found_oxum))
+        for e in errors:
+            logging.warning(str(e))
+        if report is not None:
+            report_files(report, manifests, contents.payload, contents.sizes, contents.seconds, remote, reported)
+            tag_digests = dict()
+            for alg, entries in tag_manifests.items():
+                for rel_path in entries:
+                    if rel_path in contents.tags:
+                        tag_digests.setdefault(rel_path, dict())[alg] = \
+                            hashlib.new(alg, contents.tags[rel_path]).hexdigest()
+            report_files(report, tag_manifests, tag_digests,
+                         dict((rel_path, len(data)) for rel_path, data in contents.tags.items()))
+
+        statement = "%d payload files (%s) checked against the %s manifests" % (
+            len(contents.payload), format_bytes(payload_bytes), ", ".join(sorted(manifests)))
+        if expected_oxum:
+            statement += ", Payload-Oxum %s" % ("of the local files only" if remote else
+                                                "matches" if expected_oxum == found_oxum else "does not match")
+        if errors:
+            raise PayloadValidationError("Bag archive validation failed (%s)%s" % (statement, report_note(report)),
+                                         errors)
+        if report is not None:
+            statement += "; report saved to %s" % report.path
+        logging.info("Bag archive %s is valid: %s" % (archive_path, statement))
+        finish_report(report, start)
+        return statement
+    except HashingInterruptedError as e:
+        finish_report(report, start, e)
+        raise bdbagit.BaggingInterruptedError("Bag archive validation interrupted!")
+    except (bdbagit.BagError, bdbagit.BaggingInterruptedError) as e:
+        finish_report(report, start, e)
+        logging.warning(bdb.get_typed_exception(e))
+        raise e
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        finish_report(report, start, e)
+        raise bdbagit.BagError("Unable to read bag archive %s: %s" % (archive_path, e))
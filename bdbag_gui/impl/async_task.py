@@ -1,9 +1,75 @@
+import os
 import sys
+import logging
+import threading
+import multiprocessing
 from PyQt5.QtCore import  QObject, QRunnable, QThreadPool, pyqtSignal
 
+EXECUTOR_DEFAULT = "default"
+EXECUTOR_HASH = "hash"
+EXECUTOR_NETWORK = "network"
+EXECUTOR_DISK = "disk"
+EXECUTOR_WATCH = "watch"
+EXECUTOR_DETECT = "detect"
 
-def async_execute(task):
-    QThreadPool.globalInstance().start(task)
+BACKEND_THREAD = "thread"
+BACKEND_PROCESS = "process"
+
+DEFAULT_EXECUTOR_LIMITS = {
+    EXECUTOR_HASH: os.cpu_count() or 1,
+    EXECUTOR_NETWORK: 16,
+    EXECUTOR_DISK: 2
+}
+
+executors = dict()
+executor_limits = dict(DEFAULT_EXECUTOR_LIMITS)
+# not configurable: integrity checks of watched bags run one at a time in the background
+executor_limits[EXECUTOR_WATCH] = 1
+# not configurable: bag detection and the tree scanner get threads of their own, so that a selection is classified
+# at once even while long archive or extract jobs hold every disk worker
+executor_limits[EXECUTOR_DETECT] = 2
+
+
+def executor_key(name, path=None):
+    if name != EXECUTOR_DISK or not path:
+        return name
+    # disk executors are sized per device, so bags on separate devices do not queue behind each other
+    try:
+        return "%s:%d" % (name, os.stat(path).st_dev)
+    except OSError:
+        return name
+
+
+def get_executor(name=None, path=None):
+    if not name or name == EXECUTOR_DEFAULT:
+        return QThreadPool.globalInstance()
+    key = executor_key(name, path)
+    pool = executors.get(key)
+    if pool is None:
+        pool = QThreadPool()
+        pool.setMaxThreadCount(max(1, executor_limits.get(name, QThreadPool.globalInstance().maxThreadCount())))
+        executors[key] = pool
+    return pool
+
+
+def configure_executors(limits):
+    for name, limit in limits.items():
+        executor_limits[name] = max(1, int(limit))
+    for key, pool in executors.items():
+        name = key.split(":", 1)[0]
+        if name in executor_limits:
+            pool.setMaxThreadCount(executor_limits[name])
+
+
+def wait_for_executors(msecs=-1):
+    done = QThreadPool.globalInstance().waitForDone(msecs)
+    for pool in list(executors.values()):
+        done = pool.waitForDone(msecs) and done
+    return done
+
+
+def async_execute(task, executor=None, path=None, priority=0):
+    get_executor(executor, path).start(task, priority)
 
 
 class TaskSignal(QObject):
@@ -24,19 +90,40 @@ class Task(QRunnable):
         self.canceled = False
         self.signal = None
         self.callback = callback
+        self.on_cancel = None
         self.setAutoDelete(True)
 
     def cancel(self):
         self.canceled = True
 
+    def terminate(self):
+        # threads cannot be killed, so in-process tasks stop at their next cancellation checkpoint
+        self.cancel()
+
+    def discard_partial_output(self):
+        if self.on_cancel is None:
+            return
+        try:
+            self.on_cancel()
+        except Exception as e:
+            logging.warning("Unable to remove partial output of canceled task: %s" % e)
+
+    def emit(self, result, success):
+        try:
+            self.signal.callback.emit(result, success)
+        except RuntimeError:
+            # a task left running when the application closed finishes after its signal object is gone
+            logging.debug("Task finished after the application closed: %s" % result)
+
     def signal_success(self, result):
-        self.signal.callback.emit(result, True)
+        self.emit(result, True)
 
     def signal_failure(self, result):
-        self.signal.callback.emit(result, False)
+        self.emit(result, False)
 
     def signal_canceled(self):
-        self.signal.callback.emit("Task canceled.", False)
+        self.discard_partial_output()
+        self.emit("Task canceled.", False)
 
     def run(self):
         self.signal = TaskSignal(self.callback)
@@ -44,7 +131,7 @@ class Task(QRunnable):
             self.signal_canceled()
             return
         try:
-            result = self.method(*self.args)
+            result = self.execute()
             if self.canceled:
                 self.signal_canceled()
                 return
@@ -58,6 +145,136 @@ class Task(QRunnable):
         finally:
             self.cleanup()
 
+    def execute(self):
+        return self.method(*self.args)
+
     def cleanup(self):
         if self.signal is not None:
-            self.signal.deleteLater()
+            try:
+                self.signal.deleteLater()
+            except RuntimeError:
+                pass
+
+
+class RemoteCallback(object):
+
+    def __init__(self, index):
+        self.index = index
+
+
+class PipeLogHandler(logging.Handler):
+
+    def __init__(self, send):
+        super(PipeLogHandler, self).__init__()
+        self.send = send
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            record.exc_info = None
+            self.send(("log", record.__dict__))
+        except Exception:
+            self.handleError(record)
+
+
+def process_main(conn, method, args, log_level):
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            conn.send(message)
+
+    def remote_callback(index):
+        def callback(*callback_args):
+            send(("callback", index, callback_args))
+            return True
+        return callback
+
+    logger = logging.getLogger()
+    logger.handlers = [PipeLogHandler(send)]
+    logger.setLevel(log_level)
+    args = [remote_callback(arg.index) if isinstance(arg, RemoteCallback) else arg for arg in args]
+    try:
+        result = method(*args)
+        try:
+            send(("success", result))
+        except Exception:
+            # results that cannot be pickled are reduced to their string form
+            send(("success", str(result)))
+    except Exception as e:
+        send(("failure", str(e)))
+    finally:
+        conn.close()
+
+
+class ProcessTask(Task):
+
+    def __init__(self, method, args, callback, callbacks=None):
+        super(ProcessTask, self).__init__(method, args, callback)
+        self.callbacks = list(callbacks or [])
+        self.process = None
+
+    def terminate(self):
+        self.cancel()
+        self.kill()
+
+    def kill(self):
+        process = self.process
+        if process is None or not process.is_alive():
+            return
+        process.terminate()
+        process.join(2)
+        if process.is_alive():
+            process.kill()
+
+    def remote_args(self):
+        args = list()
+        for arg in self.args:
+            index = next((i for i, callback in enumerate(self.callbacks) if callback == arg), None)
+            args.append(RemoteCallback(index) if index is not None else arg)
+        return args
+
+    def dispatch(self, message):
+        kind = message[0]
+        if kind == "callback":
+            self.callbacks[message[1]](*message[2])
+        elif kind == "log":
+            record = logging.makeLogRecord(message[1])
+            logging.getLogger(record.name).handle(record)
+        elif kind == "success":
+            return True, message[1]
+        elif kind == "failure":
+            raise RuntimeError(message[1])
+        return False, None
+
+    def execute(self):
+        context = multiprocessing.get_context("spawn")
+        reader, writer = context.Pipe(duplex=False)
+        self.process = context.Process(target=process_main,
+                                       args=(writer, self.method, self.remote_args(),
+                                             logging.getLogger().getEffectiveLevel()),
+                                       daemon=True)
+        self.process.start()
+        writer.close()
+        try:
+            while True:
+                if self.canceled:
+                    self.kill()
+                    return None
+                if not reader.poll(0.1):
+                    if not self.process.is_alive() and not reader.poll():
+                        raise RuntimeError("Worker process exited unexpectedly (exit code: %s)." %
+                                           self.process.exitcode)
+                    continue
+                try:
+                    message = reader.recv()
+                except EOFError:
+                    raise RuntimeError("Worker process exited unexpectedly (exit code: %s)." %
+                                       self.process.exitcode)
+                done, result = self.dispatch(message)
+                if done:
+                    return result
+        finally:
+            reader.close()
+            self.process.join()
@@ -0,0 +1,298 @@
+import os
+import lzma
+import zlib
+import zipfile
+import logging
+import threading
+from collections import OrderedDict, deque
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal, pyqtSlot
+
+from bdbag import bdbag_api as bdb
+from bdbag_gui.impl.async_task import Task, async_execute, EXECUTOR_DETECT
+
+DEFAULT_CACHE_SIZE = 512
+DEFAULT_SCAN_CACHE_SIZE = 65536
+DEFAULT_SCAN_BATCH_SIZE = 64
+DEFAULT_SCAN_DELAY_MS = 50
+MAX_PENDING_SCANS = 1024
+SCAN_PRIORITY = -1
+
+BAG_STATUS_NONE = 0
+BAG_STATUS_BAG = 1
+BAG_STATUS_HOLEY_BAG = 2
+BAG_STATUS_ARCHIVE = 3
+BAG_STATUS_BAG_ARCHIVE = 4
+
+ARCHIVE_FORMAT_ZIP = "zip"
+ARCHIVE_FORMAT_TAR = "tar"
+ARCHIVE_FORMAT_TGZ = "tgz"
+ARCHIVE_FORMAT_BZ2 = "bz2"
+ARCHIVE_FORMAT_XZ = "xz"
+
+ARCHIVE_MAGIC = [
+    (0, b"PK\x03\x04", ARCHIVE_FORMAT_ZIP),
+    (0, b"PK\x05\x06", ARCHIVE_FORMAT_ZIP),
+    (0, b"\x1f\x8b", ARCHIVE_FORMAT_TGZ),
+    (0, b"BZh", ARCHIVE_FORMAT_BZ2),
+    (0, b"\xfd7zXZ\x00", ARCHIVE_FORMAT_XZ),
+    (257, b"ustar", ARCHIVE_FORMAT_TAR)
+]
+TAR_MAGIC_OFFSET = 257
+TAR_HEADER_SIZE = 512
+SNIFF_BYTES = 4096
+DEFAULT_SNIFF_CACHE_SIZE = 4096
+
+sniff_cache = OrderedDict()
+sniff_lock = threading.Lock()
+
+
+def sniff_archive_format(header):
+    for offset, magic, archive_format in ARCHIVE_MAGIC:
+        if header[offset:offset + len(magic)] == magic:
+            return archive_format
+    return None
+
+
+def peek_decompressed(archive_format, header):
+    try:
+        if archive_format == ARCHIVE_FORMAT_TGZ:
+            return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(header, TAR_HEADER_SIZE)
+        if archive_format == ARCHIVE_FORMAT_XZ:
+            return lzma.LZMADecompressor().decompress(header, TAR_HEADER_SIZE)
+    except (zlib.error, lzma.LZMAError, OSError, EOFError):
+        pass
+    return b""
+
+
+def find_zip_bag_root(path):
+    # only the central directory at the end of the file is read, member data is never decompressed
+    try:
+        with zipfile.ZipFile(path) as zf:
+            for name in zf.namelist():
+                parts = name.strip("/").split("/")
+                if len(parts) == 2 and parts[1] == "bagit.txt":
+                    return parts[0]
+    except (zipfile.BadZipFile, OSError, ValueError) as e:
+        logging.debug("Unable to read zip central directory of [%s]: %s" % (path, e))
+    return None
+
+
+def sniff_archive(path):
+    # returns (archive_format, bag_root); both are None if the file is not an archive bdbag can extract
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with sniff_lock:
+        result = sniff_cache.get(key)
+        if result is not None:
+            sniff_cache.move_to_end(key)
+            return result
+
+    archive_format, bag_root = None, None
+    try:
+        with open(path, "rb") as archive_file:
+            header = archive_file.read(SNIFF_BYTES)
+        archive_format = sniff_archive_format(header)
+        if archive_format == ARCHIVE_FORMAT_ZIP:
+            bag_root = find_zip_bag_root(path)
+        elif archive_format in (ARCHIVE_FORMAT_TGZ, ARCHIVE_FORMAT_XZ):
+            # a compressed stream is only extractable if it holds a tar (bz2 blocks are too large to peek into)
+            tar_header = peek_decompressed(archive_format, header)
+            if len(tar_header) > TAR_MAGIC_OFFSET + 5 and sniff_archive_format(tar_header) != ARCHIVE_FORMAT_TAR:
+                archive_format = None
+    except OSError as e:
+        logging.debug("Unable to read [%s]: %s" % (path, e))
+
+    result = (archive_format, bag_root)
+    with sniff_lock:
+        sniff_cache[key] = result
+        while len(sniff_cache) > DEFAULT_SNIFF_CACHE_SIZE:
+            sniff_cache.popitem(last=False)
+    return result
+
+
+def classify_archive(path):
+    archive_format, bag_root = sniff_archive(path)
+    if bag_root:
+        return BAG_STATUS_BAG_ARCHIVE
+    return BAG_STATUS_ARCHIVE if archive_format else BAG_STATUS_NONE
+
+
+def classify_path(path):
+    # a cheap approximation of is_bag (bagit.txt only) since this runs for every row that becomes visible
+    try:
+        if os.path.isdir(path):
+            if not os.path.isfile(os.path.join(path, "bagit.txt")):
+                return BAG_STATUS_NONE
+            fetch_txt = os.path.join(path, "fetch.txt")
+            if os.path.isfile(fetch_txt) and os.path.getsize(fetch_txt) > 0:
+                return BAG_STATUS_HOLEY_BAG
+            return BAG_STATUS_BAG
+        return classify_archive(path)
+    except OSError as e:
+        logging.debug("Unable to classify [%s]: %s" % (path, e))
+    return BAG_STATUS_NONE
+
+
+def classify_paths(paths):
+    return [(path, classify_path(path)) for path in paths]
+
+
+def detect_bag(path):
+    try:
+        if os.path.isdir(path):
+            return path, BAG_STATUS_BAG if bdb.is_bag(path) else BAG_STATUS_NONE
+        return path, classify_archive(path)
+    except Exception as e:
+        logging.debug("Unable to determine if [%s] is a bag: %s" % (path, e))
+        return path, BAG_STATUS_NONE
+
+
+class BagDetector(QObject):
+    bag_detected_signal = pyqtSignal(str, int)
+    bag_invalidated_signal = pyqtSignal(str)
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE, parent=None):
+        super(BagDetector, self).__init__(parent)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = set()
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.invalidate)
+        self.watcher.fileChanged.connect(self.onFileChanged)
+
+    def cached(self, path):
+        if path not in self.cache:
+            return None
+        self.cache.move_to_end(path)
+        return self.cache[path]
+
+    def request(self, path):
+        status = self.cached(path)
+        if status is not None or path in self.pending:
+            return status
+        self.pending.add(path)
+        async_execute(Task(detect_bag, [path], self.onDetected), EXECUTOR_DETECT, path)
+        return None
+
+    def watch(self, path):
+        paths = [path]
+        bagit_txt = os.path.join(path, "bagit.txt")
+        if os.path.isfile(bagit_txt):
+            paths.append(bagit_txt)
+        self.watcher.addPaths(paths)
+
+    def unwatch(self, path):
+        watched = set(self.watcher.directories() + self.watcher.files())
+        paths = [p for p in (path, os.path.join(path, "bagit.txt")) if p in watched]
+        if paths:
+            self.watcher.removePaths(paths)
+
+    @pyqtSlot(object, bool)
+    def onDetected(self, result, success):
+        if not success:
+            return
+        path, status = result
+        if path not in self.pending:
+            # invalidated while the detection was in flight, so the result may already be stale
+            self.request(path)
+            return
+        self.pending.discard(path)
+        self.cache[path] = status
+        self.cache.move_to_end(path)
+        self.watch(path)
+        while len(self.cache) > self.cache_size:
+            evicted, _ = self.cache.popitem(last=False)
+            self.unwatch(evicted)
+        self.bag_detected_signal.emit(path, status)
+
+    @pyqtSlot(str)
+    def invalidate(self, path):
+        path = os.path.normpath(path)
+        self.pending.discard(path)
+        if self.cache.pop(path, None) is not None:
+            self.unwatch(path)
+        self.bag_invalidated_signal.emit(path)
+
+    @pyqtSlot(str)
+    def onFileChanged(self, path):
+        # either a watched archive file or the bagit.txt of a watched directory
+        self.invalidate(path if path in self.cache else os.path.dirname(path))
+
+
+class BagScanner(QObject):
+    scanned_signal = pyqtSignal(object)
+
+    def __init__(self,
+                 batch_size=DEFAULT_SCAN_BATCH_SIZE,
+                 cache_size=DEFAULT_SCAN_CACHE_SIZE,
+                 parent=None):
+        super(BagScanner, self).__init__(parent)
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.queue = deque()
+        self.queued = set()
+        self.in_flight = set()
+        self.stale = set()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(DEFAULT_SCAN_DELAY_MS)
+        self.timer.timeout.connect(self.dispatch)
+
+    def status(self, path):
+        status = self.cache.get(path)
+        if status is None:
+            self.request(path)
+        else:
+            self.cache.move_to_end(path)
+        return status
+
+    def request(self, path):
+        if path in self.queued or path in self.in_flight:
+            return
+        # newest requests first: they are the rows currently on screen, older ones may have scrolled out of view
+        self.queue.appendleft(path)
+        self.queued.add(path)
+        while len(self.queue) > MAX_PENDING_SCANS:
+            self.queued.discard(self.queue.pop())
+        if not self.in_flight and not self.timer.isActive():
+            self.timer.start()
+
+    def invalidate(self, path):
+        self.cache.pop(path, None)
+        if path in self.in_flight:
+            self.stale.add(path)
+
+    @pyqtSlot()
+    def dispatch(self):
+        if self.in_flight or not self.queue:
+            return
+        batch = list()
+        while self.queue and len(batch) < self.batch_size:
+            path = self.queue.popleft()
+            self.queued.discard(path)
+            batch.append(path)
+        self.in_flight = set(batch)
+        # one low priority batch at a time, so scanning never crowds out bag tasks on the same device
+        async_execute(Task(classify_paths, [batch], self.onScanned), EXECUTOR_DETECT, batch[0], SCAN_PRIORITY)
+
+    @pyqtSlot(object, bool)
+    def onScanned(self, results, success):
+        stale = self.stale
+        self.in_flight = set()
+        self.stale = set()
+        if success:
+            results = [(path, status) for path, status in results if path not in stale]
+            for path, status in results:
+                self.cache[path] = status
+                self.cache.move_to_end(path)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            self.scanned_signal.emit(results)
+        for path in stale:
+            self.request(path)
+        if self.queue:
+            self.timer.start()
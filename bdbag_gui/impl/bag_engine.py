@@ -0,0 +1,335 @@
+import os
+import time
+import logging
+import tempfile
+from datetime import date, datetime
+
+from bdbag import VERSION, BAGIT_VERSION, PROJECT_URL, urlunquote, bdbagit, bdbag_api as bdb
+from bdbag.bdbag_config import read_config, BAG_CONFIG_TAG, BAG_ALGORITHMS_TAG, BAG_METADATA_TAG, \
+    BAG_SPEC_VERSION_TAG, BAG_ARCHIVE_IDEMPOTENT, DEFAULT_BAG_ALGORITHMS, DEFAULT_BAG_SPEC_VERSION
+from bdbag_gui.impl.hashing import hash_file, hash_files, HashProgress, HashingInterruptedError, DEFAULT_HASH_WORKERS, \
+    DEFAULT_HASH_ENGINE
+from bdbag_gui.impl.digest_cache import open_digest_cache, digest_key, cacheable, DIGEST_CACHE_TRUST, \
+    DIGEST_CACHE_OFF
+from bdbag_gui.impl.payload import scan_payload, cached_payload_files, diff_payload, normalize_name, \
+    payload_algorithms, manifest_times
+
+
+def scan_payload_files(root):
+    files = cached_payload_files(root)
+    if files is not None:
+        logging.info("Reusing pre-flight scan of %s (%d files)" % (root, len(files)))
+        return files, None
+    scanned = scan_payload(root)
+    return [path for path, stat in scanned], [stat for path, stat in scanned]
+
+
+def manifest_name(path, root, prefix="data"):
+    return "/".join([prefix] + os.path.relpath(path, root).split(os.path.sep))
+
+
+def hash_payload(files, algorithms, workers=DEFAULT_HASH_WORKERS, callback=None, cache_mode=DIGEST_CACHE_OFF,
+                 errors=None, engine=DEFAULT_HASH_ENGINE, stats=None, max_age=None, on_file=None, stop=None):
+    # returns a list of (digests, nbytes) in the same order as files, served from the digest cache where possible
+    # (if given, only from checksums computed within max_age seconds); stats already gathered while walking the
+    # payload save a second stat of every file. on_file(index, result, seconds) is called as each file is done, with
+    # seconds None for cached checksums and result None for files that could not be read (their error is already in
+    # errors). Setting stop abandons the files not yet hashed, see hash_files.
+    stats = list(stats) if stats is not None else [None] * len(files)
+    keys = [None] * len(files)
+    for index, path in enumerate(files):
+        try:
+            if stats[index] is None:
+                stats[index] = os.stat(path)
+            keys[index] = digest_key(stats[index])
+        except OSError as e:
+            if errors is None:
+                raise
+            errors[index] = e
+            if on_file is not None:
+                on_file(index, None, None)
+
+    results = [None] * len(files)
+    cache = open_digest_cache(cache_mode)
+    try:
+        if cache is not None and cache_mode == DIGEST_CACHE_TRUST:
+            for index, digests in enumerate(cache.lookup(keys, algorithms, max_age)):
+                if digests is not None:
+                    results[index] = (digests, keys[index][2])
+                    if on_file is not None:
+                        on_file(index, results[index], None)
+        pending = [index for index in range(len(files)) if results[index] is None and keys[index] is not None]
+        total_bytes = sum(keys[index][2] for index in pending)
+        if len(pending) < len(files) - len(errors or {}):
+            logging.info("Using cached checksums for %d of %d files." % (len(files) - len(pending), len(files)))
+        logging.info("Using %d threads to generate checksums for %d files (%d bytes): %s" %
+                     (workers, len(pending), total_bytes, ", ".join(algorithms)))
+
+        hashed_ns = time.time_ns()
+        pending_errors = None if errors is None else dict()
+
+        def on_pending_file(position, result, seconds):
+            if result is None and position in pending_errors:
+                errors[pending[position]] = pending_errors[position]
+            on_file(pending[position], result, seconds)
+
+        hashed = hash_files([files[index] for index in pending], algorithms, workers,
+                            HashProgress(total_bytes, callback), errors=pending_errors, engine=engine,
+                            stats=[stats[index] for index in pending],
+                            on_file=None if on_file is None else on_pending_file, stop=stop)
+        for position, error in (pending_errors or {}).items():
+            errors[pending[position]] = error
+        for index, result in zip(pending, hashed):
+            results[index] = result
+
+        if cache is not None:
+            # only files that did not change while they were being read are cached
+            items = list()
+            for index in pending:
+                if results[index] is None or not cacheable(keys[index], hashed_ns):
+                    continue
+                try:
+                    if digest_key(os.stat(files[index])) == keys[index]:
+                        items.append((keys[index], results[index][0]))
+                except OSError:
+                    pass
+            cache.store(items, hashed_ns // 10 ** 9)
+    finally:
+        if cache is not None:
+            cache.close()
+    return results
+
+
+def write_manifests(bag_path, algorithms, entries, hashed_ns=None):
+    # the manifests are stamped with the time hashing started, so a payload file modified while the bag was being
+    # hashed is still newer than the manifests when the payload is next compared with them (see payload.diff_payload)
+    for alg in algorithms:
+        manifest_file = os.path.join(bag_path, "manifest-%s.txt" % alg)
+        logging.info("Creating %s" % manifest_file)
+        with open(manifest_file, "w", encoding="utf-8") as manifest:
+            for name, digests in entries:
+                digest = digests.get(alg)
+                if digest:
+                    manifest.write("%s  %s\n" % (digest, bdbagit._encode_filename(name)))
+        if hashed_ns is not None:
+            os.utime(manifest_file, ns=(hashed_ns, hashed_ns))
+
+
+def default_metadata(bag_metadata, idempotent=False):
+    if idempotent:
+        # as in bdbag, an idempotent bag has no bagging time, so the same payload always makes the same bag
+        for name in ("Bagging-Date", "Bagging-Time"):
+            if name in bag_metadata:
+                logging.warning("%s metadata is not compatible with Bag idempotency. Removing %s attribute." %
+                                (name, name))
+                del bag_metadata[name]
+    else:
+        if "Bagging-Date" not in bag_metadata:
+            bag_metadata["Bagging-Date"] = date.strftime(date.today(), "%Y-%m-%d")
+        if "Bagging-Time" not in bag_metadata:
+            bag_metadata["Bagging-Time"] = datetime.now().astimezone().strftime("%H:%M:%S %Z")
+    if "Bag-Software-Agent" not in bag_metadata:
+        bag_metadata["Bag-Software-Agent"] = \
+            "BDBag version: %s (Bagit version: %s) <%s>" % (VERSION, BAGIT_VERSION, PROJECT_URL)
+    return bag_metadata
+
+
+def tag_files(bag_path):
+    # every file outside of data/ except the tag manifests themselves, named relative to the bag and in the order
+    # bagit lists them (directory order, not sorted), so the tag manifests are the same as those bdbag writes
+    files = list()
+    for entry in os.listdir(bag_path):
+        if entry == "data":
+            continue
+        path = os.path.join(bag_path, entry)
+        if os.path.isfile(path):
+            if not entry.startswith("tagmanifest-"):
+                files.append((entry, path))
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                if not filename.startswith("tagmanifest-"):
+                    path = os.path.join(dirpath, filename)
+                    files.append((os.path.relpath(path, bag_path).replace(os.path.sep, "/"), path))
+    return files
+
+
+def save_bag_info(bag_path, bag_metadata, total_bytes, total_files, algorithms):
+    # writes bag-info.txt and the tag manifests directly: reopening the bag through bagit to save it would parse and
+    # path check every manifest entry twice, which takes longer than hashing a payload of millions of small files
+    bag_metadata = dict(bag_metadata)
+    bag_metadata["Payload-Oxum"] = "%d.%d" % (total_bytes, total_files)
+    bag_info_file = os.path.join(bag_path, "bag-info.txt")
+    logging.info("Creating %s" % bag_info_file)
+    bdbagit._make_tag_file(bag_info_file, bag_metadata)
+
+    files = tag_files(bag_path)
+    digests = [hash_file(path, algorithms)[0] for name, path in files]
+    for alg in algorithms:
+        tagmanifest_file = os.path.join(bag_path, "tagmanifest-%s.txt" % alg)
+        logging.info("Creating %s" % tagmanifest_file)
+        with open(tagmanifest_file, "w", encoding="utf-8") as tagmanifest:
+            for (name, path), file_digests in zip(files, digests):
+                tagmanifest.write("%s %s\n" % (file_digests[alg], bdbagit._encode_filename(name)))
+    return bag_path
+
+
+def make_bag(bag_path, algorithms=None, update=False, config_file=None, workers=DEFAULT_HASH_WORKERS,
+             callback=None, cache_mode=DIGEST_CACHE_OFF, engine=DEFAULT_HASH_ENGINE, diff=None, idempotent=None,
+             strict=False, ro_metadata=None, ro_metadata_file=None):
+    # takes the same options as bdbag_api.make_bag, with the same defaults taken from the bdbag configuration
+    bag_path = os.path.abspath(bag_path)
+    bag_config = read_config(config_file)[BAG_CONFIG_TAG]
+    algorithms = list(algorithms or bag_config.get(BAG_ALGORITHMS_TAG, DEFAULT_BAG_ALGORITHMS))
+    idempotent = bag_config.get(BAG_ARCHIVE_IDEMPOTENT, False) if idempotent is None else idempotent
+    if ro_metadata or ro_metadata_file:
+        # RO metadata is serialized into tag files by bdbag itself, so such bags are left to it
+        logging.info("Using bdbag to make a bag with RO metadata: %s" % bag_path)
+        bdb.make_bag(bag_path, algorithms, update, True, False, None, None, None, config_file, ro_metadata,
+                     ro_metadata_file, idempotent, strict)
+        return bag_path
+
+    created = False
+    if os.path.isfile(os.path.join(bag_path, "bagit.txt")):
+        if not update:
+            logging.info("The directory %s is already a bag." % bag_path)
+        else:
+            update_bag(bag_path, algorithms, workers, callback, cache_mode, engine, diff, idempotent)
+    else:
+        create_bag(bag_path, algorithms, bag_config, workers, callback, cache_mode, engine, idempotent)
+        created = True
+
+    if strict:
+        try:
+            bdbagit.BDBag(bag_path)._validate_structure()
+        except bdbagit.BagValidationError as e:
+            error = ("The newly created/updated bag is not structurally valid and strict checking has been requested.%s"
+                     " Exception: %s\n" % (" The bag will be reverted back to a normal directory." if created else "",
+                                           bdb.get_typed_exception(e)))
+            logging.error(error)
+            if created:
+                bdb.revert_bag(bag_path)
+            raise bdbagit.BagValidationError(error)
+    return bag_path
+
+
+def create_bag(bag_path, algorithms, bag_config, workers=DEFAULT_HASH_WORKERS, callback=None,
+               cache_mode=DIGEST_CACHE_OFF, engine=DEFAULT_HASH_ENGINE, idempotent=False):
+    logging.info("Creating bag for directory %s" % bag_path)
+    if not os.path.isdir(bag_path):
+        raise RuntimeError("Bag directory %s does not exist" % bag_path)
+    unwritable = [path for path in [bag_path] + [os.path.join(bag_path, entry) for entry in os.listdir(bag_path)]
+                  if os.path.isdir(path) and not os.access(path, os.W_OK)]
+    if unwritable:
+        raise bdbagit.BagError("Missing permissions to move all files and directories: %s" % ", ".join(unwritable))
+
+    # everything is hashed before the payload is moved, so a failed or canceled creation leaves the directory as is
+    files, stats = scan_payload_files(bag_path)
+    hashed_ns = time.time_ns()
+    try:
+        results = hash_payload(files, algorithms, workers, callback, cache_mode, engine=engine, stats=stats)
+    except HashingInterruptedError:
+        raise bdbagit.BaggingInterruptedError("Bag creation interrupted!")
+    entries = [(manifest_name(path, bag_path), digests) for path, (digests, nbytes) in zip(files, results)]
+    total_bytes = sum(nbytes for digests, nbytes in results)
+
+    logging.info("Creating data directory")
+    temp_data = tempfile.mkdtemp(dir=bag_path)
+    for entry in os.listdir(bag_path):
+        path = os.path.join(bag_path, entry)
+        if path != temp_data:
+            os.rename(path, os.path.join(temp_data, entry))
+    data_dir = os.path.join(bag_path, "data")
+    os.rename(temp_data, data_dir)
+    os.chmod(data_dir, os.stat(bag_path).st_mode)
+
+    write_manifests(bag_path, algorithms, entries, hashed_ns)
+    logging.info("Creating bagit.txt")
+    with open(os.path.join(bag_path, "bagit.txt"), "w", encoding="utf-8") as bagit_file:
+        bagit_file.write("BagIt-Version: %s\nTag-File-Character-Encoding: UTF-8\n" %
+                         bag_config.get(BAG_SPEC_VERSION_TAG, DEFAULT_BAG_SPEC_VERSION))
+    save_bag_info(bag_path,
+                  default_metadata(bag_config.get(BAG_METADATA_TAG, {}).copy(), idempotent),
+                  total_bytes,
+                  len(entries),
+                  algorithms)
+    logging.info("Created bag: %s" % bag_path)
+    return bag_path
+
+
+def remote_manifest_entries(bag, local_names):
+    # payload files still referenced from fetch.txt keep the digests already recorded in the manifests
+    entries = list()
+    total_bytes = 0
+    payload_entries = bag.payload_entries()
+    for url, size, filename in bag.fetch_entries():
+        name = urlunquote(filename)
+        if name in local_names:
+            continue
+        entries.append((name, payload_entries.get(os.path.normpath(name), {})))
+        try:
+            total_bytes += int(size)
+        except ValueError:
+            pass
+    return sorted(entries), total_bytes
+
+
+def update_bag(bag_path, algorithms, workers=DEFAULT_HASH_WORKERS, callback=None, cache_mode=DIGEST_CACHE_OFF,
+               engine=DEFAULT_HASH_ENGINE, diff=None, idempotent=False):
+    logging.info("Updating bag: %s" % bag_path)
+    bag = bdbagit.BDBag(bag_path)
+    bag_metadata = default_metadata(dict(bag.info), idempotent)
+    new_algorithms = [alg for alg in algorithms if alg not in bag.algorithms]
+    if new_algorithms:
+        return rehash_bag(bag, bag_metadata, bag.algorithms + new_algorithms, workers, callback, cache_mode, engine)
+
+    # without new algorithms only files added or modified since the manifests were written are hashed again. The
+    # changes are those of the payload comparison the user confirmed, unless the manifests were rewritten since.
+    if diff is None or (diff.reference_ns, diff.reference_ctime_ns) != manifest_times(bag_path):
+        if diff is not None:
+            logging.warning("The manifests of %s changed since the payload was compared, comparing again." % bag_path)
+        diff = diff_payload(bag, cache_mode)
+    logging.info("Payload changes: %s" % diff.summary())
+    # the manifests are stamped with the time of the comparison, so a file modified after it is found changed next time
+    hashed_ns = diff.scanned_ns
+    pending = diff.pending()
+    manifest_algorithms = payload_algorithms(bag)
+    hashed = dict()
+    if pending:
+        try:
+            results = hash_payload([path for name, path in pending], manifest_algorithms, workers, callback,
+                                   cache_mode, engine=engine)
+        except HashingInterruptedError:
+            raise bdbagit.BaggingInterruptedError("Bag update interrupted!")
+        hashed = dict((name, result) for (name, path), result in zip(pending, results))
+
+    payload_entries = dict((normalize_name(name), digests) for name, digests in bag.payload_entries().items())
+    entries = list()
+    total_bytes = 0
+    for name, path, size, state in diff.files:
+        digests, nbytes = hashed.get(name) or (payload_entries[normalize_name(name)], size)
+        entries.append((name, digests))
+        total_bytes += nbytes
+    remote_entries, remote_bytes = remote_manifest_entries(bag, set(name for name, digests in entries))
+
+    if not diff.is_empty():
+        write_manifests(bag_path, manifest_algorithms, entries + remote_entries, hashed_ns)
+    return save_bag_info(bag_path, bag_metadata, total_bytes + remote_bytes, len(entries) + len(remote_entries),
+                         bag.algorithms)
+
+
+def rehash_bag(bag, bag_metadata, algorithms, workers=DEFAULT_HASH_WORKERS, callback=None,
+               cache_mode=DIGEST_CACHE_OFF, engine=DEFAULT_HASH_ENGINE):
+    data_dir = os.path.join(bag.path, "data")
+    files, stats = scan_payload_files(data_dir)
+    hashed_ns = time.time_ns()
+    try:
+        results = hash_payload(files, algorithms, workers, callback, cache_mode, engine=engine, stats=stats)
+    except HashingInterruptedError:
+        raise bdbagit.BaggingInterruptedError("Bag update interrupted!")
+    entries = [(manifest_name(path, data_dir), digests) for path, (digests, nbytes) in zip(files, results)]
+    remote_entries, remote_bytes = remote_manifest_entries(bag, set(name for name, digests in entries))
+    total_bytes = sum(nbytes for digests, nbytes in results) + remote_bytes
+
+    write_manifests(bag.path, algorithms, entries + remote_entries, hashed_ns)
+    return save_bag_info(bag.path, bag_metadata, total_bytes, len(entries) + len(remote_entries), algorithms)
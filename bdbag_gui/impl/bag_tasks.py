@@ -1,20 +1,124 @@
+import os
+import shutil
+import logging
+import tarfile
+import zipfile
 from PyQt5 import QtCore
 from PyQt5.QtCore import pyqtSignal
 
 from bdbag import bdbag_api as bdb
-from bdbag_gui.impl.async_task import Task, async_execute
+from bdbag_gui.impl.async_task import Task, ProcessTask, async_execute, EXECUTOR_DEFAULT, EXECUTOR_HASH, \
+    EXECUTOR_NETWORK, EXECUTOR_DISK, BACKEND_THREAD, BACKEND_PROCESS
+from bdbag_gui.impl.progress import ProgressAggregator
+from bdbag_gui.impl import bag_engine, bag_validate, archive_validate, fetch_engine, payload
+from bdbag_gui.impl.hashing import DEFAULT_HASH_WORKERS, DEFAULT_HASH_ENGINE
+from bdbag_gui.impl.fetch_engine import DEFAULT_FETCH_WORKERS, DEFAULT_FETCH_PER_HOST
+from bdbag_gui.impl.digest_cache import DIGEST_CACHE_TRUST, DIGEST_CACHE_RECOMPUTE, DEFAULT_DIGEST_TRUST_DAYS
+
+TASK_TYPE_CREATE = "create"
+TASK_TYPE_REVERT = "revert"
+TASK_TYPE_VALIDATE = "validate"
+TASK_TYPE_FETCH = "fetch"
+TASK_TYPE_ARCHIVE = "archive"
+TASK_TYPE_EXTRACT = "extract"
+TASK_TYPE_MATERIALIZE = "materialize"
+
+TASK_TYPES = [TASK_TYPE_CREATE, TASK_TYPE_REVERT, TASK_TYPE_VALIDATE, TASK_TYPE_FETCH, TASK_TYPE_ARCHIVE,
+              TASK_TYPE_EXTRACT, TASK_TYPE_MATERIALIZE]
+
+
+def path_identity(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_dev, stat.st_ino
+    except OSError:
+        return None
+
+
+def archive_root_name(archive_path):
+    name = None
+    try:
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                names = archive.namelist()
+                name = names[0] if names else None
+        else:
+            with tarfile.open(archive_path) as archive:
+                member = archive.next()
+                name = member.name if member else None
+    except Exception as e:
+        logging.debug("Unable to read archive member names from %s: %s" % (archive_path, e))
+    if name:
+        name = name.replace("\\", "/").lstrip("/").partition("/")[0]
+    return name or os.path.splitext(os.path.basename(archive_path))[0]
+
+
+def extraction_path(archive_path, output_path=None):
+    base_path = os.path.realpath(output_path) if output_path else \
+        os.path.dirname(os.path.splitext(archive_path)[0])
+    return os.path.join(base_path, archive_root_name(archive_path))
+
+
+def remove_partial_output(path, identity):
+    # only remove output created by the canceled task, never content that existed before it started
+    if not os.path.lexists(path) or (identity is not None and path_identity(path) == identity):
+        return
+    logging.info("Removing partial output of canceled task: %s" % path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        os.remove(path)
 
 
 class BagTask(QtCore.QObject):
     status_update_signal = pyqtSignal(str, bool)
     progress_update_signal = pyqtSignal(int, int)
+    throughput_update_signal = pyqtSignal(float, float)
+    executor = EXECUTOR_DEFAULT
+    task_type = None
 
     def __init__(self, parent=None):
         super(BagTask, self).__init__(parent)
         self.task = None
-
-    def start(self):
-        async_execute(self.task)
+        self.path = None
+        self.job_queue = None
+        self.backend = BACKEND_THREAD
+        self.partial_outputs = list()
+        self.progress = ProgressAggregator(parent=self)
+        self.progress.progress_signal.connect(self.progress_update_signal)
+        self.progress.throughput_signal.connect(self.throughput_update_signal)
+
+    def create_task(self, method, args):
+        if self.backend == BACKEND_PROCESS:
+            task = ProcessTask(method, args, self.result_callback,
+                               [self.progress_callback, self.byte_progress_callback])
+        else:
+            task = Task(method, args, self.result_callback)
+        task.on_cancel = self.discard_partial_output
+        return task
+
+    def track_partial_output(self, path):
+        self.partial_outputs.append((path, path_identity(path)))
+
+    def discard_partial_output(self):
+        for path, identity in self.partial_outputs:
+            remove_partial_output(path, identity)
+
+    def start(self, path=None):
+        self.path = path
+        if self.job_queue is not None:
+            self.job_queue.schedule(self)
+        else:
+            self.run()
+
+    def run(self):
+        # the progress timer only runs while the task does, not while it waits in the job queue
+        self.progress.start()
+        async_execute(self.task, self.executor, self.path)
+
+    def can_cancel(self):
+        # whether the task stops part way once it runs
+        return True
 
     def cancel(self):
         self.task.cancel()
@@ -23,6 +127,7 @@ class BagTask(QtCore.QObject):
         self.task.terminate()
 
     def set_status(self, status, success):
+        self.progress.stop()
         self.status_update_signal.emit(status, success)
 
     def result_callback(self, result, success):
@@ -32,11 +137,20 @@ class BagTask(QtCore.QObject):
         if self.task.canceled:
             return False
 
-        self.progress_update_signal.emit(current, maximum)
+        self.progress.update(current, maximum)
+        return True
+
+    def byte_progress_callback(self, done_bytes, total_bytes, done_files):
+        if self.task.canceled:
+            return False
+
+        self.progress.update(done_bytes, total_bytes, done_files, done_bytes)
         return True
 
 
 class BagCreateOrUpdateTask(BagTask):
+    executor = EXECUTOR_HASH
+    task_type = TASK_TYPE_CREATE
 
     def __init__(self, parent=None):
         super(BagCreateOrUpdateTask, self).__init__(parent)
@@ -47,15 +161,38 @@ class BagCreateOrUpdateTask(BagTask):
             "Bag %s error: %s" % ("update" if self.update else "creation", result)
         self.set_status(status, success)
 
-    def createOrUpdate(self, bag_path, update, config_file):
+    def createOrUpdate(self, bag_path, update, config_file, algorithms=None, workers=DEFAULT_HASH_WORKERS,
+                       cache_mode=DIGEST_CACHE_TRUST, engine=DEFAULT_HASH_ENGINE, diff=None):
         self.update = update
-        self.task = Task(bdb.make_bag,
-                         [bag_path, ['md5', 'sha256'], update, True, False, None, None, None, config_file],
-                         self.result_callback)
-        self.start()
+        self.task = self.create_task(bag_engine.make_bag,
+                                     [bag_path, algorithms, update, config_file, workers,
+                                      self.byte_progress_callback, cache_mode, engine, diff])
+        self.start(bag_path)
+
+
+class BagDiffTask(BagTask):
+    diff_ready_signal = pyqtSignal(object)
+    executor = EXECUTOR_DISK
+
+    def __init__(self, parent=None):
+        super(BagDiffTask, self).__init__(parent)
+
+    def result_callback(self, result, success):
+        status = "Payload comparison complete: %s." % result.summary() if success else \
+            "Payload comparison error: %s" % result
+        # the job is finished first, so an update started from the diff is not blocked by it
+        self.set_status(status, success)
+        if success:
+            self.diff_ready_signal.emit(result)
+
+    def diff(self, bag_path, cache_mode=DIGEST_CACHE_TRUST):
+        self.task = self.create_task(payload.diff_bag_payload, [bag_path, cache_mode])
+        self.start(bag_path)
 
 
 class BagRevertTask(BagTask):
+    executor = EXECUTOR_DISK
+    task_type = TASK_TYPE_REVERT
 
     def __init__(self, parent=None):
         super(BagRevertTask, self).__init__(parent)
@@ -64,30 +201,59 @@ class BagRevertTask(BagTask):
         status = "Bag reverted successfully." if success else "Bag reversion failed: %s" % result
         self.set_status(status, success)
 
+    def can_cancel(self):
+        # bdbag reverts a bag in place, so a revert stopped part way would leave neither a bag nor the directory
+        return False
+
     def revert(self, bag_path):
-        self.task = Task(bdb.revert_bag,
-                         [bag_path],
-                         self.result_callback)
-        self.start()
+        self.task = self.create_task(bdb.revert_bag, [bag_path])
+        self.start(bag_path)
 
 
 class BagValidateTask(BagTask):
+    executor = EXECUTOR_HASH
+    task_type = TASK_TYPE_VALIDATE
 
     def __init__(self, parent=None):
         super(BagValidateTask, self).__init__(parent)
+        self.kind = "validation"
 
     def result_callback(self, result, success):
-        status = "Bag validation complete." if success else "Bag validation error: %s" % result
+        if success:
+            status = "Bag %s complete: %s." % (self.kind, result) if result else "Bag %s complete." % self.kind
+        else:
+            status = "Bag %s error: %s" % (self.kind, result)
         self.set_status(status, success)
 
-    def validate(self, bag_path, fast, config_file):
-        self.task = Task(bdb.validate_bag,
-                         [bag_path, fast, self.progress_callback, config_file],
-                         self.result_callback)
-        self.start()
+    def validate(self, bag_path, fast, config_file, workers=DEFAULT_HASH_WORKERS, cache_mode=DIGEST_CACHE_RECOMPUTE,
+                 engine=DEFAULT_HASH_ENGINE, trust_days=DEFAULT_DIGEST_TRUST_DAYS,
+                 policy=bag_validate.DEFAULT_VALIDATION_POLICY, error_budget=bag_validate.DEFAULT_ERROR_BUDGET):
+        self.executor = EXECUTOR_DISK if fast else EXECUTOR_HASH
+        self.task = self.create_task(bag_validate.validate_bag,
+                                     [bag_path, fast,
+                                      self.progress_callback if fast else self.byte_progress_callback,
+                                      config_file, workers, cache_mode, engine, trust_days,
+                                      bag_validate.DEFAULT_REPORT_DIR, policy, error_budget])
+        self.start(bag_path)
+
+    def sample(self, bag_path, percent, budget_bytes, method, config_file, workers=DEFAULT_HASH_WORKERS,
+               cache_mode=DIGEST_CACHE_TRUST, engine=DEFAULT_HASH_ENGINE):
+        self.kind = "sample validation"
+        self.task = self.create_task(bag_validate.sample_bag,
+                                     [bag_path, percent, budget_bytes, method, None, self.byte_progress_callback,
+                                      config_file, workers, cache_mode, engine])
+        self.start(bag_path)
+
+    def validateArchive(self, archive_path, algorithms=None):
+        self.kind = "archive validation"
+        self.task = self.create_task(archive_validate.validate_archive,
+                                     [archive_path, self.byte_progress_callback, algorithms])
+        self.start(archive_path)
 
 
 class BagFetchTask(BagTask):
+    executor = EXECUTOR_NETWORK
+    task_type = TASK_TYPE_FETCH
 
     def __init__(self, parent=None):
         super(BagFetchTask, self).__init__(parent)
@@ -98,14 +264,17 @@ class BagFetchTask(BagTask):
             "Bag fetch error: %s" % result
         self.set_status(status, success)
 
-    def fetch(self, bag_path, fetch_all, keychain_file, config_file):
-        self.task = Task(bdb.resolve_fetch,
-                         [bag_path, fetch_all, self.progress_callback, keychain_file, config_file],
-                         self.result_callback)
-        self.start()
+    def fetch(self, bag_path, fetch_all, keychain_file, config_file, workers=DEFAULT_FETCH_WORKERS,
+              per_host=DEFAULT_FETCH_PER_HOST):
+        self.task = self.create_task(fetch_engine.fetch_bag,
+                                     [bag_path, fetch_all, self.byte_progress_callback, keychain_file, config_file,
+                                      workers, per_host])
+        self.start(bag_path)
 
 
 class BagArchiveTask(BagTask):
+    executor = EXECUTOR_DISK
+    task_type = TASK_TYPE_ARCHIVE
 
     def __init__(self, parent=None):
         super(BagArchiveTask, self).__init__(parent)
@@ -114,14 +283,21 @@ class BagArchiveTask(BagTask):
         status = "Bag archive complete." if success else "Bag archive error: %s" % result
         self.set_status(status, success)
 
+    def can_cancel(self):
+        # bdbag writes the archive without a callback to stop it, so only a worker process can be stopped
+        return self.backend == BACKEND_PROCESS
+
     def archive(self, bag_path, archiver):
-        self.task = Task(bdb.archive_bag,
-                         [bag_path, archiver],
-                         self.result_callback)
-        self.start()
+        bag_path = bag_path.rstrip(os.path.sep)
+        self.track_partial_output(
+            os.path.join(os.path.dirname(bag_path), '.'.join([os.path.basename(bag_path), archiver.lower()])))
+        self.task = self.create_task(bdb.archive_bag, [bag_path, archiver])
+        self.start(bag_path)
 
 
 class BagExtractTask(BagTask):
+    executor = EXECUTOR_DISK
+    task_type = TASK_TYPE_EXTRACT
 
     def __init__(self, parent=None):
         super(BagExtractTask, self).__init__(parent)
@@ -130,14 +306,19 @@ class BagExtractTask(BagTask):
         status = "File extraction complete." if success else "File extraction error: %s" % result
         self.set_status(status, success)
 
+    def can_cancel(self):
+        # as with archives, bdbag extracts every member without a callback to stop it
+        return self.backend == BACKEND_PROCESS
+
     def extract(self, bag_path, output_path=None):
-        self.task = Task(bdb.extract_bag,
-                         [bag_path, output_path],
-                         self.result_callback)
-        self.start()
+        self.track_partial_output(extraction_path(bag_path, output_path))
+        self.task = self.create_task(bdb.extract_bag, [bag_path, output_path])
+        self.start(bag_path)
 
 
 class BagMaterializeTask(BagTask):
+    executor = EXECUTOR_NETWORK
+    task_type = TASK_TYPE_MATERIALIZE
 
     def __init__(self, parent=None):
         super(BagMaterializeTask, self).__init__(parent)
@@ -147,7 +328,8 @@ class BagMaterializeTask(BagTask):
         self.set_status(status, success)
 
     def materialize(self, bag_path, output_path=None):
-        self.task = Task(bdb.materialize,
-                         [bag_path, output_path, self.progress_callback, self.progress_callback],
-                         self.result_callback)
-        self.start()
+        if os.path.isfile(bag_path):
+            self.track_partial_output(extraction_path(bag_path, output_path))
+        self.task = self.create_task(bdb.materialize,
+                                     [bag_path, output_path, self.progress_callback, self.progress_callback])
+        self.start(bag_path)
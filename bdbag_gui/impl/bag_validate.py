@@ -0,0 +1,323 @@
+import os
+import time
+import random
+import logging
+import threading
+
+from bdbag import bdbagit, bdbag_api as bdb
+from bdbag_gui.impl.bag_engine import hash_payload
+from bdbag_gui.impl.hashing import HashingInterruptedError, DEFAULT_HASH_WORKERS, DEFAULT_HASH_ENGINE
+from bdbag_gui.impl.digest_cache import DIGEST_CACHE_OFF, DIGEST_CACHE_RECOMPUTE, DEFAULT_DIGEST_TRUST_DAYS
+from bdbag_gui.impl.payload import scan_payload
+from bdbag_gui.impl.progress import format_bytes
+from bdbag_gui.impl.report import ValidationReport, DEFAULT_REPORT_DIR, REPORT_OK, REPORT_MISMATCH, REPORT_MISSING, \
+    REPORT_UNEXPECTED, REPORT_UNREADABLE
+from bdbag_gui.impl.sampling import SampleStore, SAMPLE_RANDOM, DEFAULT_SAMPLE_FILE, DEFAULT_SAMPLE_PERCENT, \
+    SAMPLE_STRATIFIED, DEFAULT_SAMPLE_CONFIDENCE, select_sample, detection_bound, new_seed
+
+MAX_REPORTED_ERRORS = 10
+SECONDS_PER_DAY = 24 * 60 * 60
+
+VALIDATION_POLICY_COMPLETE = "complete"
+VALIDATION_POLICY_FAIL_FAST = "fail_fast"
+VALIDATION_POLICY_BUDGET = "budget"
+VALIDATION_POLICIES = [VALIDATION_POLICY_COMPLETE, VALIDATION_POLICY_FAIL_FAST, VALIDATION_POLICY_BUDGET]
+DEFAULT_VALIDATION_POLICY = VALIDATION_POLICY_COMPLETE
+DEFAULT_ERROR_BUDGET = 100
+
+
+class PayloadOxumMismatch(object):
+
+    def __init__(self, expected, found):
+        self.expected = expected
+        self.found = found
+
+    def __str__(self):
+        return "Payload-Oxum validation failed: expected %s found %s" % (self.expected, self.found)
+
+
+class PayloadValidationError(bdbagit.BagValidationError):
+    # the message of a failed task ends up in the status bar, so only the first details are part of it; every one of
+    # them has already been logged
+
+    def __str__(self):
+        counts = dict()
+        for e in self.details:
+            counts[type(e).__name__] = counts.get(type(e).__name__, 0) + 1
+        summary = "%s: %s" % (self.message,
+                              ", ".join("%d %s" % (count, name) for name, count in sorted(counts.items())))
+        details = "; ".join(str(e) for e in self.details[:MAX_REPORTED_ERRORS])
+        if len(self.details) > MAX_REPORTED_ERRORS:
+            details += "; ... and %d more" % (len(self.details) - MAX_REPORTED_ERRORS)
+        return "%s -- %s" % (summary, details)
+
+
+def error_limit(policy, error_budget=DEFAULT_ERROR_BUDGET):
+    # the number of failures at which a validation stops, or None to run to completion
+    if policy == VALIDATION_POLICY_FAIL_FAST:
+        return 1
+    if policy == VALIDATION_POLICY_BUDGET:
+        return max(1, int(error_budget))
+    return None
+
+
+def failure_count(errors):
+    # a file failing the manifests of several algorithms is one failure
+    return len(set(getattr(e, "path", None) or str(e) for e in errors))
+
+
+def validate_entries(bag, workers=DEFAULT_HASH_WORKERS, callback=None, cache_mode=DIGEST_CACHE_OFF,
+                     engine=DEFAULT_HASH_ENGINE, skip=None, trust_days=DEFAULT_DIGEST_TRUST_DAYS, entries=None,
+                     report=None, max_failures=None):
+    # returns every checksum mismatch or unreadable file rather than stopping at the first one, checking all manifest
+    # entries or only the given (rel_path, hashes) entries; entries in skip (already reported as missing) are not
+    # read. Files whose stat signature is unchanged since they were last hashed, no more than trust_days ago, are
+    # verified against their cached checksums instead. The result of each file is added to report as it is known.
+    # With max_failures, the files not yet read are abandoned once that many files have failed.
+    entries = [(rel_path, hashes) for rel_path, hashes in (bag.entries.items() if entries is None else entries)
+               if not skip or rel_path not in skip]
+    files = [os.path.join(bag.path, bag.normalized_filesystem_names.get(rel_path, rel_path))
+             for rel_path, hashes in entries]
+    read_errors = dict()
+    failed = dict()
+    checked = [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def on_file(index, result, seconds):
+        # called from the hashing threads
+        rel_path, hashes = entries[index]
+        expected = dict((alg, digest.lower()) for alg, digest in hashes.items() if alg in bag.algorithms)
+        if result is None:
+            computed = "Could not read %s: %s" % (files[index], read_errors.get(index))
+            file_errors = [bdbagit.ChecksumMismatch(rel_path, alg, digest, computed)
+                           for alg, digest in expected.items()]
+            if report is not None:
+                report.add(rel_path, REPORT_UNREADABLE, expected=expected, error=str(read_errors.get(index)))
+        else:
+            actual = dict((alg, result[0].get(alg)) for alg in expected)
+            file_errors = [bdbagit.ChecksumMismatch(rel_path, alg, digest, actual[alg])
+                           for alg, digest in expected.items() if actual[alg] != digest]
+            if report is not None:
+                report.add(rel_path, REPORT_MISMATCH if file_errors else REPORT_OK, result[1], seconds, expected,
+                           actual, cached=seconds is None)
+        for e in file_errors:
+            logging.warning(str(e))
+        with lock:
+            checked[0] += 1
+            if file_errors:
+                failed[index] = file_errors
+                if max_failures is not None and len(failed) >= max_failures:
+                    stop.set()
+
+    start = time.monotonic()
+    total_bytes = 0
+    try:
+        results = hash_payload(files, bag.algorithms, workers, callback, cache_mode, read_errors, engine,
+                               max_age=trust_days * SECONDS_PER_DAY if trust_days else None, on_file=on_file,
+                               stop=stop)
+        total_bytes = sum(result[1] for result in results if result is not None)
+    except HashingInterruptedError:
+        if max_failures is None or len(failed) < max_failures:
+            raise bdbagit.BaggingInterruptedError("Bag validation interrupted!")
+        logging.warning("Stopped after %d failed files, %d of %d files were not checked." %
+                        (len(failed), len(files) - checked[0], len(files)))
+    if total_bytes:
+        elapsed = max(time.monotonic() - start, 1e-9)
+        logging.info("Verified %d files (%s) in %.1fs, %s/s" %
+                     (len(files), format_bytes(total_bytes), elapsed, format_bytes(total_bytes / elapsed)))
+    return [e for index in sorted(failed) for e in failed[index]]
+
+
+def validate_completeness(bag):
+    # missing and unexpected files are returned, so they can be reported together with the checksum mismatches of
+    # all other files
+    bag._validate_structure()
+    bag._validate_bagittxt()
+    bag._validate_fetch()
+    try:
+        bag._validate_completeness()
+    except bdbagit.BagValidationError as e:
+        return list(e.details)
+    return list()
+
+
+def validate_oxum(bag):
+    # compares the stat totals of the payload with Payload-Oxum before any file is read. Skipped for a bag with a
+    # fetch.txt, whose Payload-Oxum also counts the remote files.
+    expected = bag.info.get("Payload-Oxum")
+    if isinstance(expected, list):
+        expected = expected[0]
+    if not expected or list(bag.fetch_entries()):
+        return list()
+    files = scan_payload(os.path.join(bag.path, "data"))
+    found = "%d.%d" % (sum(stat.st_size for path, stat in files if stat is not None), len(files))
+    if expected.strip() == found:
+        return list()
+    e = PayloadOxumMismatch(expected.strip(), found)
+    logging.warning(str(e))
+    return [e]
+
+
+def report_completeness(report, errors):
+    if report is None:
+        return
+    for e in errors:
+        if isinstance(e, bdbagit.FileMissing):
+            report.add(e.path, REPORT_MISSING)
+        elif isinstance(e, bdbagit.UnexpectedFile):
+            report.add(e.path, REPORT_UNEXPECTED)
+
+
+def finish_report(report, start, error=None):
+    if report is not None:
+        report.close(error is None, time.monotonic() - start, None if error is None else str(error))
+
+
+def report_note(report):
+    return " (report: %s)" % report.path if report is not None else ""
+
+
+def validate_bag(bag_path, fast=False, callback=None, config_file=None, workers=DEFAULT_HASH_WORKERS,
+                 cache_mode=DIGEST_CACHE_OFF, engine=DEFAULT_HASH_ENGINE, trust_days=DEFAULT_DIGEST_TRUST_DAYS,
+                 report_dir=DEFAULT_REPORT_DIR, policy=DEFAULT_VALIDATION_POLICY, error_budget=DEFAULT_ERROR_BUDGET):
+    # fast validation only compares Payload-Oxum, which bdbag already does without reading any payload. A full
+    # validation checks for missing files and Payload-Oxum first, so unless the policy runs to completion an
+    # obviously broken bag fails before its payload is read.
+    if fast:
+        return bdb.validate_bag(bag_path, True, callback, config_file)
+
+    report = None
+    start = time.monotonic()
+    try:
+        logging.info("Validating bag: %s" % bag_path)
+        bag = bdbagit.BDBag(bag_path)
+        report = ValidationReport.create(bag_path, "full", report_dir) if report_dir else None
+        limit = error_limit(policy, error_budget)
+        errors = validate_completeness(bag)
+        report_completeness(report, errors)
+        if not errors:
+            # a missing or unexpected file already explains a Payload-Oxum mismatch
+            errors.extend(validate_oxum(bag))
+        if limit is not None and failure_count(errors) >= limit:
+            raise PayloadValidationError("Bag validation failed before reading the payload%s" % report_note(report),
+                                         errors)
+        missing = set(e.path for e in errors if isinstance(e, bdbagit.FileMissing))
+        errors.extend(validate_entries(bag, workers, callback, cache_mode, engine, missing, trust_days,
+                                       report=report,
+                                       max_failures=None if limit is None else limit - failure_count(errors)))
+        if limit is not None and failure_count(errors) >= limit:
+            raise PayloadValidationError("Bag validation stopped after %d failure%s%s" %
+                                         (limit, "" if limit == 1 else "s", report_note(report)), errors)
+        if errors:
+            raise PayloadValidationError("Bag validation failed%s" % report_note(report), errors)
+        logging.info("Bag %s is valid" % bag_path)
+        finish_report(report, start)
+        return "report saved to %s" % report.path if report is not None else None
+    except bdbagit.BagValidationError as e:
+        finish_report(report, start, e)
+        logging.warning("BagValidationError: A BagValidationError may be transient if the bag contains unresolved "
+                        "remote file references from a fetch.txt file. In this case the bag is incomplete but not "
+                        "necessarily invalid. Resolve remote file references (if any) and re-validate.")
+        raise e
+    except (bdbagit.BagError, bdbagit.BaggingInterruptedError) as e:
+        finish_report(report, start, e)
+        logging.warning(bdb.get_typed_exception(e))
+        raise e
+    except Exception as e:
+        finish_report(report, start, e)
+        raise RuntimeError("Unhandled exception while validating bag: %s" % e)
+
+
+def sample_bag(bag_path, percent=DEFAULT_SAMPLE_PERCENT, budget_bytes=0, method=SAMPLE_RANDOM, seed=None,
+               callback=None, config_file=None, workers=DEFAULT_HASH_WORKERS, cache_mode=DIGEST_CACHE_OFF,
+               engine=DEFAULT_HASH_ENGINE, sample_file=DEFAULT_SAMPLE_FILE, report_dir=DEFAULT_REPORT_DIR):
+    # verifies a size weighted sample of the payload, of percent of its bytes or of a fixed byte budget, plus every
+    # tag file, and returns a statement of what the sample covered. Sampled files are always read: a cached checksum
+    # proves nothing about the bytes on disk now.
+    report = None
+    start = time.monotonic()
+    try:
+        logging.info("Validating a sample of bag: %s" % bag_path)
+        bag = bdbagit.BDBag(bag_path)
+        report = ValidationReport.create(bag_path, "sample", report_dir) if report_dir else None
+        errors = validate_completeness(bag)
+        report_completeness(report, errors)
+        missing = set(e.path for e in errors if isinstance(e, bdbagit.FileMissing))
+
+        names = list()
+        sizes = list()
+        tag_entries = list()
+        for rel_path, hashes in bag.entries.items():
+            if rel_path in missing:
+                continue
+            if not rel_path.startswith("data/"):
+                tag_entries.append((rel_path, hashes))
+                continue
+            try:
+                size = os.stat(os.path.join(bag.path, bag.normalized_filesystem_names.get(rel_path, rel_path))).st_size
+            except OSError:
+                size = 0
+            names.append(rel_path)
+            sizes.append(size)
+        total_bytes = sum(sizes)
+        budget = budget_bytes or int(total_bytes * percent / 100.0)
+
+        seed = new_seed() if seed is None else seed
+        bag_key = os.path.abspath(bag_path)
+        with SampleStore(sample_file) as store:
+            cycle = store.cycle(bag_key)
+            selected, next_selected, draws = select_sample(names, sizes, budget, store.covered(bag_key, cycle),
+                                                            random.Random(seed), method)
+        coverage = [(names[index], cycle) for index in selected]
+        if next_selected is not None:
+            # every file has now been covered in this cycle, the rest of the sample counts towards the next one
+            cycle += 1
+            coverage.extend((names[index], cycle) for index in next_selected)
+            selected = selected + next_selected
+        sampled_bytes = sum(sizes[index] for index in selected)
+        logging.info("Sample seed %d (%s): %d of %d payload files, %s of %s" %
+                     (seed, method, len(selected), len(names), format_bytes(sampled_bytes), format_bytes(total_bytes)))
+
+        sampled = [(names[index], bag.entries[names[index]]) for index in selected]
+        errors.extend(validate_entries(bag, workers, callback,
+                                       DIGEST_CACHE_OFF if cache_mode == DIGEST_CACHE_OFF else DIGEST_CACHE_RECOMPUTE,
+                                       engine, entries=tag_entries + sampled, report=report))
+
+        with SampleStore(sample_file) as store:
+            store.record(bag_key, cycle, seed, method, coverage, sampled_bytes, len(names), total_bytes, len(errors))
+            covered = store.covered(bag_key, cycle)
+        covered_bytes = sum(size for name, size in zip(names, sizes) if name in covered)
+
+        statement = "verified %d of %d payload files (%s of %s, %.1f%%), seed %d" % (
+            len(selected), len(names), format_bytes(sampled_bytes), format_bytes(total_bytes),
+            100.0 * sampled_bytes / total_bytes if total_bytes else 100.0, seed)
+        if errors:
+            raise PayloadValidationError("Bag sample validation failed (%s)%s" % (statement, report_note(report)),
+                                         errors)
+        if draws:
+            statement += "; with %d%% confidence less than %.2f%% of the payload bytes are corrupt" % (
+                DEFAULT_SAMPLE_CONFIDENCE * 100, 100.0 * detection_bound(draws))
+        else:
+            # files chosen by earlier coverage or per size stratum are not drawn in proportion to their bytes, so the
+            # sample supports no confidence statement about the files it did not read
+            statement += "; %s, so this is coverage, not a confidence statement" % (
+                "the sample was stratified by file size" if method == SAMPLE_STRATIFIED else
+                "files not yet covered in this cycle were sampled first")
+        statement += "; %.1f%% of the payload covered in coverage cycle %d" % (
+            100.0 * covered_bytes / total_bytes if total_bytes else 100.0, cycle + 1)
+        if report is not None:
+            statement += "; report saved to %s" % report.path
+        logging.info("Bag %s sample is valid: %s" % (bag_path, statement))
+        finish_report(report, start)
+        return statement
+    except bdbagit.BagValidationError as e:
+        finish_report(report, start, e)
+        raise e
+    except (bdbagit.BagError, bdbagit.BaggingInterruptedError) as e:
+        finish_report(report, start, e)
+        logging.warning(bdb.get_typed_exception(e))
+        raise e
+    except Exception as e:
+        finish_report(report, start, e)
+        raise RuntimeError("Unhandled exception while validating bag sample: %s" % e)
@@ -0,0 +1,150 @@
+import os
+import time
+import errno
+import sqlite3
+import logging
+from bdbag.bdbag_config import DEFAULT_CONFIG_PATH
+
+DIGEST_CACHE_TRUST = "trust"
+DIGEST_CACHE_RECOMPUTE = "recompute"
+DIGEST_CACHE_OFF = "off"
+DIGEST_CACHE_MODES = [DIGEST_CACHE_TRUST, DIGEST_CACHE_RECOMPUTE, DIGEST_CACHE_OFF]
+
+DEFAULT_DIGEST_CACHE_FILE = os.path.join(DEFAULT_CONFIG_PATH, "bdbag_gui_digests.db")
+DEFAULT_DIGEST_CACHE_MAX_ENTRIES = 2000000
+# once full, the least recently used files are evicted until this fraction of the entries is left, so the next few
+# stores do not each evict again
+EVICT_TARGET = 0.9
+# files modified this close to the time they were hashed could change again within the same mtime tick
+RACY_WINDOW_NS = 2 * 10 ** 9
+# how long a cached checksum is trusted by validation before the file is read again; 0 trusts it indefinitely
+DEFAULT_DIGEST_TRUST_DAYS = 30
+LOOKUP_BATCH_SIZE = 500
+
+# an upper bound of the number of entries of each cache file, kept from one connection to the next so the table is
+# only counted again once it may be full. Entries added by another process are not included, which only delays their
+# eviction until the table is next counted.
+entry_counts = dict()
+
+
+def digest_key(stat):
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class DigestCache(object):
+
+    def __init__(self, path=DEFAULT_DIGEST_CACHE_FILE, max_entries=DEFAULT_DIGEST_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir, mode=0o750)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        # a connection per caller: jobs (and process backed tasks) share the file, sqlite serializes the writers
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS digests ("
+                                    "dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, "
+                                    "mtime_ns INTEGER NOT NULL, alg TEXT NOT NULL, digest TEXT NOT NULL, "
+                                    "last_used INTEGER NOT NULL, verified INTEGER NOT NULL, "
+                                    "PRIMARY KEY (dev, ino, size, mtime_ns, alg))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS digests_last_used ON digests (last_used)")
+        return self
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def lookup(self, keys, algorithms, max_age=None):
+        # returns a {alg: digest} dict for each key that has every requested algorithm cached, otherwise None; with a
+        # max_age (in seconds), only checksums computed from the file contents within that time are returned
+        results = [None] * len(keys)
+        hits = list()
+        verified_since = int(time.time()) - max_age if max_age else 0
+        cursor = self.connection.cursor()
+        for index, key in enumerate(keys):
+            if key is None:
+                continue
+            cursor.execute("SELECT alg, digest FROM digests WHERE dev=? AND ino=? AND size=? AND mtime_ns=? "
+                           "AND verified>=?", key + (verified_since,))
+            digests = dict(cursor.fetchall())
+            if all(alg in digests for alg in algorithms):
+                results[index] = dict((alg, digests[alg]) for alg in algorithms)
+                hits.append(key)
+        if hits:
+            now = int(time.time())
+            with self.connection:
+                for start in range(0, len(hits), LOOKUP_BATCH_SIZE):
+                    self.connection.executemany(
+                        "UPDATE digests SET last_used=? WHERE dev=? AND ino=? AND size=? AND mtime_ns=?",
+                        [(now,) + key for key in hits[start:start + LOOKUP_BATCH_SIZE]])
+        return results
+
+    def store(self, items, verified=None):
+        # items are checksums just computed from the file contents, verified (in seconds) when reading them began;
+        # checksums served by lookup are never stored again, so trusting them does not extend their verification
+        now = int(time.time())
+        verified = now if verified is None else min(int(verified), now)
+        rows = [key + (alg, digest, now, verified) for key, digests in items for alg, digest in digests.items()]
+        if not rows:
+            return
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO digests "
+                                        "(dev, ino, size, mtime_ns, alg, digest, last_used, verified) "
+                                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        # replaced rows are counted as added, which keeps the count an upper bound
+        entries = entry_counts.get(self.path)
+        if entries is None or entries + len(rows) > self.max_entries:
+            self.evict()
+        else:
+            entry_counts[self.path] = entries + len(rows)
+
+    def count(self):
+        entry_counts[self.path] = self.connection.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+        return entry_counts[self.path]
+
+    def evict(self):
+        entries = self.count()
+        if entries <= self.max_entries:
+            return
+        # every checksum of a file goes at once: a file missing one of its algorithms is a miss anyway
+        with self.connection:
+            self.connection.execute("DELETE FROM digests WHERE (dev, ino, size, mtime_ns) IN "
+                                    "(SELECT dev, ino, size, mtime_ns FROM digests ORDER BY last_used LIMIT ?)",
+                                    (entries - int(self.max_entries * EVICT_TARGET),))
+        self.count()
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM digests")
+        entry_counts[self.path] = 0
+        self.connection.execute("VACUUM")
+
+
+def open_digest_cache(mode, path=DEFAULT_DIGEST_CACHE_FILE, max_entries=DEFAULT_DIGEST_CACHE_MAX_ENTRIES):
+    if mode == DIGEST_CACHE_OFF:
+        return None
+    try:
+        return DigestCache(path, max_entries).open()
+    except (sqlite3.Error, OSError) as e:
+        logging.warning("Unable to open checksum cache [%s], continuing without it: %s" % (path, e))
+        return None
+
+
+def cacheable(key, hashed_ns):
+    return key is not None and key[3] < hashed_ns - RACY_WINDOW_NS
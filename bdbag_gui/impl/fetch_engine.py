@@ -0,0 +1,273 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bdbag import bdbagit, urlsplit, urlunquote, stob, get_typed_exception
+from bdbag.bdbag_config import read_config, DEFAULT_KEYCHAIN_FILE, FETCH_CONFIG_TAG, DEFAULT_FETCH_CONFIG, \
+    DEFAULT_FETCH_HTTP_SESSION_CONFIG
+from bdbag.fetch.fetcher import fetch_file, cleanup_fetchers
+from bdbag.fetch.auth.keychain import read_keychain, get_auth_entries
+from bdbag.fetch.auth.cookies import get_request_cookies
+from bdbag.fetch.transports.fetch_http import HEADERS
+from bdbag_gui.impl.hashing import HashProgress
+from bdbag_gui.impl.progress import format_bytes, format_duration
+
+DEFAULT_FETCH_WORKERS = 16
+MAX_FETCH_WORKERS = 256
+DEFAULT_FETCH_PER_HOST = 8
+FETCH_CHUNK_SIZE = 1024 * 1024
+# (connect, read) seconds; a stalled server fails the transfer rather than holding a worker forever
+FETCH_TIMEOUT = (30, 300)
+PARTIAL_SUFFIX = ".fetching"
+HTTP_SCHEMES = ("http", "https")
+
+
+class FetchInterruptedError(RuntimeError):
+    pass
+
+
+class FetchItem(object):
+
+    def __init__(self, output_path, size):
+        self.output_path = output_path
+        self.size = size
+        self.urls = list()
+
+
+def plan_fetch(bag, force=False):
+    # groups the fetch.txt entries by output file (a file listed more than once is tried from each URL in turn) and
+    # keeps the files to transfer: all of them if force, otherwise those absent or of the wrong size, as bdbag does
+    items = OrderedDict()
+    for url, length, filename in bag.fetch_entries():
+        output_path = os.path.normpath(os.path.join(bag.path, urlunquote(filename)))
+        item = items.get(output_path)
+        if item is None:
+            try:
+                size = int(length)
+            except ValueError:
+                size = None
+            item = items[output_path] = FetchItem(output_path, size)
+        item.urls.append(url)
+    if force:
+        return list(items.values())
+    missing = list()
+    for item in items.values():
+        try:
+            local_size = os.path.getsize(item.output_path)
+        except OSError:
+            local_size = None
+        if local_size is None or (item.size is not None and local_size != item.size):
+            missing.append(item)
+    return missing
+
+
+def host_key(url):
+    parts = urlsplit(url)
+    return "%s://%s" % (parts.scheme.lower(), parts.netloc.lower())
+
+
+def is_direct(item, keychain):
+    # plain HTTP(S) URLs of hosts without keychain credentials are transferred by the engine; identifiers, other
+    # schemes and authenticated hosts go through bdbag's own transports
+    return all(urlsplit(url).scheme.lower() in HTTP_SCHEMES and not get_auth_entries(url, keychain)
+               for url in item.urls)
+
+
+def bypass_cert_verify(config, url):
+    bypass = config.get("bypass_ssl_cert_verification", False)
+    if isinstance(bypass, bool):
+        return bypass
+    if isinstance(bypass, list):
+        return any(uri in url for uri in bypass)
+    return False
+
+
+def new_session(session_config, pool_size):
+    retries = Retry(connect=session_config["retry_connect"],
+                    read=session_config["retry_read"],
+                    backoff_factor=session_config["retry_backoff_factor"],
+                    status_forcelist=session_config["retry_status_forcelist"])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries, pool_block=True)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+class SessionPool(object):
+    # one keep-alive session per host, shared by the transfer threads: its urllib3 pool is thread safe and, sized to
+    # the per-host limit and blocking, caps the connections open to any one host
+
+    def __init__(self, fetch_config, cookies, per_host):
+        self.lock = threading.Lock()
+        self.sessions = dict()
+        self.fetch_config = fetch_config
+        self.cookies = cookies
+        self.per_host = per_host
+
+    def get(self, url):
+        scheme = urlsplit(url).scheme.lower()
+        config = self.fetch_config.get(scheme) or DEFAULT_FETCH_CONFIG[scheme]
+        host = host_key(url)
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.sessions[host] = new_session(
+                    config.get("session_config", DEFAULT_FETCH_HTTP_SESSION_CONFIG), self.per_host)
+        return session, {"cookies": self.cookies,
+                         "allow_redirects": stob(config.get("allow_redirects", True)),
+                         "verify": not bypass_cert_verify(config, url)}
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+def fetch_url(url, item, sessions, stop, progress):
+    # streams the file next to its output path and moves it into place once all of it has arrived, so a failed or
+    # interrupted transfer never leaves a truncated payload file behind
+    partial_path = item.output_path + PARTIAL_SUFFIX
+    received = 0
+    fetched = False
+    try:
+        session, options = sessions.get(url)
+        with session.get(url, stream=True, timeout=FETCH_TIMEOUT, **options) as response:
+            if response.status_code != 200:
+                logging.warning("File transfer failed: [%s] HTTP %s from %s" %
+                                (item.output_path, response.status_code, url))
+                return False
+            os.makedirs(os.path.dirname(item.output_path), exist_ok=True)
+            with open(partial_path, "wb") as output_file:
+                for chunk in response.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+                    output_file.write(chunk)
+                    received += len(chunk)
+                    if stop.is_set() or not progress.add(len(chunk)):
+                        stop.set()
+                        raise FetchInterruptedError("Fetch interrupted.")
+        if item.size is not None and received != item.size:
+            logging.warning("File transfer failed: [%s] expected %s bytes but received %s bytes from %s" %
+                            (item.output_path, item.size, received, url))
+            return False
+        os.replace(partial_path, item.output_path)
+        fetched = True
+        progress.add(files=1)
+        return True
+    except (requests.exceptions.RequestException, OSError) as e:
+        logging.warning("File transfer failed: [%s] %s" % (item.output_path, get_typed_exception(e)))
+        return False
+    finally:
+        if not fetched:
+            # the bytes of a failed attempt are taken back so that a retry from another URL is not counted twice
+            if received:
+                progress.add(-received)
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+
+
+def fetch_item(item, sessions, stop, progress):
+    for url in item.urls:
+        if stop.is_set():
+            raise FetchInterruptedError("Fetch interrupted.")
+        if fetch_url(url, item, sessions, stop, progress):
+            return True
+    return False
+
+
+def fetch_direct(items, fetch_config, cookies, progress, workers=DEFAULT_FETCH_WORKERS,
+                 per_host=DEFAULT_FETCH_PER_HOST):
+    # transfers at most workers files at a time, and at most per_host of them from any one host; the remaining files
+    # wait in a queue per host (rather than as futures), so a slow host never takes up every worker
+    workers = max(1, min(int(workers), MAX_FETCH_WORKERS))
+    per_host = max(1, min(int(per_host), workers))
+    queues = OrderedDict()
+    for item in items:
+        queues.setdefault(host_key(item.urls[0]), deque()).append(item)
+    active = dict()
+    pending = dict()
+    success = True
+    stop = threading.Event()
+    sessions = SessionPool(fetch_config, cookies, per_host)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while queues or pending:
+                    for host in list(queues):
+                        queue = queues[host]
+                        while queue and active.get(host, 0) < per_host and len(pending) < workers:
+                            pending[executor.submit(fetch_item, queue.popleft(), sessions, stop, progress)] = host
+                            active[host] = active.get(host, 0) + 1
+                        if not queue:
+                            del queues[host]
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        active[pending.pop(future)] -= 1
+                        success = future.result() and success
+            except BaseException:
+                stop.set()
+                raise
+    finally:
+        sessions.close()
+    return success
+
+
+def fetch_delegated(items, config, keychain, progress):
+    fetchers = dict()
+    success = True
+    try:
+        for item in items:
+            fetched = any(fetch_file(url, item.output_path, config, keychain, fetchers, size=item.size)
+                          for url in item.urls)
+            success = fetched and success
+            if not progress.add((item.size or 0) if fetched else 0, files=1 if fetched else 0, force=True):
+                raise FetchInterruptedError("Fetch interrupted.")
+    finally:
+        cleanup_fetchers(fetchers)
+    return success
+
+
+def fetch_bag(bag_path, force=False, callback=None, keychain_file=DEFAULT_KEYCHAIN_FILE, config_file=None,
+              workers=DEFAULT_FETCH_WORKERS, per_host=DEFAULT_FETCH_PER_HOST):
+    # stands in for bdbag's resolve_fetch and, like it, returns True if every remote file was transferred. callback
+    # is called with (done bytes, total bytes, done files), where the total counts the files of known size.
+    bag = bdbagit.BDBag(bag_path)
+    items = plan_fetch(bag, force)
+    if not items:
+        return True
+    keychain = read_keychain(keychain_file)
+    config = read_config(config_file)
+    direct = list()
+    delegated = list()
+    for item in items:
+        (direct if is_direct(item, keychain) else delegated).append(item)
+    total_bytes = sum(item.size or 0 for item in items)
+    progress = HashProgress(total_bytes, callback)
+    logging.info("Attempting to fetch %d remote file(s) (%s) from %s: %d over HTTP(S) with up to %d transfers "
+                 "(%d per host), %d through the bdbag fetch transports." %
+                 (len(items), format_bytes(total_bytes), os.path.join(bag_path, "fetch.txt"), len(direct),
+                  workers, per_host, len(delegated)))
+    start = time.monotonic()
+    try:
+        success = True
+        if direct:
+            success = fetch_direct(direct, config.get(FETCH_CONFIG_TAG) or DEFAULT_FETCH_CONFIG,
+                                   get_request_cookies(config), progress, workers, per_host)
+        if delegated:
+            success = fetch_delegated(delegated, config, keychain, progress) and success
+        progress.finish()
+    except FetchInterruptedError:
+        logging.warning("Fetch cancelled by user...")
+        return False
+    logging.info("Fetch complete: %d of %d file(s), %s in %s." %
+                 (progress.done_files, len(items), format_bytes(progress.done_bytes),
+                  format_duration(time.monotonic() - start)))
+    return success
@@ -0,0 +1,374 @@
+import os
+import time
+import mmap
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+HASH_BLOCK_SIZE = 1024 * 1024
+LARGE_HASH_BLOCK_SIZE = 8 * 1024 * 1024
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+MAX_HASH_WORKERS = 64
+DEFAULT_PROGRESS_INTERVAL = 0.05
+
+HASH_ENGINE_READ = "read"
+HASH_ENGINE_READINTO = "readinto"
+HASH_ENGINE_MMAP = "mmap"
+HASH_ENGINES = [HASH_ENGINE_READ, HASH_ENGINE_READINTO, HASH_ENGINE_MMAP]
+DEFAULT_HASH_ENGINE = HASH_ENGINE_READ
+# pages already hashed are dropped from the page cache in windows of this size
+FADVISE_WINDOW = 64 * 1024 * 1024
+# mapping a file costs more than reading it below this size
+MIN_MMAP_SIZE = 4 * 1024 * 1024
+
+# files up to this size are read with a single system call and hashed in batches
+SMALL_FILE_SIZE = 64 * 1024
+SMALL_FILE_BATCH_FILES = 512
+SMALL_FILE_BATCH_BYTES = 8 * 1024 * 1024
+
+DEFAULT_ENGINE_BENCHMARK_SIZES = [1024, 1024 * 1024, 64 * 1024 * 1024, 1024 * 1024 * 1024]
+DEFAULT_ENGINE_BENCHMARK_BYTES = 64 * 1024 * 1024
+
+buffers = threading.local()
+
+
+class HashingInterruptedError(RuntimeError):
+    pass
+
+
+class HashProgress(object):
+
+    def __init__(self, total_bytes, callback=None, interval=DEFAULT_PROGRESS_INTERVAL):
+        self.lock = threading.Lock()
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        self.done_files = 0
+        self.callback = callback
+        self.interval = interval
+        self.last_report = 0.0
+        self.canceled = False
+
+    def add(self, nbytes=0, files=0, force=False):
+        # called from every hashing thread; reports are rate limited so millions of small files (or a process
+        # backend pipe) are not flooded with callbacks
+        with self.lock:
+            self.done_bytes += nbytes
+            self.done_files += files
+            now = time.monotonic()
+            if self.callback is None or (not force and now - self.last_report < self.interval):
+                return not self.canceled
+            self.last_report = now
+            if self.callback(self.done_bytes, self.total_bytes, self.done_files) is False:
+                self.canceled = True
+            return not self.canceled
+
+    def finish(self):
+        return self.add(force=True)
+
+
+def fadvise(fd, offset, length, advice):
+    # posix_fadvise is only a hint and is not available on every platform
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass
+
+
+def get_buffer(size):
+    # each hashing thread reuses one buffer of a given size for every file it reads
+    pool = getattr(buffers, "pool", None)
+    if pool is None:
+        pool = buffers.pool = dict()
+    buffer = pool.get(size)
+    if buffer is None:
+        buffer = pool[size] = bytearray(size)
+    return buffer
+
+
+def hash_stream(f, hashers, block_size, on_block, name=None):
+    # feeds every block of an open file object (such as an archive member) to every digest
+    nbytes = 0
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        for hasher in hashers:
+            hasher.update(block)
+        nbytes += len(block)
+        if on_block is not None and not on_block(len(block)):
+            raise HashingInterruptedError("Hashing interrupted: %s" % name)
+    return nbytes
+
+
+def hash_file_read(path, hashers, block_size, on_block):
+    with open(path, "rb") as f:
+        return hash_stream(f, hashers, block_size, on_block, path)
+
+
+def hash_file_readinto(path, hashers, block_size, on_block):
+    # reads into a pooled buffer and feeds the same memory to every digest, without copying any block; pages already
+    # hashed are dropped so hashing a huge file does not push everything else out of the page cache
+    view = memoryview(get_buffer(block_size))
+    nbytes = 0
+    dropped = 0
+    with open(path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        fadvise(fd, 0, 0, getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+        try:
+            while True:
+                count = f.readinto(view)
+                if not count:
+                    break
+                with view[:count] as block:
+                    for hasher in hashers:
+                        hasher.update(block)
+                nbytes += count
+                if nbytes - dropped >= FADVISE_WINDOW:
+                    fadvise(fd, dropped, nbytes - dropped, getattr(os, "POSIX_FADV_DONTNEED", 0))
+                    dropped = nbytes
+                if on_block is not None and not on_block(count):
+                    raise HashingInterruptedError("Hashing interrupted: %s" % path)
+        finally:
+            fadvise(fd, dropped, 0, getattr(os, "POSIX_FADV_DONTNEED", 0))
+    return nbytes
+
+
+def hash_file_mmap(path, hashers, block_size, on_block):
+    # NOTE: a mapped file that is truncated while it is hashed faults the whole process, so this engine is opt-in
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        if size < MIN_MMAP_SIZE:
+            return hash_file_readinto(path, hashers, block_size, on_block)
+        fadvise(fd, 0, 0, getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            dropped = 0
+            try:
+                for offset in range(0, size, block_size):
+                    with view[offset:offset + block_size] as block:
+                        for hasher in hashers:
+                            hasher.update(block)
+                        count = len(block)
+                    done = offset + count
+                    if done - dropped >= FADVISE_WINDOW:
+                        if hasattr(mapped, "madvise"):
+                            mapped.madvise(mmap.MADV_DONTNEED, dropped, done - dropped)
+                        fadvise(fd, dropped, done - dropped, getattr(os, "POSIX_FADV_DONTNEED", 0))
+                        dropped = done
+                    if on_block is not None and not on_block(count):
+                        raise HashingInterruptedError("Hashing interrupted: %s" % path)
+            finally:
+                view.release()
+        fadvise(fd, dropped, 0, getattr(os, "POSIX_FADV_DONTNEED", 0))
+    return size
+
+
+HASH_ENGINE_METHODS = {
+    HASH_ENGINE_READ: hash_file_read,
+    HASH_ENGINE_READINTO: hash_file_readinto,
+    HASH_ENGINE_MMAP: hash_file_mmap
+}
+
+
+def engine_block_size(engine):
+    return HASH_BLOCK_SIZE if engine == HASH_ENGINE_READ else LARGE_HASH_BLOCK_SIZE
+
+
+def hash_file(path, algorithms, block_size=HASH_BLOCK_SIZE, on_block=None, engine=DEFAULT_HASH_ENGINE):
+    # a single read pass feeds every requested digest
+    hashers = [(alg, hashlib.new(alg)) for alg in algorithms]
+    method = HASH_ENGINE_METHODS.get(engine, hash_file_read)
+    nbytes = method(path, [hasher for alg, hasher in hashers], block_size, on_block)
+    return dict((alg, hasher.hexdigest()) for alg, hasher in hashers), nbytes
+
+
+def hash_small_file(path, algorithms, size):
+    # reads the whole file into the pooled buffer, normally with one read call (and without the fstat and buffering
+    # set up by open()); a file that grew past SMALL_FILE_SIZE since it was stat'ed is hashed the regular way
+    view = memoryview(get_buffer(SMALL_FILE_SIZE + 1))
+    count = 0
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        while count < len(view):
+            if hasattr(os, "readv"):
+                nbytes = os.readv(fd, [view[count:]])
+            else:
+                data = os.read(fd, len(view) - count)
+                nbytes = len(data)
+                view[count:count + nbytes] = data
+            count += nbytes
+            if not nbytes or count >= size:
+                break
+    finally:
+        os.close(fd)
+    if count >= len(view):
+        return hash_file(path, algorithms)
+    digests = dict()
+    with view[:count] as block:
+        for alg in algorithms:
+            hasher = hashlib.new(alg)
+            hasher.update(block)
+            digests[alg] = hasher.hexdigest()
+    return digests, count
+
+
+def plan_batches(stats):
+    # larger files are hashed one per unit of work, largest first, so the pool does not end on a single big file while
+    # every other worker is idle; small files follow, grouped into batches in inode order, which on most filesystems
+    # follows their on-disk layout and saves seeks on spinning disks
+    small = sorted((index for index, stat in enumerate(stats)
+                    if stat is not None and stat.st_size <= SMALL_FILE_SIZE), key=lambda index: stats[index].st_ino)
+    small_set = set(small)
+    units = [([index], False) for index in sorted((index for index in range(len(stats)) if index not in small_set),
+                                                  key=lambda index: -stats[index].st_size if stats[index] else 0)]
+    batch = list()
+    batch_bytes = 0
+    for index in small:
+        batch.append(index)
+        batch_bytes += stats[index].st_size
+        if len(batch) >= SMALL_FILE_BATCH_FILES or batch_bytes >= SMALL_FILE_BATCH_BYTES:
+            units.append((batch, True))
+            batch = list()
+            batch_bytes = 0
+    if batch:
+        units.append((batch, True))
+    return units
+
+
+def hash_files(paths, algorithms, workers=DEFAULT_HASH_WORKERS, progress=None, block_size=None, errors=None,
+                engine=DEFAULT_HASH_ENGINE, stats=None, on_file=None, stop=None):
+    # returns a list of (digests, nbytes) in the same order as paths; if an errors dict is given, files that cannot
+    # be read are recorded there by index (with a None result) instead of failing the whole run. If the stat of each
+    # path is given, small files take the batched fast path and progress is reported once per batch. on_file is
+    # called from the hashing threads with (index, result, seconds) as each file is done. Setting the stop event (from
+    # on_file, say) abandons the files not yet done and raises HashingInterruptedError.
+    results = [None] * len(paths)
+    stop = stop if stop is not None else threading.Event()
+    block_size = block_size or engine_block_size(engine)
+
+    def on_block(nbytes):
+        if stop.is_set():
+            return False
+        return progress.add(nbytes) if progress is not None else True
+
+    def run_file(index):
+        start = time.perf_counter()
+        try:
+            results[index] = hash_file(paths[index], algorithms, block_size, on_block, engine)
+        except (OSError, IOError) as e:
+            if errors is None:
+                raise
+            errors[index] = e
+        if on_file is not None:
+            on_file(index, results[index], time.perf_counter() - start)
+        return 0
+
+    def run_small_file(index):
+        start = time.perf_counter()
+        nbytes = 0
+        try:
+            results[index] = hash_small_file(paths[index], algorithms, stats[index].st_size)
+            nbytes = results[index][1]
+        except (OSError, IOError) as e:
+            if errors is None:
+                raise
+            errors[index] = e
+        if on_file is not None:
+            on_file(index, results[index], time.perf_counter() - start)
+        return nbytes
+
+    def run(unit):
+        indices, small = unit
+        nbytes = 0
+        for index in indices:
+            # checked before each file of a batch too, which would otherwise read up to SMALL_FILE_BATCH_FILES files
+            if stop.is_set():
+                raise HashingInterruptedError("Hashing interrupted.")
+            nbytes += (run_small_file if small else run_file)(index)
+        if progress is not None and not progress.add(nbytes, files=len(indices)):
+            raise HashingInterruptedError("Hashing interrupted.")
+
+    units = plan_batches(stats) if stats is not None else [([index], False) for index in range(len(paths))]
+
+    workers = max(1, min(int(workers), MAX_HASH_WORKERS))
+    if workers == 1 or len(units) <= 1:
+        for unit in units:
+            run(unit)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # hashlib releases the GIL for large buffers, so threads scale across cores; the window of pending
+            # futures is bounded so payloads with millions of files do not queue millions of futures
+            pending = set()
+            try:
+                for unit in units:
+                    if len(pending) >= workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(executor.submit(run, unit))
+                for future in pending:
+                    future.result()
+            except BaseException:
+                stop.set()
+                raise
+    if progress is not None:
+        progress.finish()
+    return results
+
+
+def write_benchmark_files(directory, size, count):
+    block = os.urandom(min(size, HASH_BLOCK_SIZE))
+    paths = list()
+    for index in range(count):
+        path = os.path.join(directory, "%d-%d.bin" % (size, index))
+        with open(path, "wb") as f:
+            remaining = size
+            while remaining > 0:
+                remaining -= f.write(block[:remaining])
+            f.flush()
+            os.fsync(f.fileno())
+        paths.append(path)
+    return paths
+
+
+def drop_cached_pages(paths):
+    # clean pages can be dropped, so every engine reads the benchmark files from storage rather than from memory
+    for path in paths:
+        with open(path, "rb") as f:
+            fadvise(f.fileno(), 0, 0, getattr(os, "POSIX_FADV_DONTNEED", 0))
+
+
+def benchmark_engines(directory=None, sizes=None, engines=None, algorithms=None,
+                      total_bytes=DEFAULT_ENGINE_BENCHMARK_BYTES, max_files=4096, callback=None):
+    # returns {size: {engine: bytes per second}}; files of each size are written to directory, so the storage the
+    # payload lives on is measured, and about total_bytes of them (at least one file) are hashed with every engine
+    sizes = list(sizes or DEFAULT_ENGINE_BENCHMARK_SIZES)
+    engines = list(engines or HASH_ENGINES)
+    algorithms = list(algorithms or ["md5", "sha256"])
+    work_dir = tempfile.mkdtemp(prefix="bdbag-gui-benchmark-", dir=directory)
+    results = dict()
+    step = 0
+    try:
+        for size in sizes:
+            paths = write_benchmark_files(work_dir, size, max(1, min(max_files, total_bytes // size)))
+            results[size] = dict()
+            for engine in engines:
+                if callback is not None and not callback(step, len(sizes) * len(engines)):
+                    raise HashingInterruptedError("Benchmark interrupted.")
+                step += 1
+                drop_cached_pages(paths)
+                start = time.perf_counter()
+                for path in paths:
+                    hash_file(path, algorithms, engine_block_size(engine), engine=engine)
+                results[size][engine] = size * len(paths) / max(time.perf_counter() - start, 1e-9)
+            for path in paths:
+                os.remove(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
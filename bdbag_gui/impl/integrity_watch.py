@@ -0,0 +1,395 @@
+import os
+import time
+import logging
+from PyQt5.QtCore import QObject, QThread, QFileSystemWatcher, QTimer, pyqtSignal, pyqtSlot
+
+from bdbag import urlunquote, bdbagit
+from bdbag_gui.impl.async_task import Task, async_execute, EXECUTOR_WATCH
+from bdbag_gui.impl.hashing import hash_file
+from bdbag_gui.impl.payload import scan_payload, normalize_name, payload_algorithms
+
+# inotify watches are a per-user resource (8192 on many systems), so payload files beyond this many are only swept
+DEFAULT_MAX_WATCHED_PATHS = 8192
+DEFAULT_SETTLE_DELAY_MS = 2000
+DEFAULT_SWEEP_INTERVAL_MS = 15 * 60 * 1000
+# one digest is enough to notice drift, the strongest commonly present one is used
+WATCH_ALGORITHMS = ["sha256", "sha512", "sha1", "md5"]
+
+DRIFT_MISMATCH = "checksum mismatch"
+DRIFT_MISSING = "missing"
+DRIFT_UNEXPECTED = "not in manifest"
+DRIFT_UNREADABLE = "unreadable"
+
+
+class BagWatch(object):
+    # the manifest and the last seen stat of every payload file of a watched bag. Only the check task in flight for
+    # the bag (there is at most one) changes it.
+
+    def __init__(self, path):
+        self.path = path
+        self.data_dir = os.path.join(path, "data")
+        self.algorithm = None
+        self.manifest = dict()
+        self.remote = set()
+        self.tag_files = list()
+        self.dirs = set()
+        self.snapshot = dict()
+        self.drift = dict()
+
+    def name(self, path):
+        return normalize_name("/".join(["data"] + os.path.relpath(path, self.data_dir).split(os.path.sep)))
+
+
+class CheckResult(object):
+
+    def __init__(self, watch, previous_drift):
+        self.watch = watch
+        self.previous_drift = previous_drift
+        # paths to watch: new directories, and every checked file (Qt drops the watch of a removed or replaced file)
+        self.added = list()
+        self.removed = list()
+        # files modified too recently to hash, checked again once they have settled
+        self.unsettled = list()
+
+    def new_drift(self):
+        return dict((name, reason) for name, reason in self.watch.drift.items()
+                    if self.previous_drift.get(name) != reason)
+
+    def cleared(self):
+        return sorted(name for name in self.previous_drift if name not in self.watch.drift)
+
+
+def stat_key(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_watch(bag_path):
+    watch = BagWatch(bag_path)
+    bag = bdbagit.BDBag(bag_path)
+    algorithms = payload_algorithms(bag)
+    watch.algorithm = next((alg for alg in WATCH_ALGORITHMS if alg in algorithms),
+                           algorithms[0] if algorithms else None)
+    watch.manifest = dict((normalize_name(name), digests.get(watch.algorithm))
+                          for name, digests in bag.payload_entries().items())
+    watch.remote = set(normalize_name(urlunquote(filename)) for url, size, filename in bag.fetch_entries())
+    watch.tag_files = [os.path.join(bag_path, name) for name in os.listdir(bag_path)
+                       if os.path.isfile(os.path.join(bag_path, name))]
+    dirs = dict()
+    for path, stat in scan_payload(watch.data_dir, dirs):
+        if stat is not None:
+            watch.snapshot[path] = stat_key(stat)
+    watch.dirs = set(dirs)
+    # drift that can be seen without reading any file
+    present = set(watch.name(path) for path in watch.snapshot)
+    for name in present:
+        if name not in watch.manifest:
+            watch.drift[name] = DRIFT_UNEXPECTED
+    for name in watch.manifest:
+        if name not in present and name not in watch.remote:
+            watch.drift[name] = DRIFT_MISSING
+    return watch
+
+
+def check_file(watch, path, canceled):
+    name = watch.name(path)
+    expected = watch.manifest.get(name)
+    if expected is None:
+        return DRIFT_UNEXPECTED if name not in watch.manifest else None
+    try:
+        digests, nbytes = hash_file(path, [watch.algorithm], on_block=lambda nbytes: not canceled())
+    except OSError as e:
+        return "%s: %s" % (DRIFT_UNREADABLE, e)
+    return DRIFT_MISMATCH if digests[watch.algorithm] != expected else None
+
+
+def check_watch(watch, dirty_dirs, dirty_files, reload, settle_ns, canceled):
+    # rehashes the touched files of a bag against its manifest. Listing the changed directories finds added and
+    # removed files; a file whose size and modification time did not change since it was last seen is not read.
+    if reload:
+        # the tag files changed (the bag was updated), so nothing known about the payload can be trusted
+        result = CheckResult(load_watch(watch.path), watch.drift)
+        result.added = [watch.path] + sorted(result.watch.dirs) + result.watch.tag_files + \
+            sorted(result.watch.snapshot)
+        return result
+    result = CheckResult(watch, dict(watch.drift))
+    touched = set(dirty_files)
+    for directory in sorted(dirty_dirs):
+        if directory not in watch.dirs:
+            continue
+        try:
+            listing = set(entry.path for entry in os.scandir(directory))
+        except OSError:
+            listing = set()
+        for path in [path for path in watch.dirs if os.path.dirname(path) == directory and path not in listing]:
+            prefix = os.path.join(path, "")
+            gone = [p for p in watch.dirs if p == path or p.startswith(prefix)]
+            watch.dirs.difference_update(gone)
+            result.removed.extend(gone)
+            for file_path in [p for p in watch.snapshot if p.startswith(prefix)]:
+                result.removed.append(file_path)
+                touched.add(file_path)
+        for path in [p for p in watch.snapshot if os.path.dirname(p) == directory and p not in listing]:
+            touched.add(path)
+        for path in listing:
+            if path in watch.snapshot or path in watch.dirs:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                dirs = dict()
+                for file_path, stat in scan_payload(path, dirs):
+                    touched.add(file_path)
+                watch.dirs.update(dirs)
+                result.added.extend(sorted(dirs))
+            else:
+                touched.add(path)
+
+    now = time.time_ns()
+    for path in sorted(touched):
+        if canceled():
+            result.unsettled.append(path)
+            continue
+        name = watch.name(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if path in watch.snapshot:
+                del watch.snapshot[path]
+                result.removed.append(path)
+            if name in watch.manifest and name not in watch.remote:
+                watch.drift[name] = DRIFT_MISSING
+            else:
+                watch.drift.pop(name, None)
+            continue
+        key = stat_key(stat)
+        result.added.append(path)
+        if watch.snapshot.get(path) == key:
+            continue
+        if now - stat.st_mtime_ns < settle_ns:
+            result.unsettled.append(path)
+            continue
+        drift = check_file(watch, path, canceled)
+        try:
+            if stat_key(os.stat(path)) != key:
+                # modified while it was read
+                result.unsettled.append(path)
+                continue
+        except OSError:
+            continue
+        watch.snapshot[path] = key
+        if drift:
+            watch.drift[name] = drift
+        else:
+            watch.drift.pop(name, None)
+    return result
+
+
+class WatchTask(Task):
+
+    def __init__(self, bag_path, method, args, callback):
+        super(WatchTask, self).__init__(method, args, callback)
+        self.bag_path = bag_path
+
+    def run(self):
+        # the watch executor has threads of its own, so they can be left at idle priority (SCHED_IDLE on Linux,
+        # which also puts their reads in the idle I/O class)
+        QThread.currentThread().setPriority(QThread.IdlePriority)
+        super(WatchTask, self).run()
+
+    def execute(self):
+        # the bag travels with the result, failures included, since the callback is shared by every watched bag
+        try:
+            return self.bag_path, self.method(*self.args, canceled=lambda: self.canceled), None
+        except Exception as e:
+            return self.bag_path, None, str(e)
+
+
+class WatchedBag(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.watch = None
+        self.task = None
+        self.dirty_dirs = set()
+        self.dirty_files = set()
+        self.reload = True
+
+
+class IntegrityWatcher(QObject):
+    drift_detected_signal = pyqtSignal(str, object)
+    drift_cleared_signal = pyqtSignal(str, object)
+    watch_failed_signal = pyqtSignal(str, str)
+
+    def __init__(self, is_busy=None, max_paths=DEFAULT_MAX_WATCHED_PATHS, settle_delay=DEFAULT_SETTLE_DELAY_MS,
+                 sweep_interval=DEFAULT_SWEEP_INTERVAL_MS, parent=None):
+        super(IntegrityWatcher, self).__init__(parent)
+        # checks of a bag are held back while is_busy(path) says a job is working on it
+        self.is_busy = is_busy or (lambda path: False)
+        self.max_paths = max_paths
+        self.bags = dict()
+        self.owners = dict()
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.onDirectoryChanged)
+        self.watcher.fileChanged.connect(self.onFileChanged)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(settle_delay)
+        self.timer.timeout.connect(self.dispatch)
+        self.sweepTimer = QTimer(self)
+        self.sweepTimer.setInterval(sweep_interval)
+        self.sweepTimer.timeout.connect(self.sweep)
+
+    def watched(self):
+        return sorted(self.bags)
+
+    def is_watched(self, path):
+        return os.path.normpath(path) in self.bags
+
+    def watch(self, path):
+        path = os.path.normpath(path)
+        if path in self.bags:
+            return
+        self.bags[path] = WatchedBag(path)
+        self.dispatch()
+        if not self.sweepTimer.isActive():
+            self.sweepTimer.start()
+
+    def unwatch(self, path):
+        path = os.path.normpath(path)
+        bag = self.bags.pop(path, None)
+        if bag is None:
+            return
+        if bag.task is not None:
+            bag.task.cancel()
+        self.removeWatches(path)
+        if not self.bags:
+            self.sweepTimer.stop()
+
+    def reload(self, path):
+        for bag in self.bags.values():
+            if bag.path == path or bag.path.startswith(os.path.join(path, "")) or \
+                    path.startswith(os.path.join(bag.path, "")):
+                bag.reload = True
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.sweepTimer.stop()
+        for bag in self.bags.values():
+            if bag.task is not None:
+                bag.task.cancel()
+        self.bags = dict()
+
+    def addWatches(self, bag_path, paths):
+        # Qt refuses paths it still watches, so paths already owned are simply added again
+        owned = [path for path in paths if self.owners.get(path) == bag_path]
+        new = [path for path in paths if path not in self.owners]
+        available = max(0, self.max_paths - len(self.owners))
+        if len(new) > available:
+            logging.info("Watching %d of %d new paths of [%s], the others are checked every %d minutes." %
+                         (available, len(new), bag_path, self.sweepTimer.interval() // 60000))
+            new = new[:available]
+        if not owned and not new:
+            return
+        failed = set(self.watcher.addPaths(owned + new))
+        for path in new:
+            if path not in failed:
+                self.owners[path] = bag_path
+
+    def removeWatches(self, bag_path, paths=None):
+        if paths is None:
+            paths = [path for path, owner in self.owners.items() if owner == bag_path]
+        paths = [path for path in set(paths) if self.owners.get(path) == bag_path]
+        for path in paths:
+            del self.owners[path]
+        if paths:
+            self.watcher.removePaths(paths)
+
+    @pyqtSlot(str)
+    def onDirectoryChanged(self, path):
+        bag = self.bags.get(self.owners.get(path))
+        if bag is None:
+            return
+        if path == bag.path:
+            # tag files replaced, or the payload directory itself added or removed
+            bag.reload = True
+        else:
+            bag.dirty_dirs.add(path)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    @pyqtSlot(str)
+    def onFileChanged(self, path):
+        bag = self.bags.get(self.owners.get(path))
+        if bag is None:
+            return
+        if os.path.dirname(path) == bag.path:
+            bag.reload = True
+        else:
+            bag.dirty_files.add(path)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    @pyqtSlot()
+    def sweep(self):
+        # payload files beyond the watch limit are only noticed by comparing their stat
+        for bag in self.bags.values():
+            if bag.watch is not None and bag.task is None:
+                bag.dirty_files.update(path for path in bag.watch.snapshot if path not in self.owners)
+        self.dispatch()
+
+    @pyqtSlot()
+    def dispatch(self):
+        deferred = False
+        for bag in self.bags.values():
+            if bag.task is not None or not (bag.reload or bag.dirty_dirs or bag.dirty_files):
+                continue
+            if self.is_busy(bag.path):
+                deferred = True
+                continue
+            watch = bag.watch or BagWatch(bag.path)
+            bag.task = WatchTask(bag.path, check_watch,
+                                 [watch, bag.dirty_dirs, bag.dirty_files, bag.reload or bag.watch is None,
+                                  self.timer.interval() * 1000000],
+                                 self.onChecked)
+            bag.dirty_dirs = set()
+            bag.dirty_files = set()
+            bag.reload = False
+            async_execute(bag.task, EXECUTOR_WATCH)
+        if deferred and not self.timer.isActive():
+            self.timer.start()
+
+    @pyqtSlot(object, bool)
+    def onChecked(self, result, success):
+        if not success:
+            # canceled, and the bag is no longer watched
+            return
+        path, result, error = result
+        bag = self.bags.get(path)
+        if bag is None:
+            return
+        bag.task = None
+        if error is not None:
+            if bag.watch is None:
+                # the bag could not be loaded at all, so there is nothing to watch
+                self.unwatch(bag.path)
+                self.watch_failed_signal.emit(bag.path, error)
+            else:
+                logging.warning("Integrity check of [%s] failed: %s" % (bag.path, error))
+                bag.reload = True
+                self.timer.start()
+            return
+        if result.watch is not bag.watch:
+            self.removeWatches(bag.path)
+            bag.watch = result.watch
+        self.removeWatches(bag.path, result.removed)
+        self.addWatches(bag.path, result.added)
+        if result.unsettled:
+            bag.dirty_files.update(result.unsettled)
+            self.timer.start()
+        cleared = result.cleared()
+        if cleared:
+            self.drift_cleared_signal.emit(bag.path, cleared)
+        drift = result.new_drift()
+        if drift:
+            self.drift_detected_signal.emit(bag.path, drift)
+        if bag.reload or bag.dirty_dirs or bag.dirty_files:
+            self.timer.start()
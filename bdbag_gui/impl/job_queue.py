@@ -0,0 +1,194 @@
+import os
+import time
+from collections import deque
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+from bdbag_gui.impl.async_task import wait_for_executors
+
+JOB_QUEUED = "Queued"
+JOB_RUNNING = "Running"
+JOB_CANCELING = "Canceling"
+JOB_COMPLETED = "Completed"
+JOB_FAILED = "Failed"
+JOB_CANCELED = "Canceled"
+
+ACTIVE_JOB_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_CANCELING)
+
+DEFAULT_MAX_CONCURRENT_JOBS = 4
+
+
+class Job(object):
+
+    def __init__(self, job_id, task, description, path=None):
+        self.id = job_id
+        self.task = task
+        self.description = description
+        self.path = path
+        self.state = JOB_QUEUED
+        self.current = 0
+        self.maximum = 0
+        self.items_per_second = 0.0
+        self.bytes_per_second = -1.0
+        self.result = None
+        self.success = None
+        self.started = None
+        self.finished = None
+        self.total_bytes = None
+        self.estimate = None
+
+    def is_active(self):
+        return self.state in ACTIVE_JOB_STATES
+
+    def can_cancel(self):
+        # a queued job can always be canceled, a running one only if its task can stop part way
+        return self.state == JOB_QUEUED or (self.state == JOB_RUNNING and self.task.can_cancel())
+
+    def percent(self):
+        if self.maximum <= 0:
+            return 100 if self.state == JOB_COMPLETED else 0
+        return min(100, int(self.current * 100 / self.maximum))
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def eta(self):
+        # the remaining time at the average rate since the job started, which is refined with every progress update;
+        # until the first update, what is left of the pre-flight estimate
+        if self.started is None or self.finished is not None:
+            return None
+        if self.maximum > 0 and self.current > 0:
+            return self.elapsed() * (self.maximum - self.current) / self.current
+        if self.estimate is not None:
+            return max(0.0, self.estimate - self.elapsed())
+        return None
+
+    def overlaps(self, path):
+        if not self.path or not path:
+            return False
+        job_path = os.path.join(self.path, "")
+        other_path = os.path.join(path, "")
+        return job_path.startswith(other_path) or other_path.startswith(job_path)
+
+
+class JobQueue(QObject):
+    job_added_signal = pyqtSignal(object)
+    job_updated_signal = pyqtSignal(object)
+    job_finished_signal = pyqtSignal(object)
+    job_removed_signal = pyqtSignal(object)
+
+    def __init__(self, max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS, parent=None):
+        super(JobQueue, self).__init__(parent)
+        self.jobs = list()
+        self.pending = deque()
+        self.running = list()
+        self.task_jobs = dict()
+        self.next_job_id = 1
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+
+    def set_max_concurrent_jobs(self, max_concurrent_jobs):
+        self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        self.dispatch()
+
+    def submit(self, task, description, path=None):
+        job = Job(self.next_job_id, task, description, path)
+        self.next_job_id += 1
+        self.jobs.append(job)
+        self.task_jobs[task] = job
+        task.job_queue = self
+        task.status_update_signal.connect(self.onTaskStatus)
+        task.progress_update_signal.connect(self.onTaskProgress)
+        task.throughput_update_signal.connect(self.onTaskThroughput)
+        self.job_added_signal.emit(job)
+        return job
+
+    def schedule(self, task):
+        job = self.task_jobs.get(task)
+        if job is None or job.state != JOB_QUEUED:
+            return
+        self.pending.append(job)
+        self.dispatch()
+
+    def dispatch(self):
+        while self.pending and len(self.running) < self.max_concurrent_jobs:
+            job = self.pending.popleft()
+            job.state = JOB_RUNNING
+            job.started = time.monotonic()
+            self.running.append(job)
+            job.task.run()
+            self.job_updated_signal.emit(job)
+
+    def cancel(self, job):
+        if job.state == JOB_QUEUED:
+            if job in self.pending:
+                self.pending.remove(job)
+            self.finish(job, "Job canceled before it was started.", False)
+        elif job.state == JOB_RUNNING and job.task.can_cancel():
+            job.state = JOB_CANCELING
+            job.task.cancel()
+            self.job_updated_signal.emit(job)
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            self.cancel(job)
+
+    def finish(self, job, result, success):
+        if job.task.task is not None and job.task.task.canceled:
+            job.state = JOB_CANCELED
+        elif job.state == JOB_QUEUED and not success:
+            job.state = JOB_CANCELED
+        else:
+            job.state = JOB_COMPLETED if success else JOB_FAILED
+        job.result = result
+        job.success = success
+        if job.started is not None:
+            job.finished = time.monotonic()
+        if job in self.running:
+            self.running.remove(job)
+        self.task_jobs.pop(job.task, None)
+        self.job_finished_signal.emit(job)
+        self.dispatch()
+
+    def remove(self, job):
+        if job.is_active() or job not in self.jobs:
+            return
+        self.jobs.remove(job)
+        self.job_removed_signal.emit(job)
+
+    def clear_finished(self):
+        for job in list(self.jobs):
+            self.remove(job)
+
+    def active_jobs(self):
+        return [job for job in self.jobs if job.is_active()]
+
+    def active_job_for_path(self, path):
+        for job in self.active_jobs():
+            if job.overlaps(path):
+                return job
+        return None
+
+    def wait_for_done(self, msecs=-1):
+        return wait_for_executors(msecs)
+
+    @pyqtSlot(str, bool)
+    def onTaskStatus(self, status, success):
+        job = self.task_jobs.get(self.sender())
+        if job is not None:
+            self.finish(job, status, success)
+
+    @pyqtSlot(int, int)
+    def onTaskProgress(self, current, maximum):
+        job = self.task_jobs.get(self.sender())
+        if job is not None:
+            job.current = current
+            job.maximum = maximum
+            self.job_updated_signal.emit(job)
+
+    @pyqtSlot(float, float)
+    def onTaskThroughput(self, items_per_second, bytes_per_second):
+        job = self.task_jobs.get(self.sender())
+        if job is not None:
+            job.items_per_second = items_per_second
+            job.bytes_per_second = bytes_per_second
@@ -0,0 +1,249 @@
+import os
+import glob
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from bdbag import urlunquote, bdbagit
+from bdbag_gui.impl.progress import format_bytes
+from bdbag_gui.impl.digest_cache import open_digest_cache, digest_key, DIGEST_CACHE_TRUST, DIGEST_CACHE_OFF, \
+    RACY_WINDOW_NS
+
+PAYLOAD_ADDED = "added"
+PAYLOAD_CHANGED = "changed"
+PAYLOAD_UNCHANGED = "unchanged"
+PAYLOAD_REMOVED = "removed"
+MAX_DIFF_DETAILS = 1000
+
+DEFAULT_SCAN_CACHE_SIZE = 16
+# file lists of larger scans are not kept, only their totals
+MAX_CACHED_SCAN_FILES = 1000000
+
+scan_cache = OrderedDict()
+scan_lock = threading.Lock()
+
+
+def scan_payload(root, dirs=None):
+    # a scandir walk in the same order as bagit's own payload walk (os.walk with sorted names), so manifests match
+    # those written by bdbag; the stat of each file is returned along with it so hashing or a diff does not need a
+    # second stat pass. Directory symlinks are not followed, just like os.walk.
+    files = list()
+    try:
+        if dirs is not None:
+            # recorded before listing, so an entry added while the directory is read still invalidates the scan
+            dirs[root] = os.stat(root).st_mtime_ns
+        entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    except OSError as e:
+        logging.warning("Unable to scan directory %s: %s" % (root, e))
+        return files
+    subdirs = list()
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if not entry.is_symlink():
+                subdirs.append(entry.path)
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            stat = None
+        files.append((entry.path, stat))
+    for subdir in subdirs:
+        files.extend(scan_payload(subdir, dirs))
+    return files
+
+
+class PayloadScan(object):
+
+    def __init__(self, path, files, dirs):
+        self.path = path
+        self.total_files = len(files)
+        self.total_bytes = sum(stat.st_size for file_path, stat in files if stat is not None)
+        # only the paths are kept: the stat results would be stale by the time a task reuses the scan
+        self.files = [file_path for file_path, stat in files] if len(files) <= MAX_CACHED_SCAN_FILES else None
+        self.dirs = dirs
+
+    def is_current(self):
+        # adding, removing or renaming an entry changes the mtime of its directory, and stating every directory
+        # again is much cheaper than walking every file
+        for path, mtime_ns in self.dirs.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def files_under(self, root):
+        if root == self.path:
+            return list(self.files)
+        prefix = os.path.join(root, "")
+        return [path for path in self.files if path.startswith(prefix)]
+
+
+def preflight_scan(path):
+    # walks path ahead of a task, returning (total files, total bytes); the file list is cached for the task to reuse
+    path = os.path.abspath(path)
+    dirs = dict()
+    scan = PayloadScan(path, scan_payload(path, dirs), dirs)
+    logging.info("Pre-flight scan of %s: %d files, %s" % (path, scan.total_files, format_bytes(scan.total_bytes)))
+    if scan.files is not None:
+        with scan_lock:
+            scan_cache[path] = scan
+            scan_cache.move_to_end(path)
+            while len(scan_cache) > DEFAULT_SCAN_CACHE_SIZE:
+                scan_cache.popitem(last=False)
+    return scan.total_files, scan.total_bytes
+
+
+def cached_payload_files(root):
+    # returns the file paths under root from a pre-flight scan of root or of one of its parents, in scan_payload
+    # order, or None if there is no such scan or the tree changed since
+    root = os.path.abspath(root)
+    with scan_lock:
+        scans = [scan for path, scan in scan_cache.items()
+                 if root == path or root.startswith(os.path.join(path, ""))]
+    for scan in reversed(scans):
+        if scan.is_current():
+            return scan.files_under(root)
+        with scan_lock:
+            if scan_cache.get(scan.path) is scan:
+                del scan_cache[scan.path]
+    return None
+
+
+def normalize_name(name):
+    return unicodedata.normalize("NFC", os.path.normpath(name))
+
+
+def payload_algorithms(bag):
+    # bag.algorithms also lists the algorithms of tag manifests, which may have no payload manifest
+    return [alg for alg in bag.algorithms if os.path.isfile(os.path.join(bag.path, "manifest-%s.txt" % alg))]
+
+
+def manifest_times(bag_path):
+    # manifests are rewritten on every create or update, so the oldest of them bounds when the payload was last hashed.
+    # Returns the oldest (mtime, ctime) in ns, or (None, None) if there are no manifests.
+    stats = list()
+    for manifest in glob.glob(os.path.join(bag_path, "manifest-*.txt")):
+        try:
+            stats.append(os.stat(manifest))
+        except OSError:
+            pass
+    if not stats:
+        return None, None
+    return min(stat.st_mtime_ns for stat in stats), min(stat.st_ctime_ns for stat in stats)
+
+
+class PayloadDiff(object):
+
+    def __init__(self, bag_path):
+        self.bag_path = bag_path
+        self.files = list()
+        self.removed = list()
+        self.previous_bytes = None
+        self.scanned_ns = None
+        self.reference_ns = None
+        self.reference_ctime_ns = None
+        self.algorithms = list()
+
+    def add(self, name, path, size, state):
+        self.files.append((name, path, size, state))
+
+    def count(self, state):
+        return sum(1 for name, path, size, file_state in self.files if file_state == state)
+
+    def bytes(self, state):
+        return sum(size for name, path, size, file_state in self.files if file_state == state)
+
+    def pending(self):
+        return [(name, path) for name, path, size, state in self.files if state != PAYLOAD_UNCHANGED]
+
+    def total_bytes(self):
+        return sum(size for name, path, size, state in self.files)
+
+    def is_empty(self):
+        return not self.removed and not self.pending()
+
+    def details(self, limit=MAX_DIFF_DETAILS):
+        changes = [(state, name) for name, path, size, state in self.files if state != PAYLOAD_UNCHANGED] + \
+            [(PAYLOAD_REMOVED, name) for name in self.removed]
+        lines = ["%s: %s" % (state.capitalize(), name) for state, name in changes[:limit]]
+        if len(changes) > limit:
+            lines.append("... and %d more" % (len(changes) - limit))
+        return lines
+
+    def summary(self):
+        summary = "%d added (%s), %d changed (%s), %d removed, %d unchanged" % (
+            self.count(PAYLOAD_ADDED), format_bytes(self.bytes(PAYLOAD_ADDED)),
+            self.count(PAYLOAD_CHANGED), format_bytes(self.bytes(PAYLOAD_CHANGED)),
+            len(self.removed), self.count(PAYLOAD_UNCHANGED))
+        if self.previous_bytes is not None:
+            summary += "; payload size %s -> %s" % (format_bytes(self.previous_bytes),
+                                                   format_bytes(self.total_bytes()))
+        return summary
+
+
+def diff_payload(bag, cache_mode=DIGEST_CACHE_OFF):
+    # compares the payload on disk with the manifests using stat information only. A file is changed if the digest
+    # cache holds checksums for its current identity that disagree with the manifests, or otherwise if it was modified
+    # after the manifests were written. The mtime of a file can be set back (cp -p, rsync -t), its ctime cannot, so a
+    # file whose inode changed after the manifests were written is changed too. Files still listed in fetch.txt are
+    # remote, not removed.
+    diff = PayloadDiff(bag.path)
+    diff.scanned_ns = time.time_ns()
+    diff.algorithms = list(bag.algorithms)
+    data_dir = os.path.join(bag.path, "data")
+    manifest_entries = dict((normalize_name(name), digests) for name, digests in bag.payload_entries().items())
+    remote_names = set(normalize_name(urlunquote(filename)) for url, size, filename in bag.fetch_entries())
+    try:
+        diff.previous_bytes = int(bag.info.get("Payload-Oxum", "").split(".")[0])
+    except ValueError:
+        pass
+
+    files = scan_payload(data_dir)
+    keys = [digest_key(stat) if stat is not None else None for path, stat in files]
+    cached = [None] * len(files)
+    cache = open_digest_cache(cache_mode) if cache_mode == DIGEST_CACHE_TRUST else None
+    if cache is not None:
+        try:
+            cached = cache.lookup(keys, payload_algorithms(bag))
+        finally:
+            cache.close()
+
+    reference_ns, reference_ctime_ns = diff.reference_ns, diff.reference_ctime_ns = manifest_times(bag.path)
+    local_names = set()
+    for (path, stat), key, cached_digests in zip(files, keys, cached):
+        name = "/".join(["data"] + os.path.relpath(path, data_dir).split(os.path.sep))
+        normalized = normalize_name(name)
+        local_names.add(normalized)
+        size = stat.st_size if stat is not None else 0
+        digests = manifest_entries.get(normalized)
+        if digests is None:
+            state = PAYLOAD_ADDED
+        elif key is None or reference_ns is None:
+            state = PAYLOAD_CHANGED
+        elif cached_digests is not None:
+            state = PAYLOAD_UNCHANGED if all(cached_digests.get(alg) == digest.lower()
+                                             for alg, digest in digests.items()) else PAYLOAD_CHANGED
+        elif key[3] >= reference_ns - RACY_WINDOW_NS or stat.st_ctime_ns >= reference_ctime_ns - RACY_WINDOW_NS:
+            state = PAYLOAD_CHANGED
+        else:
+            state = PAYLOAD_UNCHANGED
+        diff.add(name, path, size, state)
+
+    diff.removed = sorted(name for name in manifest_entries if name not in local_names and name not in remote_names)
+    return diff
+
+
+def diff_bag_payload(bag_path, cache_mode=DIGEST_CACHE_OFF):
+    bag_path = os.path.abspath(bag_path)
+    logging.info("Comparing payload of bag %s with its manifests" % bag_path)
+    diff = diff_payload(bdbagit.BDBag(bag_path), cache_mode)
+    logging.info("Payload changes: %s" % diff.summary())
+    return diff
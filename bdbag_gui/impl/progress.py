@@ -0,0 +1,97 @@
+import time
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+DEFAULT_FLUSH_INTERVAL_MS = 50
+MAX_PROGRESS_VALUE = 2 ** 31 - 1
+RATE_SMOOTHING = 0.3
+BYTE_UNITS = ["B", "KB", "MB", "GB", "TB", "PB"]
+
+
+def format_bytes(value):
+    value = float(value)
+    for unit in BYTE_UNITS:
+        if abs(value) < 1024.0 or unit == BYTE_UNITS[-1]:
+            return "%.1f %s" % (value, unit) if unit != "B" else "%d %s" % (value, unit)
+        value /= 1024.0
+
+
+def format_rate(items_per_second, bytes_per_second=-1):
+    rate = "%.1f items/s" % items_per_second
+    if bytes_per_second >= 0:
+        rate += ", %s/s" % format_bytes(bytes_per_second)
+    return rate
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "%ds" % seconds
+    if seconds < 3600:
+        return "%dm %02ds" % (seconds // 60, seconds % 60)
+    if seconds < 86400:
+        return "%dh %02dm" % (seconds // 3600, seconds % 3600 // 60)
+    return "%dd %02dh" % (seconds // 86400, seconds % 86400 // 3600)
+
+
+class ProgressAggregator(QObject):
+    progress_signal = pyqtSignal(int, int)
+    throughput_signal = pyqtSignal(float, float)
+
+    def __init__(self, interval=DEFAULT_FLUSH_INTERVAL_MS, parent=None):
+        super(ProgressAggregator, self).__init__(parent)
+        self.latest = None
+        self.flushed = None
+        self.sample = None
+        self.items_per_second = 0.0
+        self.bytes_per_second = -1.0
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def update(self, current, maximum, items=None, nbytes=None):
+        # Called from worker threads. Replacing a single reference is atomic under the GIL, so the worker never
+        # waits on the GUI thread and intermediate values are simply overwritten until the next flush.
+        self.latest = (current, maximum, current if items is None else items, nbytes)
+
+    def start(self):
+        self.latest = self.flushed = self.sample = None
+        self.items_per_second = 0.0
+        self.bytes_per_second = -1.0
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.flush()
+
+    def update_rates(self, items, nbytes):
+        now = time.monotonic()
+        if self.sample is None:
+            self.sample = (now, items, nbytes)
+            return
+        elapsed = now - self.sample[0]
+        if elapsed <= 0:
+            return
+        items_rate = max(0.0, (items - self.sample[1]) / elapsed)
+        self.items_per_second += RATE_SMOOTHING * (items_rate - self.items_per_second)
+        if nbytes is not None and self.sample[2] is not None:
+            bytes_rate = max(0.0, (nbytes - self.sample[2]) / elapsed)
+            if self.bytes_per_second < 0:
+                self.bytes_per_second = bytes_rate
+            else:
+                self.bytes_per_second += RATE_SMOOTHING * (bytes_rate - self.bytes_per_second)
+        self.sample = (now, items, nbytes)
+
+    @pyqtSlot()
+    def flush(self):
+        latest = self.latest
+        if latest is None or latest is self.flushed:
+            return
+        self.flushed = latest
+        current, maximum, items, nbytes = latest
+        self.update_rates(items, nbytes)
+        # QProgressBar is limited to 32-bit values, so byte counts of large payloads are scaled down
+        if maximum > MAX_PROGRESS_VALUE:
+            scale = float(maximum) / MAX_PROGRESS_VALUE
+            current, maximum = int(current / scale), MAX_PROGRESS_VALUE
+        self.throughput_signal.emit(self.items_per_second, self.bytes_per_second)
+        self.progress_signal.emit(int(current), int(maximum))
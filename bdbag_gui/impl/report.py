@@ -0,0 +1,125 @@
+import os
+import re
+import glob
+import json
+import time
+import logging
+import threading
+from bdbag.bdbag_config import DEFAULT_CONFIG_PATH
+
+DEFAULT_REPORT_DIR = os.path.join(DEFAULT_CONFIG_PATH, "bdbag_gui_reports")
+DEFAULT_REPORT_KEEP = 100
+MAX_REPORT_NAME_ATTEMPTS = 100
+
+REPORT_OK = "ok"
+REPORT_MISMATCH = "mismatch"
+REPORT_MISSING = "missing"
+REPORT_UNEXPECTED = "unexpected"
+REPORT_UNREADABLE = "unreadable"
+
+RECORD_RUN = "run"
+RECORD_FILE = "file"
+RECORD_SUMMARY = "summary"
+
+
+class ValidationReport(object):
+    # a JSON Lines file: a run record, one record per file written as soon as the file is checked (from any hashing
+    # thread), and a summary record once the run is over. A report without a summary is from an interrupted run.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.counts = dict()
+        self.file = None
+
+    @staticmethod
+    def create(bag_path, mode, report_dir=DEFAULT_REPORT_DIR, keep=DEFAULT_REPORT_KEEP):
+        try:
+            os.makedirs(report_dir, exist_ok=True)
+            prune_reports(report_dir, keep - 1)
+            name = "%s-%s-%s-%d" % (re.sub(r"[^\w.-]", "_", os.path.basename(os.path.normpath(bag_path))) or "bag",
+                                    mode, time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+            # runs started within the same second (of bags with the same name) each get a report of their own
+            for attempt in range(MAX_REPORT_NAME_ATTEMPTS):
+                report = ValidationReport(os.path.join(report_dir, "%s%s.jsonl" % (
+                    name, "-%d" % attempt if attempt else "")))
+                try:
+                    report.file = open(report.path, "x", encoding="utf-8")
+                    break
+                except FileExistsError:
+                    if attempt == MAX_REPORT_NAME_ATTEMPTS - 1:
+                        raise
+        except OSError as e:
+            logging.warning("Unable to create a validation report in %s, continuing without it: %s" % (report_dir, e))
+            return None
+        report.write({"type": RECORD_RUN, "bag": os.path.abspath(bag_path), "mode": mode, "started": time.time()})
+        return report
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+
+    def add(self, path, status, size=None, seconds=None, expected=None, actual=None, error=None, cached=False):
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+        record = {"type": RECORD_FILE, "path": path, "status": status, "size": size}
+        if seconds is not None:
+            record["seconds"] = round(seconds, 6)
+            if size and seconds > 0:
+                record["throughput"] = round(size / seconds)
+        if expected:
+            record["expected"] = expected
+        if actual:
+            record["actual"] = actual
+        if error:
+            record["error"] = error
+        if cached:
+            record["cached"] = True
+        self.write(record)
+
+    def close(self, success, seconds, message=None):
+        self.write({"type": RECORD_SUMMARY, "success": success, "seconds": round(seconds, 3),
+                    "counts": dict(self.counts), "message": message})
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        logging.info("Validation report written to %s" % self.path)
+
+
+def prune_reports(report_dir, keep):
+    reports = sorted(glob.glob(os.path.join(report_dir, "*.jsonl")), key=os.path.getmtime, reverse=True)
+    for path in reports[max(0, keep):]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.debug("Unable to remove old validation report %s: %s" % (path, e))
+
+
+def latest_report(report_dir=DEFAULT_REPORT_DIR):
+    reports = glob.glob(os.path.join(report_dir, "*.jsonl"))
+    return max(reports, key=os.path.getmtime) if reports else None
+
+
+def load_report(path):
+    # returns (run record, file records, summary record or None); a truncated last line (of a report still being
+    # written) is skipped
+    run = None
+    files = list()
+    summary = None
+    with open(path, encoding="utf-8") as report_file:
+        for line in report_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            record_type = record.get("type")
+            if record_type == RECORD_FILE:
+                files.append(record)
+            elif record_type == RECORD_RUN:
+                run = record
+            elif record_type == RECORD_SUMMARY:
+                summary = record
+    return run, files, summary
@@ -0,0 +1,154 @@
+import os
+import math
+import time
+import errno
+import random
+import sqlite3
+from bdbag.bdbag_config import DEFAULT_CONFIG_PATH
+
+SAMPLE_RANDOM = "random"
+SAMPLE_STRATIFIED = "stratified"
+SAMPLE_METHODS = [SAMPLE_RANDOM, SAMPLE_STRATIFIED]
+
+DEFAULT_SAMPLE_FILE = os.path.join(DEFAULT_CONFIG_PATH, "bdbag_gui_samples.db")
+DEFAULT_SAMPLE_PERCENT = 5.0
+DEFAULT_SAMPLE_CONFIDENCE = 0.95
+# strata of the stratified method span a factor of 16 in file size each (up to 16 bytes, up to 256 bytes, ...)
+STRATUM_SIZE_BITS = 4
+MIN_RANDOM = 1e-300
+
+
+class SampleStore(object):
+    # the sample runs of every bag, and which payload files they have covered in the current coverage cycle. Once
+    # every file of a bag has been covered a new cycle starts, so repeated runs rotate through the whole payload.
+
+    def __init__(self, path=DEFAULT_SAMPLE_FILE):
+        self.path = path
+        self.connection = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        store_dir = os.path.dirname(self.path)
+        if store_dir and not os.path.isdir(store_dir):
+            try:
+                os.makedirs(store_dir, mode=0o750)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS samples ("
+                                    "id INTEGER PRIMARY KEY AUTOINCREMENT, bag TEXT NOT NULL, cycle INTEGER NOT NULL, "
+                                    "seed INTEGER NOT NULL, method TEXT NOT NULL, started INTEGER NOT NULL, "
+                                    "files INTEGER NOT NULL, bytes INTEGER NOT NULL, total_files INTEGER NOT NULL, "
+                                    "total_bytes INTEGER NOT NULL, errors INTEGER NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS coverage ("
+                                    "bag TEXT NOT NULL, name TEXT NOT NULL, cycle INTEGER NOT NULL, "
+                                    "sample INTEGER NOT NULL, PRIMARY KEY (bag, name))")
+        return self
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def cycle(self, bag):
+        row = self.connection.execute("SELECT MAX(cycle) FROM samples WHERE bag=?", (bag,)).fetchone()
+        return row[0] if row[0] is not None else 0
+
+    def covered(self, bag, cycle):
+        return set(row[0] for row in self.connection.execute("SELECT name FROM coverage WHERE bag=? AND cycle=?",
+                                                             (bag, cycle)))
+
+    def record(self, bag, cycle, seed, method, coverage, nbytes, total_files, total_bytes, errors):
+        # coverage is a list of (name, cycle) for every sampled payload file
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO samples (bag, cycle, seed, method, started, files, bytes, total_files, total_bytes, "
+                "errors) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (bag, cycle, seed, method, int(time.time()), len(coverage), nbytes, total_files, total_bytes, errors))
+            self.connection.executemany("INSERT OR REPLACE INTO coverage (bag, name, cycle, sample) "
+                                        "VALUES (?, ?, ?, ?)",
+                                        [(bag, name, name_cycle, cursor.lastrowid) for name, name_cycle in coverage])
+        return cursor.lastrowid
+
+
+def weighted_pick(indices, sizes, budget, rng, at_least_one=True):
+    # size weighted sampling without replacement (Efraimidis-Spirakis keys, as logarithms so huge weights keep their
+    # precision); files that would overrun the budget are passed over for smaller ones rather than ending the sample,
+    # but unless told otherwise the sample has at least one file. Returns (picked, draws): the first draws picks,
+    # made before any file was passed over, are successive size weighted draws.
+    keyed = sorted(indices, key=lambda index: math.log(rng.random() or MIN_RANDOM) / (sizes[index] + 1),
+                   reverse=True)
+    picked = list()
+    draws = None
+    total = 0
+    for index in keyed:
+        if total >= budget:
+            break
+        if (picked or not at_least_one) and total + sizes[index] > budget:
+            if draws is None:
+                draws = len(picked)
+            continue
+        picked.append(index)
+        total += sizes[index]
+    return picked, len(picked) if draws is None else draws
+
+
+def stratum(size):
+    return int(math.log2(size + 1)) // STRATUM_SIZE_BITS
+
+
+def pick(indices, sizes, budget, rng, method=SAMPLE_RANDOM, at_least_one=True):
+    # returns (picked, draws) as weighted_pick does; a stratified sample makes no size weighted draws, since every
+    # stratum gets a pick of its own whatever its share of the bytes
+    if not indices or budget <= 0:
+        return list(), 0
+    if method != SAMPLE_STRATIFIED:
+        return weighted_pick(indices, sizes, budget, rng, at_least_one)
+    # each size class gets its share of the budget, so many small files are sampled even next to a few huge ones
+    strata = dict()
+    for index in indices:
+        strata.setdefault(stratum(sizes[index]), list()).append(index)
+    total_bytes = sum(sizes[index] for index in indices) or 1
+    picked = list()
+    for key in sorted(strata):
+        members = strata[key]
+        share = budget * sum(sizes[index] for index in members) / total_bytes
+        picked.extend(weighted_pick(members, sizes, share, rng, at_least_one)[0])
+    return picked, 0
+
+
+def select_sample(names, sizes, budget, covered, rng, method=SAMPLE_RANDOM):
+    # returns (indices, next_indices, draws): files not yet covered in this cycle are sampled first, and once they all
+    # fit into the budget they are all taken, and what is left of the budget is sampled as the start of the next
+    # cycle. draws counts the size weighted draws from the whole payload, which is only the case for a random sample
+    # at the start of a cycle: any other sample is chosen by what earlier runs covered, not by chance.
+    pool = [index for index, name in enumerate(names) if name not in covered]
+    pool_bytes = sum(sizes[index] for index in pool)
+    if pool and pool_bytes > budget:
+        picked, draws = pick(pool, sizes, budget, rng, method)
+        return picked, None, draws if len(pool) == len(names) else 0
+    selected = set(pool)
+    picked, draws = pick([index for index in range(len(names)) if index not in selected], sizes,
+                         budget - pool_bytes, rng, method, at_least_one=False)
+    return pool, picked, 0
+
+
+def detection_bound(draws, confidence=DEFAULT_SAMPLE_CONFIDENCE):
+    # with draws successive size weighted draws without replacement that all verified, the share of corrupt payload
+    # bytes is below this bound at the given confidence: every draw that finds a clean file leaves a larger share of
+    # corrupt bytes for the next. (Files are weighted by their size plus one byte, so empty files can be drawn.)
+    if draws <= 0:
+        return 1.0
+    return 1.0 - (1.0 - confidence) ** (1.0 / draws)
+
+
+def new_seed():
+    return random.SystemRandom().getrandbits(63)
@@ -0,0 +1,114 @@
+from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtWidgets import QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTreeWidget, \
+    QTreeWidgetItem, QProgressBar, QAbstractItemView
+from bdbag_gui.impl.job_queue import JOB_RUNNING
+from bdbag_gui.impl.progress import format_rate
+
+JOB_COLUMN = 0
+PATH_COLUMN = 1
+STATE_COLUMN = 2
+PROGRESS_COLUMN = 3
+RESULT_COLUMN = 4
+
+
+class JobsDockWidget(QDockWidget):
+
+    def __init__(self, job_queue, parent):
+        super(JobsDockWidget, self).__init__(parent.tr("Jobs"), parent)
+        self.setObjectName("jobsDockWidget")
+        self.setAllowedAreas(Qt.BottomDockWidgetArea | Qt.TopDockWidgetArea |
+                             Qt.LeftDockWidgetArea | Qt.RightDockWidgetArea)
+        self.job_queue = job_queue
+        self.items = dict()
+
+        container = QWidget(self)
+        layout = QVBoxLayout(container)
+        layout.setContentsMargins(4, 4, 4, 4)
+
+        self.jobsTree = QTreeWidget(container)
+        self.jobsTree.setObjectName("jobsTree")
+        self.jobsTree.setRootIsDecorated(False)
+        self.jobsTree.setUniformRowHeights(True)
+        self.jobsTree.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.jobsTree.setHeaderLabels(["Job", "Path", "State", "Progress", "Result"])
+        self.jobsTree.setColumnWidth(JOB_COLUMN, 160)
+        self.jobsTree.setColumnWidth(PATH_COLUMN, 250)
+        self.jobsTree.setColumnWidth(STATE_COLUMN, 80)
+        self.jobsTree.setColumnWidth(PROGRESS_COLUMN, 120)
+        self.jobsTree.itemSelectionChanged.connect(self.updateButtons)
+        layout.addWidget(self.jobsTree)
+
+        buttonLayout = QHBoxLayout()
+        buttonLayout.addStretch(1)
+        self.cancelButton = QPushButton("Cancel Selected", container)
+        self.cancelButton.clicked.connect(self.onCancelSelected)
+        buttonLayout.addWidget(self.cancelButton)
+        self.clearButton = QPushButton("Clear Finished", container)
+        self.clearButton.clicked.connect(self.onClearFinished)
+        buttonLayout.addWidget(self.clearButton)
+        layout.addLayout(buttonLayout)
+        self.setWidget(container)
+
+        self.job_queue.job_added_signal.connect(self.onJobAdded)
+        self.job_queue.job_updated_signal.connect(self.onJobUpdated)
+        self.job_queue.job_finished_signal.connect(self.onJobUpdated)
+        self.job_queue.job_removed_signal.connect(self.onJobRemoved)
+        self.updateButtons()
+
+    def selectedJobs(self):
+        return [item.data(JOB_COLUMN, Qt.UserRole) for item in self.jobsTree.selectedItems()]
+
+    @pyqtSlot()
+    def updateButtons(self):
+        jobs = self.selectedJobs()
+        self.cancelButton.setEnabled(any(job.can_cancel() for job in jobs))
+        self.clearButton.setEnabled(any(not job.is_active() for job in self.job_queue.jobs))
+
+    @pyqtSlot(object)
+    def onJobAdded(self, job):
+        item = QTreeWidgetItem(["#%d %s" % (job.id, job.description), job.path or "", job.state, "", ""])
+        item.setData(JOB_COLUMN, Qt.UserRole, job)
+        item.setToolTip(PATH_COLUMN, job.path or "")
+        self.jobsTree.addTopLevelItem(item)
+        progressBar = QProgressBar(self.jobsTree)
+        progressBar.setRange(0, 100)
+        progressBar.setValue(0)
+        progressBar.setTextVisible(True)
+        self.jobsTree.setItemWidget(item, PROGRESS_COLUMN, progressBar)
+        self.items[job.id] = item
+        self.updateButtons()
+
+    @pyqtSlot(object)
+    def onJobUpdated(self, job):
+        item = self.items.get(job.id)
+        if item is None:
+            return
+        item.setText(STATE_COLUMN, job.state)
+        if job.result:
+            item.setText(RESULT_COLUMN, job.result)
+            item.setToolTip(RESULT_COLUMN, job.result)
+        progressBar = self.jobsTree.itemWidget(item, PROGRESS_COLUMN)
+        if progressBar is not None:
+            progressBar.setValue(job.percent())
+            if job.state == JOB_RUNNING and job.items_per_second > 0:
+                rate = format_rate(job.items_per_second, job.bytes_per_second)
+                progressBar.setToolTip(rate)
+                item.setToolTip(STATE_COLUMN, rate)
+        self.updateButtons()
+
+    @pyqtSlot(object)
+    def onJobRemoved(self, job):
+        item = self.items.pop(job.id, None)
+        if item is None:
+            return
+        self.jobsTree.takeTopLevelItem(self.jobsTree.indexOfTopLevelItem(item))
+        self.updateButtons()
+
+    @pyqtSlot()
+    def onCancelSelected(self):
+        for job in self.selectedJobs():
+            self.job_queue.cancel(job)
+
+    @pyqtSlot()
+    def onClearFinished(self):
+        self.job_queue.clear_finished()
@@ -1,19 +1,73 @@
-from PyQt5.Qt import qApp
-from PyQt5.QtCore import pyqtSignal
-from PyQt5.QtWidgets import QPlainTextEdit
+import os
+import glob
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtWidgets import QPlainTextEdit, QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton
+from bdbag.bdbag_config import DEFAULT_CONFIG_PATH
+from bdbag_gui.impl.async_task import Task, async_execute
 import logging
 
+DEFAULT_DRAIN_INTERVAL_MS = 100
+MAX_DRAIN_BATCH = 10000
+DEFAULT_LOG_BUFFER_LINES = 10000
+DEFAULT_SESSION_LOG_DIR = os.path.join(DEFAULT_CONFIG_PATH, "bdbag_gui_logs")
+DEFAULT_SESSION_LOG_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_SESSION_LOG_BACKUP_COUNT = 10
+DEFAULT_SESSION_LOG_KEEP = 10
+DEFAULT_HISTORY_PAGE_LINES = 5000
+
 
 class QPlainTextEditLogger(logging.Handler):
 
     def __init__(self, parent):
         super().__init__()
+        # the widget keeps no more than its buffer lines, so neither does the queue: in a burst of records the oldest
+        # are dropped (and counted) rather than queued without bound
+        self.records = deque(maxlen=DEFAULT_LOG_BUFFER_LINES)
+        self.dropped = 0
         self.widget = QPlainTextEditLog(parent)
+        self.timer = QTimer(self.widget)
+        self.timer.setInterval(DEFAULT_DRAIN_INTERVAL_MS)
+        self.timer.timeout.connect(self.drain)
+        self.timer.start()
+
+    def set_buffer_lines(self, lines):
+        self.acquire()
+        try:
+            self.dropped += max(0, len(self.records) - lines)
+            self.records = deque(self.records, maxlen=lines)
+        finally:
+            self.release()
+        self.widget.setMaximumBlockCount(lines)
 
     def emit(self, record):
-        msg = self.format(record)
-        self.widget.log_update_signal.emit(msg)
-        qApp.processEvents()
+        # May be called from any thread: only format and enqueue, the GUI thread appends the text in batches. Called
+        # with the handler lock held.
+        try:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def drain(self):
+        lines = list()
+        self.acquire()
+        try:
+            dropped, self.dropped = self.dropped, 0
+        finally:
+            self.release()
+        if dropped:
+            lines.append("[%d log lines were logged faster than they could be displayed and were dropped]" % dropped)
+        try:
+            while len(lines) < MAX_DRAIN_BATCH:
+                lines.append(self.records.popleft())
+        except IndexError:
+            pass
+        if lines:
+            self.widget.log_update_signal.emit("\n".join(lines))
 
 
 class QPlainTextEditLog(QPlainTextEdit):
@@ -21,5 +75,220 @@ class QPlainTextEditLog(QPlainTextEdit):
 
     def __init__(self, parent):
         super().__init__(parent)
+        self.session_log = None
         self.setReadOnly(True)
         self.setBackgroundVisible(True)
+        self.setMaximumBlockCount(DEFAULT_LOG_BUFFER_LINES)
+
+    def contextMenuEvent(self, event):
+        menu = self.createStandardContextMenu()
+        menu.addSeparator()
+        historyAction = menu.addAction("Show Session History...")
+        historyAction.setEnabled(self.session_log is not None)
+        historyAction.triggered.connect(self.showSessionHistory)
+        menu.exec_(event.globalPos())
+        del menu
+
+    @pyqtSlot()
+    def showSessionHistory(self):
+        if self.session_log is None:
+            return
+        self.session_log.flush()
+        dialog = LogHistoryDialog(self, SessionLogHistory(self.session_log.baseFilename,
+                                                          self.session_log.backupCount))
+        dialog.exec_()
+        del dialog
+
+
+class SessionLogHandler(RotatingFileHandler):
+
+    def __init__(self,
+                 log_dir=DEFAULT_SESSION_LOG_DIR,
+                 max_bytes=DEFAULT_SESSION_LOG_MAX_BYTES,
+                 backup_count=DEFAULT_SESSION_LOG_BACKUP_COUNT,
+                 keep_sessions=DEFAULT_SESSION_LOG_KEEP):
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir, mode=0o750)
+        prune_session_logs(log_dir, keep_sessions - 1)
+        filename = os.path.join(log_dir, "bdbag_gui-%s-%d.log" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+        super(SessionLogHandler, self).__init__(filename,
+                                                maxBytes=max_bytes,
+                                                backupCount=backup_count,
+                                                encoding="utf-8",
+                                                delay=True)
+
+
+def prune_session_logs(log_dir, keep):
+    sessions = sorted(glob.glob(os.path.join(log_dir, "bdbag_gui-*.log")), key=os.path.getmtime, reverse=True)
+    for session in sessions[max(0, keep):]:
+        for path in glob.glob(session + "*"):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.debug("Unable to remove old session log %s: %s" % (path, e))
+
+
+class SessionLogHistory(object):
+    # pages are keyed by the inode of the file they start in rather than by its name: on rollover every file is renamed
+    # to the next backup (.1 becomes .2), so a name would point at other lines afterwards while an inode does not. The
+    # first line of the file is kept as well, as the inode of a file rotated out is soon reused by a new one.
+
+    def __init__(self, filename, backup_count, page_lines=DEFAULT_HISTORY_PAGE_LINES):
+        self.filename = filename
+        self.backup_count = backup_count
+        self.page_lines = page_lines
+        self.pages = list()
+        self.total_lines = 0
+
+    def files(self):
+        # (path, inode) of the session log and its backups, oldest first
+        files = list()
+        for path in ["%s.%d" % (self.filename, i) for i in range(self.backup_count, 0, -1)] + [self.filename]:
+            try:
+                files.append((path, os.stat(path).st_ino))
+            except OSError:
+                pass
+        return files
+
+    def index(self):
+        # returns the (inode, first line, byte offset) at which each page starts, so any page can be read with a single
+        # seek, and the number of lines. Called off the GUI thread, so it only reads the files; see set_index.
+        pages = list()
+        total_lines = 0
+        indexed = set()
+        for path, ino in self.files():
+            try:
+                log_file = open(path, "rb")
+            except OSError:
+                continue
+            with log_file:
+                # the file may have rolled over since it was listed
+                ino = os.fstat(log_file.fileno()).st_ino
+                if ino in indexed:
+                    continue
+                indexed.add(ino)
+                offset = 0
+                head = log_file.readline()
+                log_file.seek(0)
+                for line in log_file:
+                    if total_lines % self.page_lines == 0:
+                        pages.append((ino, head, offset))
+                    offset += len(line)
+                    total_lines += 1
+        return pages, total_lines
+
+    def set_index(self, pages, total_lines):
+        self.pages = pages
+        self.total_lines = total_lines
+
+    def read_page(self, page):
+        # returns None if the file the page starts in has been rotated out of the session log since it was indexed
+        if page < 0 or page >= len(self.pages):
+            return ""
+        start_ino, head, offset = self.pages[page]
+        files = self.files()
+        inodes = [ino for path, ino in files]
+        if start_ino not in inodes:
+            return None
+        lines = list()
+        for path, ino in files[inodes.index(start_ino):]:
+            try:
+                log_file = open(path, "rb")
+            except OSError:
+                continue
+            with log_file:
+                if ino == start_ino and (os.fstat(log_file.fileno()).st_ino != ino or log_file.readline() != head):
+                    return None
+                log_file.seek(offset)
+                for line in log_file:
+                    lines.append(line.decode("utf-8", "replace").rstrip("\r\n"))
+                    if len(lines) >= self.page_lines:
+                        return "\n".join(lines)
+            offset = 0
+        return "\n".join(lines)
+
+
+class LogHistoryDialog(QDialog):
+
+    def __init__(self, parent, history):
+        super(LogHistoryDialog, self).__init__(parent)
+        self.history = history
+        self.page = 0
+        self.indexTask = None
+        self.setWindowTitle("Session Log History")
+        self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        self.resize(900, 600)
+        layout = QVBoxLayout(self)
+
+        self.historyText = QPlainTextEdit(self)
+        self.historyText.setReadOnly(True)
+        self.historyText.setLineWrapMode(QPlainTextEdit.NoWrap)
+        layout.addWidget(self.historyText)
+
+        navigationLayout = QHBoxLayout()
+        self.oldestButton = QPushButton("<< Oldest", self)
+        self.oldestButton.clicked.connect(lambda: self.showPage(0))
+        navigationLayout.addWidget(self.oldestButton)
+        self.olderButton = QPushButton("< Older", self)
+        self.olderButton.clicked.connect(lambda: self.showPage(self.page - 1))
+        navigationLayout.addWidget(self.olderButton)
+        self.pageLabel = QLabel(self)
+        self.pageLabel.setAlignment(Qt.AlignCenter)
+        navigationLayout.addWidget(self.pageLabel, 1)
+        self.newerButton = QPushButton("Newer >", self)
+        self.newerButton.clicked.connect(lambda: self.showPage(self.page + 1))
+        navigationLayout.addWidget(self.newerButton)
+        self.newestButton = QPushButton("Newest >>", self)
+        self.newestButton.clicked.connect(lambda: self.showPage(len(self.history.pages) - 1))
+        navigationLayout.addWidget(self.newestButton)
+        self.refreshButton = QPushButton("Refresh", self)
+        self.refreshButton.clicked.connect(self.refresh)
+        navigationLayout.addWidget(self.refreshButton)
+        layout.addLayout(navigationLayout)
+
+        self.refresh()
+
+    @pyqtSlot()
+    def refresh(self):
+        if self.indexTask is not None:
+            return
+        # the logs of a long session run to hundreds of megabytes, so they are indexed off the GUI thread
+        self.pageLabel.setText("Indexing session history...")
+        for button in (self.oldestButton, self.olderButton, self.newerButton, self.newestButton, self.refreshButton):
+            button.setEnabled(False)
+        self.indexTask = Task(self.history.index, [], self.onIndexed)
+        async_execute(self.indexTask)
+
+    @pyqtSlot(object, bool)
+    def onIndexed(self, result, success):
+        self.indexTask = None
+        self.refreshButton.setEnabled(True)
+        if not success:
+            self.pageLabel.setText("Unable to index session history: %s" % result)
+            return
+        self.history.set_index(*result)
+        self.showPage(len(self.history.pages) - 1)
+
+    def showPage(self, page):
+        pages = len(self.history.pages)
+        self.page = max(0, min(page, pages - 1))
+        text = self.history.read_page(self.page)
+        if text is None:
+            text = "This page has since been rotated out of the session log. Refresh to index it again."
+        self.historyText.setPlainText(text)
+        if pages:
+            first = self.page * self.history.page_lines + 1
+            last = min(first + self.history.page_lines - 1, self.history.total_lines)
+            self.pageLabel.setText("Page %d of %d (lines %d-%d of %d)" %
+                                   (self.page + 1, pages, first, last, self.history.total_lines))
+        else:
+            self.pageLabel.setText("No session history available.")
+        self.oldestButton.setEnabled(self.page > 0)
+        self.olderButton.setEnabled(self.page > 0)
+        self.newerButton.setEnabled(self.page < pages - 1)
+        self.newestButton.setEnabled(self.page < pages - 1)
+
+    def done(self, result):
+        if self.indexTask is not None:
+            self.indexTask.cancel()
+        super(LogHistoryDialog, self).done(result)
@@ -5,15 +5,37 @@ import logging
 import platform
 
 from PyQt5.Qt import PYQT_VERSION_STR
-from PyQt5.QtCore import Qt, QDir, QMetaObject, QModelIndex, QThreadPool, QTimer, QMutex, pyqtSlot
+from PyQt5.QtCore import Qt, QDir, QEventLoop, QMetaObject, QModelIndex, QTimer, pyqtSlot
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QAction, QMenu, QMenuBar, QMessageBox, QStyle, \
-    QProgressBar, QToolBar, QStatusBar, QVBoxLayout, QTreeView, QFileSystemModel, QAbstractItemView, qApp
+    QProgressBar, QToolBar, QStatusBar, QVBoxLayout, QTreeView, QFileSystemModel, QAbstractItemView, QLabel, \
+    QFileDialog, QSystemTrayIcon, qApp
 from PyQt5.QtGui import QIcon
-from bdbag import VERSION as BDBAG_VERSION, BAGIT_VERSION, BAGIT_PROFILE_VERSION, bdbag_api as bdb
+from bdbag import VERSION as BDBAG_VERSION, BAGIT_VERSION, BAGIT_PROFILE_VERSION
 from bdbag_gui import resources, VERSION
-from bdbag_gui.ui import log_widget, options_window
+from bdbag_gui.ui import log_widget, options_window, jobs_widget, tree_model, report_window
 from bdbag_gui.ui.options_window import DEFAULT_OPTIONS, DEFAULT_OPTIONS_FILE
-from bdbag_gui.impl import async_task, bag_tasks
+from bdbag_gui.impl import async_task, bag_tasks, bag_detect, job_queue, payload, integrity_watch
+from bdbag_gui.impl.payload import MAX_DIFF_DETAILS
+from bdbag_gui.impl.algorithms import supported_algorithms
+from bdbag_gui.impl.digest_cache import DIGEST_CACHE_RECOMPUTE, DIGEST_CACHE_OFF
+from bdbag_gui.impl.progress import format_rate, format_bytes, format_duration
+from bdbag_gui.impl.report import DEFAULT_REPORT_DIR, latest_report
+
+ETA_UPDATE_INTERVAL_MS = 1000
+# weight of the latest completed job in the measured throughput used for pre-flight estimates
+THROUGHPUT_SMOOTHING = 0.5
+# files named in a single integrity watcher alert
+MAX_DRIFT_DETAILS = 5
+# how long closing the window waits for canceled jobs before asking what to do with those still running
+CLOSE_WAIT_MS = 5000
+
+
+def run_preflight(path):
+    # the path travels with the result (and a failure is returned, not raised) so the slot can always start its job
+    try:
+        return path, payload.preflight_scan(path), None
+    except Exception as e:
+        return path, None, e
 
 
 # noinspection PyBroadException,PyArgumentList
@@ -21,19 +43,49 @@ class MainWindow(QMainWindow):
 
     def __init__(self):
         super(MainWindow, self).__init__()
-        self.currentTask = None
-        self.currentTaskMutex = QMutex()
-        self.options = DEFAULT_OPTIONS
+        self.currentJob = None
+        self.measuredThroughput = dict()
+        self.preflightJobs = dict()
+        self.closing = False
+        self.options = DEFAULT_OPTIONS.copy()
+        self.jobQueue = job_queue.JobQueue(parent=self)
+        self.jobQueue.job_updated_signal.connect(self.updateJobProgress)
+        self.jobQueue.job_finished_signal.connect(self.updateUI)
+        self.bagDetector = bag_detect.BagDetector(parent=self)
+        self.bagDetector.bag_detected_signal.connect(self.onBagDetected)
+        self.bagDetector.bag_invalidated_signal.connect(self.onBagInvalidated)
+        self.bagStatusRequested = set()
+        self.integrityWatcher = integrity_watch.IntegrityWatcher(
+            is_busy=lambda path: self.jobQueue.active_job_for_path(path) is not None, parent=self)
+        self.integrityWatcher.drift_detected_signal.connect(self.onDriftDetected)
+        self.integrityWatcher.drift_cleared_signal.connect(self.onDriftCleared)
+        self.integrityWatcher.watch_failed_signal.connect(self.onWatchFailed)
+        self.trayIcon = None
         self.ui = MainWindowUI()
         self.ui.setup_ui(self)
         self.ui.logTextBrowser.widget.log_update_signal.connect(self.updateLog)
+        self.etaTimer = QTimer(self)
+        self.etaTimer.setInterval(ETA_UPDATE_INTERVAL_MS)
+        self.etaTimer.timeout.connect(self.updateEta)
+        self.etaTimer.start()
         self.ui.logTextBrowser.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
         logging.getLogger().addHandler(self.ui.logTextBrowser)
         logging.getLogger().setLevel(logging.INFO)
+        try:
+            self.sessionLog = log_widget.SessionLogHandler()
+            self.sessionLog.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+            logging.getLogger().addHandler(self.sessionLog)
+            self.ui.logTextBrowser.widget.session_log = self.sessionLog
+        except Exception as e:
+            self.sessionLog = None
+            logging.warning("Unable to create session log file. Error: %s" % e)
 
         self.fileSystemModel = QFileSystemModel()
         self.fileSystemModel.setReadOnly(False)
-        self.ui.treeView.setModel(self.fileSystemModel)
+        self.treeModel = tree_model.BagStatusProxyModel(self)
+        self.treeModel.setSourceModel(self.fileSystemModel)
+        self.ui.treeView.setModel(self.treeModel)
+        self.bagDetector.bag_invalidated_signal.connect(self.treeModel.invalidate)
         self.fileSystemModel.setRootPath(self.fileSystemModel.myComputer())
         self.ui.treeView.setAnimated(True)
         self.ui.treeView.setAcceptDrops(True)
@@ -44,7 +96,11 @@ class MainWindow(QMainWindow):
         self.ui.treeView.setColumnWidth(0, 300)
 
         self.loadOptions()
-        homedir_index = self.fileSystemModel.index(self.options.get("current_dir", QDir.home().path()))
+        self.applyOptions()
+        for path in self.options.get("watched_bags", DEFAULT_OPTIONS["watched_bags"]):
+            self.integrityWatcher.watch(path)
+        self.updateTrayIcon()
+        homedir_index = self.treeModel.index_for_path(self.options.get("current_dir", QDir.home().path()))
         self.ui.treeView.setCurrentIndex(homedir_index)
         self.ui.treeView.setExpanded(homedir_index, True)
         QTimer.singleShot(1300, self.selectionChanged)
@@ -64,7 +120,20 @@ class MainWindow(QMainWindow):
             options = json.dumps(DEFAULT_OPTIONS)
             logging.warning("Unable to read options file: [%s]. Using internal defaults." % options_file)
 
-        self.options = json.loads(options)
+        self.options = DEFAULT_OPTIONS.copy()
+        self.options.update(json.loads(options))
+        algorithms = self.options.get("bag_algorithms") or []
+        if supported_algorithms(algorithms) != algorithms:
+            self.options["bag_algorithms"] = supported_algorithms(algorithms) or list(DEFAULT_OPTIONS["bag_algorithms"])
+            logging.warning("Checksum algorithms not supported by bdbag were removed from the options: %s" %
+                            ", ".join(alg for alg in algorithms if alg not in self.options["bag_algorithms"]))
+
+    def applyOptions(self):
+        self.jobQueue.set_max_concurrent_jobs(self.options.get("max_concurrent_jobs",
+                                                               DEFAULT_OPTIONS["max_concurrent_jobs"]))
+        async_task.configure_executors(self.options.get("executor_limits", DEFAULT_OPTIONS["executor_limits"]))
+        self.ui.logTextBrowser.set_buffer_lines(
+            self.options.get("log_buffer_lines", DEFAULT_OPTIONS["log_buffer_lines"]))
 
     def saveOptions(self, options_file=DEFAULT_OPTIONS_FILE):
         logging.debug("Writing options file: %s" % options_file)
@@ -82,53 +151,113 @@ class MainWindow(QMainWindow):
             logging.warning("Unable to write options file: [%s]. Error: %s" % (options_file, e))
 
     def checkIfBag(self, silent=False):
+        # returns None while the (possibly slow) detection is still running in the background
         current_path = self.getCurrentPath()
         if not current_path:
             return False
-        current_type = self.fileSystemModel.type(self.ui.treeView.currentIndex())
-        if current_type == "Drive":
-            is_bag = False
-        else:
-            if os.path.isdir(current_path):
-                QApplication.setOverrideCursor(Qt.WaitCursor)
-                is_bag = bdb.is_bag(current_path)
-                QApplication.restoreOverrideCursor()
-                if not silent:
-                    self.updateStatus("The directory [%s] is%s a bag." % (current_path, "" if is_bag else " NOT"), True)
-            else:
-                is_bag = False
+        current_index = self.currentSourceIndex()
+        if self.fileSystemModel.type(current_index) == "Drive" or not self.fileSystemModel.isDir(current_index):
+            return False
+
+        status = self.bagDetector.request(current_path)
+        if status is None:
+            if not silent:
+                self.bagStatusRequested.add(current_path)
+                self.statusBar().showMessage("Checking if the directory [%s] is a bag..." % current_path)
+            return None
+        is_bag = status == bag_detect.BAG_STATUS_BAG
+        if not silent:
+            self.updateStatus("The directory [%s] is%s a bag." % (current_path, "" if is_bag else " NOT"), True)
 
         return is_bag
 
+    @pyqtSlot(str, int)
+    def onBagDetected(self, path, status):
+        silent = path not in self.bagStatusRequested
+        self.bagStatusRequested.discard(path)
+        if path == self.getCurrentPath():
+            self.enableControls(silent)
+
+    @pyqtSlot(str)
+    def onBagInvalidated(self, path):
+        if path == self.getCurrentPath():
+            self.enableControls(True)
+
     def checkIfArchive(self, silent=False):
-        is_file_archive = False
         current_path = self.getCurrentPath()
-        if current_path and os.path.isfile(current_path):
-            # simple test based on extension only
-            ext = os.path.splitext(current_path)[1]
-            if ext in (".zip", ".tar", ".tgz", ".gz", ".bz2", ".xz"):
-                is_file_archive = True
+        if not current_path or self.fileSystemModel.isDir(self.currentSourceIndex()):
+            return False
+
+        # archives are identified by content rather than extension, off the GUI thread like bag detection
+        status = self.bagDetector.request(current_path)
+        if status is None:
+            if not silent:
+                self.bagStatusRequested.add(current_path)
+                self.statusBar().showMessage("Checking if the file [%s] is an archive..." % current_path)
+            return False
+        is_file_archive = status in (bag_detect.BAG_STATUS_ARCHIVE, bag_detect.BAG_STATUS_BAG_ARCHIVE)
 
         if is_file_archive and not silent:
-            self.updateStatus("The file [%s] is a supported archive format." % current_path, True)
+            if status == bag_detect.BAG_STATUS_BAG_ARCHIVE:
+                self.updateStatus("The file [%s] is a bag archive." % current_path, True)
+            else:
+                self.updateStatus("The file [%s] is a supported archive format." % current_path, True)
 
         return is_file_archive
 
-    def setCurrentTask(self, task, can_cancel=True):
-        if not self.currentTaskMutex.tryLock(10):
-            return False
-        self.currentTask = task
+    def submitTask(self, task, description, path, can_cancel=True):
+        active_job = self.jobQueue.active_job_for_path(path)
+        if active_job:
+            self.updateStatus("Unable to start \"%s\": job #%d (%s) is still active for [%s]." %
+                              (description, active_job.id, active_job.description, active_job.path), False)
+            return None
+        process_task_types = self.options.get("process_task_types", DEFAULT_OPTIONS["process_task_types"])
+        task.backend = async_task.BACKEND_PROCESS if task.task_type in process_task_types else \
+            async_task.BACKEND_THREAD
+        self.currentJob = self.jobQueue.submit(task, description, path)
         self.bagTaskTriggered(can_cancel)
-        return True
+        return self.currentJob
+
+    def preflight(self, job, start):
+        # totals the payload in the background before the job starts, which also leaves the walk cached for the task
+        # the callback has to be a method of this window: a lambda would be called on the worker thread
+        self.preflightJobs[job.path] = (job, start)
+        task = async_task.Task(run_preflight, [job.path], self.onPreflightDone)
+        async_task.async_execute(task, async_task.EXECUTOR_DISK, job.path)
+        self.updateStatus("Scanning [%s] -- Please wait..." % job.path)
+
+    @pyqtSlot(object, bool)
+    def onPreflightDone(self, result, success):
+        path, totals, error = result
+        job, start = self.preflightJobs.pop(path)
+        if not job.is_active():
+            return
+        if totals is not None:
+            total_files, job.total_bytes = totals
+            status = "%s: [%s] contains %d files (%s)" % (job.description, job.path, total_files,
+                                                           format_bytes(job.total_bytes))
+            throughput = self.measuredThroughput.get(job.description)
+            if throughput:
+                job.estimate = job.total_bytes / throughput
+                status += ", estimated time: %s" % format_duration(job.estimate)
+            self.updateStatus(status + " -- Please wait...")
+        else:
+            logging.warning("Pre-flight scan of [%s] failed: %s" % (job.path, error))
+        start()
 
-    def clearCurrentTask(self):
-        if not self.currentTask:
+    def measureThroughput(self, job):
+        if not job.success or not job.total_bytes or job.elapsed() < 1:
             return
-        self.currentTask = None
-        self.currentTaskMutex.unlock()
+        throughput = job.total_bytes / job.elapsed()
+        previous = self.measuredThroughput.get(job.description)
+        self.measuredThroughput[job.description] = throughput if previous is None else \
+            previous + THROUGHPUT_SMOOTHING * (throughput - previous)
+
+    def currentSourceIndex(self):
+        return self.treeModel.mapToSource(self.ui.treeView.currentIndex())
 
     def getCurrentPath(self):
-        return os.path.normpath(os.path.abspath(self.fileSystemModel.filePath(self.ui.treeView.currentIndex())))
+        return os.path.normpath(os.path.abspath(self.fileSystemModel.filePath(self.currentSourceIndex())))
 
     def disableControls(self, can_cancel=True):
         self.ui.actionCancel.setEnabled(can_cancel)
@@ -140,64 +269,139 @@ class MainWindow(QMainWindow):
         self.ui.actionFetchAll.setEnabled(False)
         self.ui.actionValidateFast.setEnabled(False)
         self.ui.actionValidateFull.setEnabled(False)
+        self.ui.actionValidateRehash.setEnabled(False)
+        self.ui.actionValidateSample.setEnabled(False)
+        self.ui.actionValidateArchive.setEnabled(False)
+        self.ui.actionValidateWatch.setEnabled(False)
         self.ui.actionArchive.setEnabled(False)
         self.ui.actionDelete.setEnabled(False)
         self.ui.actionOptions.setEnabled(False)
 
     def enableControls(self, silent=False):
         is_bag = self.checkIfBag(silent)
+        is_pending = is_bag is None
+        is_bag = bool(is_bag)
         is_file_archive = self.checkIfArchive(silent)
         current_path = self.getCurrentPath()
-        current_type = self.fileSystemModel.type(self.ui.treeView.currentIndex())
+        current_index = self.currentSourceIndex()
+        current_type = self.fileSystemModel.type(current_index)
         self.ui.treeView.setEnabled(True)
         self.ui.actionOptions.setEnabled(True)
-        self.ui.actionCancel.setEnabled(False)
+        self.ui.actionCancel.setEnabled(self.canCancelJobs())
         self.ui.actionDelete.setEnabled(False if (not current_type or "Drive" == current_type) else True)
         self.ui.toggleCreateOrUpdate(self, is_bag)
         self.ui.actionCreateOrUpdate.setEnabled(
-            (os.path.isdir(current_path) and "Drive" != current_type) if current_path else False)
+            (self.fileSystemModel.isDir(current_index) and "Drive" != current_type and not is_pending)
+            if current_path else False)
         self.ui.actionRevert.setEnabled(is_bag)
         self.ui.actionMaterialize.setEnabled(is_bag or is_file_archive)
         self.ui.actionFetchMissing.setEnabled(is_bag)
         self.ui.actionFetchAll.setEnabled(is_bag)
         self.ui.actionValidateFast.setEnabled(is_bag)
         self.ui.actionValidateFull.setEnabled(is_bag)
+        self.ui.actionValidateRehash.setEnabled(is_bag)
+        self.ui.actionValidateSample.setEnabled(is_bag)
+        self.ui.actionValidateArchive.setEnabled(is_file_archive)
+        self.ui.actionValidateWatch.setEnabled(is_bag)
+        self.ui.actionValidateWatch.setChecked(is_bag and self.integrityWatcher.is_watched(current_path))
         self.ui.toggleArchiveOrExtract(self, is_bag, is_file_archive)
 
     def selectionChanged(self):
         self.ui.statusBar.clearMessage()
         self.ui.progressBar.reset()
-        self.ui.logTextBrowser.widget.clear()
+        if not self.jobQueue.active_jobs():
+            self.ui.logTextBrowser.widget.clear()
         self.enableControls()
         self.ui.treeView.scrollTo(self.ui.treeView.currentIndex(), QAbstractItemView.PositionAtCenter)
         self.options["current_dir"] = self.getCurrentPath()
 
     def closeEvent(self, event):
-        self.cancelTasks()
+        if self.closing or not self.cancelTasks():
+            event.ignore()
+            return
+        self.integrityWatcher.stop()
         self.saveOptions()
         event.accept()
 
     def cancelTasks(self):
-        if not self.currentTask:
-            return
+        # returns False if the window should stay open because jobs are still stopping
+        if not self.jobQueue.active_jobs():
+            return True
 
-        self.disableControls()
-        self.currentTask.cancel()
+        self.closing = True
+        self.disableControls(False)
+        self.jobQueue.cancel_all()
         self.statusBar().showMessage("Waiting for background tasks to terminate...")
-
-        while True:
-            qApp.processEvents()
-            if not self.currentTask and QThreadPool.globalInstance().waitForDone(10):
+        # process-backed tasks are killed promptly; in-process tasks stop at their next cancellation checkpoint, and
+        # some bdbag operations (revert, extract, fetch transports) have none
+        while not self.waitForJobs(CLOSE_WAIT_MS):
+            choice = self.confirmCloseWithActiveJobs()
+            if choice == QMessageBox.Retry:
+                continue
+            if choice == QMessageBox.Cancel:
+                self.closing = False
+                self.enableControls(True)
+                self.statusBar().showMessage("%d canceled job(s) still stopping." % len(self.jobQueue.active_jobs()))
+                return False
+            for job in self.jobQueue.active_jobs():
+                if job.task.backend == async_task.BACKEND_PROCESS:
+                    job.task.terminate()
+            if self.waitForJobs(CLOSE_WAIT_MS):
                 break
-
+            logging.warning("Closing with %d in-process job(s) still stopping: they finish in the background and the "
+                            "application exits once they have stopped." % len(self.jobQueue.active_jobs()))
+            return True
         self.statusBar().showMessage("All background tasks terminated successfully.")
+        return True
+
+    def waitForJobs(self, msecs):
+        # runs the event loop instead of blocking it, so the window keeps painting and finished jobs report in
+        if not self.jobQueue.active_jobs():
+            return True
+        loop = QEventLoop()
+        timer = QTimer()
+        timer.setSingleShot(True)
+        timer.timeout.connect(loop.quit)
+
+        def onJobFinished(job):
+            if not self.jobQueue.active_jobs():
+                loop.quit()
+
+        self.jobQueue.job_finished_signal.connect(onJobFinished)
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        timer.start(msecs)
+        loop.exec_()
+        QApplication.restoreOverrideCursor()
+        timer.stop()
+        self.jobQueue.job_finished_signal.disconnect(onJobFinished)
+        return not self.jobQueue.active_jobs()
+
+    def confirmCloseWithActiveJobs(self):
+        jobs = self.jobQueue.active_jobs()
+        in_process = [job for job in jobs if job.task.backend != async_task.BACKEND_PROCESS]
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Warning)
+        msg.setWindowTitle("Jobs Still Running")
+        msg.setText("%d canceled job(s) have not stopped yet." % len(jobs))
+        text = "Closing anyway terminates the jobs running in a separate process."
+        if in_process:
+            text += " %d job(s) run inside the application and cannot be interrupted: they finish in the " \
+                    "background after the window closes, and the application exits once they have stopped." % \
+                    len(in_process)
+        msg.setInformativeText(text)
+        msg.setDetailedText("\n".join("%s: %s" % (job.description, job.path or "") for job in jobs))
+        msg.setStandardButtons(QMessageBox.Retry | QMessageBox.Close | QMessageBox.Cancel)
+        msg.button(QMessageBox.Retry).setText("Keep Waiting")
+        msg.button(QMessageBox.Close).setText("Close Anyway")
+        msg.setDefaultButton(QMessageBox.Retry)
+        return msg.exec_()
 
     @pyqtSlot()
     def bagTaskTriggered(self, can_cancel=True):
         self.ui.progressBar.reset()
+        self.ui.progressBar.setFormat("%p%")
         self.ui.progressBar.setTextVisible(can_cancel)
-        self.ui.logTextBrowser.widget.clear()
-        self.disableControls(can_cancel)
+        self.ui.actionCancel.setEnabled(self.canCancelJobs())
 
     @pyqtSlot(str)
     def updateStatus(self, status, success=True):
@@ -207,11 +411,34 @@ class MainWindow(QMainWindow):
             logging.error(status)
         self.statusBar().showMessage(status)
 
-    @pyqtSlot(str, bool)
-    def updateUI(self, status, success=True):
-        self.updateStatus(status, success)
-        self.clearCurrentTask()
-        self.enableControls(True)
+    @pyqtSlot(object)
+    def updateUI(self, job):
+        self.updateStatus(job.result, job.success)
+        self.measureThroughput(job)
+        if job is self.currentJob:
+            self.currentJob = None
+            self.updateEta()
+        if job.path:
+            self.bagDetector.invalidate(job.path)
+            # the job may have rewritten the manifests of a watched bag
+            self.integrityWatcher.reload(job.path)
+        if not self.closing:
+            self.enableControls(True)
+
+    @pyqtSlot(object)
+    def updateJobProgress(self, job):
+        # a job that started running may no longer be cancelable
+        if not self.closing:
+            self.ui.actionCancel.setEnabled(self.canCancelJobs())
+        if job is self.currentJob and job.maximum > 0:
+            self.updateProgress(job.current, job.maximum)
+            if job.items_per_second > 0:
+                self.ui.progressBar.setFormat("%%p%% (%s)" % format_rate(job.items_per_second, job.bytes_per_second))
+
+    @pyqtSlot()
+    def updateEta(self):
+        eta = self.currentJob.eta() if self.currentJob is not None else None
+        self.ui.etaLabel.setText("ETA: %s" % format_duration(eta) if eta is not None else "")
 
     @pyqtSlot(str)
     def updateLog(self, text):
@@ -221,7 +448,6 @@ class MainWindow(QMainWindow):
     def updateProgress(self, current, maximum):
         self.ui.progressBar.setRange(1, maximum)
         self.ui.progressBar.setValue(current)
-        self.ui.progressBar.repaint()
 
     @pyqtSlot(bool)
     def on_actionCreateOrUpdate_triggered(self):
@@ -239,10 +465,78 @@ class MainWindow(QMainWindow):
             msg.exec_()
             return
 
-        if not self.setCurrentTask(bag_tasks.BagCreateOrUpdateTask()):
+        update = self.checkIfBag()
+        if update is None:
+            self.updateStatus("Unable to start: still checking if the directory [%s] is a bag." % current_path, False)
+            return
+        if not update:
+            self.createOrUpdate(current_path, False)
+            return
+        # an update first compares the payload with the manifests and asks for confirmation of the changes found
+        task = bag_tasks.BagDiffTask()
+        task.diff_ready_signal.connect(self.onPayloadDiff)
+        if not self.submitTask(task, "Update: Compare", current_path):
+            return
+        task.diff(current_path, self.options.get("digest_cache_mode", DEFAULT_OPTIONS["digest_cache_mode"]))
+        self.updateStatus("Comparing payload of bag [%s] with its manifests -- Please wait..." % current_path)
+
+    @pyqtSlot(object)
+    def onPayloadDiff(self, diff):
+        # adding a manifest changes the bag for every tool reading it and rehashes the whole payload, so it is only
+        # done if confirmed; otherwise the bag keeps the manifests it has
+        algorithms = self.options.get("bag_algorithms", DEFAULT_OPTIONS["bag_algorithms"])
+        added = [alg for alg in algorithms if alg not in diff.algorithms]
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Warning if added else QMessageBox.Question)
+        msg.setWindowTitle("Confirm Action")
+        msg.setText("Update the bag [%s]?" % diff.bag_path)
+        if diff.is_empty():
+            text = "No payload changes were found."
+        else:
+            text = "Payload changes: %s." % diff.summary()
+            msg.setDetailedText("\n".join(diff.details(MAX_DIFF_DETAILS)))
+        if added:
+            text += "\n\nThe checksum options include %s, which this bag has no manifest for. Adding %s to the bag " \
+                    "hashes every payload file (%s) again. Keeping the %s manifest%s of the bag hashes %s." % (
+                        ", ".join(added), "it" if len(added) == 1 else "them", format_bytes(diff.total_bytes()),
+                        ", ".join(diff.algorithms), "" if len(diff.algorithms) == 1 else "s",
+                        "only the added and changed files" if not diff.is_empty() else
+                        "nothing and only updates the bag metadata")
+            msg.setStandardButtons(QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+            msg.button(QMessageBox.Yes).setText("Add %s" % ", ".join(added))
+            msg.button(QMessageBox.No).setText("Keep %s" % ", ".join(diff.algorithms))
+            msg.setDefaultButton(QMessageBox.No)
+        else:
+            text += " Only added and changed files will be hashed." if not diff.is_empty() else \
+                " Only the bag metadata will be updated."
+            msg.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
+        msg.setInformativeText(text)
+        ret = msg.exec_()
+        if ret in (QMessageBox.Ok, QMessageBox.Yes):
+            self.createOrUpdate(diff.bag_path, True, diff)
+        elif ret == QMessageBox.No:
+            self.createOrUpdate(diff.bag_path, True, diff, diff.algorithms)
+
+    def createOrUpdate(self, path, update, diff=None, algorithms=None):
+        task = bag_tasks.BagCreateOrUpdateTask()
+        job = self.submitTask(task, "Update" if update else "Create", path)
+        if not job:
             return
-        self.currentTask.status_update_signal.connect(self.updateUI)
-        self.currentTask.createOrUpdate(current_path, self.checkIfBag(), self.options.get("bag_config_file_path"))
+
+        def start():
+            task.createOrUpdate(path,
+                                update,
+                                self.options.get("bag_config_file_path"),
+                                algorithms or self.options.get("bag_algorithms", DEFAULT_OPTIONS["bag_algorithms"]),
+                                self.options.get("hash_workers", DEFAULT_OPTIONS["hash_workers"]),
+                                self.options.get("digest_cache_mode", DEFAULT_OPTIONS["digest_cache_mode"]),
+                                self.options.get("hash_engine", DEFAULT_OPTIONS["hash_engine"]),
+                                diff)
+        # an update hashes the changes of the payload comparison just confirmed, so the bag is not walked again
+        if update:
+            start()
+        else:
+            self.preflight(job, start)
 
     @pyqtSlot(bool)
     def on_actionRevert_triggered(self):
@@ -263,10 +557,10 @@ class MainWindow(QMainWindow):
         if ret == QMessageBox.Cancel:
             return
 
-        if not self.setCurrentTask(bag_tasks.BagRevertTask()):
+        task = bag_tasks.BagRevertTask()
+        if not self.submitTask(task, "Revert", current_path):
             return
-        self.currentTask.status_update_signal.connect(self.updateUI)
-        self.currentTask.revert(current_path)
+        task.revert(current_path)
 
     @pyqtSlot(bool)
     def on_actionMaterialize_triggered(self):
@@ -274,11 +568,10 @@ class MainWindow(QMainWindow):
         if not current_path:
             return
 
-        if not self.setCurrentTask(bag_tasks.BagMaterializeTask()):
+        task = bag_tasks.BagMaterializeTask()
+        if not self.submitTask(task, "Materialize", current_path):
             return
-        self.currentTask.status_update_signal.connect(self.updateUI)
-        self.currentTask.progress_update_signal.connect(self.updateProgress)
-        self.currentTask.materialize(current_path, self.options.get("archive_extract_dir"))
+        task.materialize(current_path, self.options.get("archive_extract_dir"))
         self.updateStatus("Materialize initiated for bag: [%s] -- Please wait..." % current_path)
 
     @pyqtSlot(bool)
@@ -289,55 +582,118 @@ class MainWindow(QMainWindow):
         is_bag = self.checkIfBag()
         is_file_archive = self.checkIfArchive()
         if is_file_archive:
-            if not self.setCurrentTask(bag_tasks.BagExtractTask(), can_cancel=False):
+            task = bag_tasks.BagExtractTask()
+            if not self.submitTask(task, "Extract", current_path, can_cancel=False):
                 return
-            self.currentTask.status_update_signal.connect(self.updateUI)
-            self.currentTask.extract(current_path, self.options.get("archive_extract_dir"))
+            task.extract(current_path, self.options.get("archive_extract_dir"))
             self.updateStatus("Extracting file: [%s] -- Please wait..." % current_path)
         elif is_bag:
             archive_format = self.options.get("archive_format", "zip")
-            if not self.setCurrentTask(bag_tasks.BagArchiveTask()):
+            task = bag_tasks.BagArchiveTask()
+            job = self.submitTask(task, "Archive (%s)" % archive_format.upper(), current_path)
+            if not job:
                 return
-            self.currentTask.status_update_signal.connect(self.updateUI)
-            self.currentTask.archive(current_path, archive_format)
-            self.updateStatus("Archive (%s) initiated for bag: [%s] -- Please wait..." %
-                              (archive_format.upper(), current_path))
+            self.preflight(job, lambda: task.archive(current_path, archive_format))
 
     @pyqtSlot(bool)
     def on_actionValidateFast_triggered(self):
         current_path = self.getCurrentPath()
         if not current_path:
             return
-        if not self.setCurrentTask(bag_tasks.BagValidateTask()):
+        task = bag_tasks.BagValidateTask()
+        if not self.submitTask(task, "Validate: Fast", current_path):
             return
-        self.currentTask.status_update_signal.connect(self.updateUI)
-        self.currentTask.validate(current_path, True, self.options.get("bag_config_file_path"))
+        task.validate(current_path, True, self.options.get("bag_config_file_path"))
 
     @pyqtSlot(bool)
     def on_actionValidateFull_triggered(self):
+        self.validateFull(False)
+
+    @pyqtSlot(bool)
+    def on_actionValidateRehash_triggered(self):
+        self.validateFull(True)
+
+    @pyqtSlot(bool)
+    def on_actionValidateSample_triggered(self):
         current_path = self.getCurrentPath()
         if not current_path:
             return
-        if not self.setCurrentTask(bag_tasks.BagValidateTask()):
+        task = bag_tasks.BagValidateTask()
+        if not self.submitTask(task, "Validate: Sample", current_path):
             return
-        self.currentTask.status_update_signal.connect(self.updateUI)
-        self.currentTask.progress_update_signal.connect(self.updateProgress)
-        self.currentTask.validate(current_path, False, self.options.get("bag_config_file_path"))
-        self.updateStatus("Full validation initiated for bag: [%s] -- Please wait..." % current_path)
+        task.sample(current_path,
+                    self.options.get("sample_percent", DEFAULT_OPTIONS["sample_percent"]),
+                    self.options.get("sample_budget_gb", DEFAULT_OPTIONS["sample_budget_gb"]) * 1024 ** 3,
+                    self.options.get("sample_method", DEFAULT_OPTIONS["sample_method"]),
+                    self.options.get("bag_config_file_path"),
+                    self.options.get("hash_workers", DEFAULT_OPTIONS["hash_workers"]),
+                    self.options.get("digest_cache_mode", DEFAULT_OPTIONS["digest_cache_mode"]),
+                    self.options.get("hash_engine", DEFAULT_OPTIONS["hash_engine"]))
+        self.updateStatus("Sample validation initiated for bag: [%s] -- Please wait..." % current_path)
+
+    @pyqtSlot(bool)
+    def on_actionValidateArchive_triggered(self):
+        current_path = self.getCurrentPath()
+        if not current_path:
+            return
+        task = bag_tasks.BagValidateTask()
+        if not self.submitTask(task, "Validate: Archive", current_path):
+            return
+        task.validateArchive(current_path, self.options.get("bag_algorithms", DEFAULT_OPTIONS["bag_algorithms"]))
+        self.updateStatus("Archive validation initiated for: [%s] -- Please wait..." % current_path)
+
+    @pyqtSlot()
+    def on_actionValidateReport_triggered(self):
+        current_path = latest_report() or DEFAULT_REPORT_DIR
+        path = QFileDialog.getOpenFileName(self, "Select Validation Report", current_path,
+                                           "Validation Reports (*.jsonl)")
+        if not path[0]:
+            return
+        dialog = report_window.ReportDialog(self, os.path.normpath(path[0]))
+        dialog.setAttribute(Qt.WA_DeleteOnClose)
+        dialog.show()
+
+    def validateFull(self, rehash):
+        current_path = self.getCurrentPath()
+        if not current_path:
+            return
+        task = bag_tasks.BagValidateTask()
+        job = self.submitTask(task, "Validate: Full (Rehash)" if rehash else "Validate: Full", current_path)
+        if not job:
+            return
+        cache_mode = self.options.get("digest_cache_mode", DEFAULT_OPTIONS["digest_cache_mode"])
+        # full validation reads every file, and refreshes the verification time of every cached checksum, unless
+        # trusting the cache was opted into; only creating and updating a bag trust it by default
+        trust_cache = self.options.get("validate_trust_cache", DEFAULT_OPTIONS["validate_trust_cache"])
+        if cache_mode != DIGEST_CACHE_OFF and (rehash or not trust_cache):
+            cache_mode = DIGEST_CACHE_RECOMPUTE
+        self.preflight(job, lambda: task.validate(current_path,
+                                                  False,
+                                                  self.options.get("bag_config_file_path"),
+                                                  self.options.get("hash_workers", DEFAULT_OPTIONS["hash_workers"]),
+                                                  cache_mode,
+                                                  self.options.get("hash_engine", DEFAULT_OPTIONS["hash_engine"]),
+                                                  self.options.get("digest_trust_days",
+                                                                   DEFAULT_OPTIONS["digest_trust_days"]),
+                                                  self.options.get("validation_policy",
+                                                                   DEFAULT_OPTIONS["validation_policy"]),
+                                                  self.options.get("validation_error_budget",
+                                                                   DEFAULT_OPTIONS["validation_error_budget"])))
 
     @pyqtSlot(bool)
     def on_actionFetchAll_triggered(self):
         current_path = self.getCurrentPath()
         if not current_path:
             return
-        if not self.setCurrentTask(bag_tasks.BagFetchTask()):
+        task = bag_tasks.BagFetchTask()
+        if not self.submitTask(task, "Fetch: All", current_path):
             return
-        self.currentTask.status_update_signal.connect(self.updateUI)
-        self.currentTask.progress_update_signal.connect(self.updateProgress)
-        self.currentTask.fetch(current_path,
-                               True,
-                               self.options.get("bag_keychain_file_path"),
-                               self.options.get("bag_config_file_path"))
+        task.fetch(current_path,
+                   True,
+                   self.options.get("bag_keychain_file_path"),
+                   self.options.get("bag_config_file_path"),
+                   self.options.get("fetch_workers", DEFAULT_OPTIONS["fetch_workers"]),
+                   self.options.get("fetch_per_host", DEFAULT_OPTIONS["fetch_per_host"]))
         self.updateStatus("Fetch all initiated for bag: [%s] -- Please wait..." % current_path)
 
     @pyqtSlot(bool)
@@ -345,14 +701,15 @@ class MainWindow(QMainWindow):
         current_path = self.getCurrentPath()
         if not current_path:
             return
-        if not self.setCurrentTask(bag_tasks.BagFetchTask()):
+        task = bag_tasks.BagFetchTask()
+        if not self.submitTask(task, "Fetch: Missing", current_path):
             return
-        self.currentTask.status_update_signal.connect(self.updateUI)
-        self.currentTask.progress_update_signal.connect(self.updateProgress)
-        self.currentTask.fetch(current_path,
-                               False,
-                               self.options.get("bag_keychain_file_path"),
-                               self.options.get("bag_config_file_path"))
+        task.fetch(current_path,
+                   False,
+                   self.options.get("bag_keychain_file_path"),
+                   self.options.get("bag_config_file_path"),
+                   self.options.get("fetch_workers", DEFAULT_OPTIONS["fetch_workers"]),
+                   self.options.get("fetch_per_host", DEFAULT_OPTIONS["fetch_per_host"]))
         self.updateStatus("Fetch missing initiated for bag: [%s] -- Please wait..." % current_path)
 
     @pyqtSlot(QModelIndex)
@@ -362,18 +719,90 @@ class MainWindow(QMainWindow):
     @pyqtSlot(bool)
     def on_actionOptions_triggered(self):
         options_window.OptionsDialog.getOptions(self)
+        self.applyOptions()
+
+    @pyqtSlot(bool)
+    def on_actionValidateWatch_triggered(self, checked):
+        current_path = self.getCurrentPath()
+        if not current_path:
+            return
+        if checked:
+            self.integrityWatcher.watch(current_path)
+            self.updateStatus("Watching [%s] for changes to its payload." % current_path)
+        else:
+            self.integrityWatcher.unwatch(current_path)
+            self.updateStatus("Stopped watching [%s] for changes." % current_path)
+        self.options["watched_bags"] = self.integrityWatcher.watched()
+        self.updateTrayIcon()
+
+    def updateTrayIcon(self):
+        watched = self.integrityWatcher.watched()
+        if not watched or not QSystemTrayIcon.isSystemTrayAvailable():
+            if self.trayIcon is not None:
+                self.trayIcon.hide()
+            return
+        if self.trayIcon is None:
+            self.trayIcon = QSystemTrayIcon(QApplication.windowIcon(), self)
+            self.trayIcon.activated.connect(self.onTrayIconActivated)
+            self.trayIcon.messageClicked.connect(self.onTrayIconActivated)
+        self.trayIcon.setToolTip("BDBag GUI: watching %d bag%s for changes" % (len(watched),
+                                                                           "" if len(watched) == 1 else "s"))
+        self.trayIcon.show()
+
+    @pyqtSlot()
+    def onTrayIconActivated(self):
+        self.showNormal()
+        self.raise_()
+        self.activateWindow()
+
+    @pyqtSlot(str, object)
+    def onDriftDetected(self, path, drift):
+        names = sorted(drift)
+        details = ", ".join("%s (%s)" % (name, drift[name]) for name in names[:MAX_DRIFT_DETAILS])
+        if len(names) > MAX_DRIFT_DETAILS:
+            details += " and %d more" % (len(names) - MAX_DRIFT_DETAILS)
+        status = "Integrity watcher: %d file%s of bag [%s] no longer match%s the manifest: %s" % (
+            len(names), "" if len(names) == 1 else "s", path, "es" if len(names) == 1 else "", details)
+        logging.warning(status)
+        self.statusBar().showMessage(status)
+        if self.trayIcon is not None and self.trayIcon.isVisible():
+            self.trayIcon.showMessage("Bag changed: %s" % os.path.basename(path), details, QSystemTrayIcon.Warning)
+
+    @pyqtSlot(str, object)
+    def onDriftCleared(self, path, names):
+        logging.info("Integrity watcher: %d file%s of bag [%s] match%s the manifest again: %s" % (
+            len(names), "" if len(names) == 1 else "s", path, "es" if len(names) == 1 else "",
+            ", ".join(names[:MAX_DRIFT_DETAILS]) + (" and %d more" % (len(names) - MAX_DRIFT_DETAILS)
+                                                    if len(names) > MAX_DRIFT_DETAILS else "")))
+
+    @pyqtSlot(str, str)
+    def onWatchFailed(self, path, error):
+        self.updateStatus("Unable to watch [%s] for changes: %s" % (path, error), False)
+        self.options["watched_bags"] = self.integrityWatcher.watched()
+        self.updateTrayIcon()
+        if path == self.getCurrentPath():
+            self.ui.actionValidateWatch.setChecked(False)
+
+    def canCancelJobs(self):
+        return any(job.can_cancel() for job in self.jobQueue.active_jobs())
 
     @pyqtSlot(bool)
     def on_actionCancel_triggered(self):
-        self.cancelTasks()
-        self.ui.progressBar.reset()
-        self.enableControls(True)
+        running = [job for job in self.jobQueue.active_jobs() if not job.can_cancel()]
+        self.jobQueue.cancel_all()
+        self.updateStatus("Cancellation requested for all active jobs%s." %
+                          (" except %d that cannot be stopped once started" % len(running) if running else ""))
 
     @pyqtSlot()
     def on_actionDelete_triggered(self):
-        is_dir = self.fileSystemModel.isDir(self.ui.treeView.currentIndex())
+        is_dir = self.fileSystemModel.isDir(self.currentSourceIndex())
         obj = "Directory" if is_dir else "File"
         current_path = self.getCurrentPath()
+        active_job = self.jobQueue.active_job_for_path(current_path)
+        if active_job:
+            self.updateStatus("Unable to delete [%s]: job #%d (%s) is still active for [%s]." %
+                              (current_path, active_job.id, active_job.description, active_job.path), False)
+            return
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Warning)
         msg.setWindowTitle("%s Deletion Warning" % obj)
@@ -383,7 +812,7 @@ class MainWindow(QMainWindow):
         msg.setStandardButtons(QMessageBox.Ok | QMessageBox.Abort)
         ret = msg.exec_()
         if ret == QMessageBox.Ok:
-            result = self.fileSystemModel.remove(self.ui.treeView.currentIndex())
+            result = self.fileSystemModel.remove(self.currentSourceIndex())
             self.updateStatus("%s: [%s]" % (("Successfully deleted" if result else "Failed to delete"),
                                             current_path), result)
             qApp.processEvents()
@@ -416,7 +845,7 @@ class MainWindowUI(object):
         # Main Window
         MainWin.setObjectName("MainWindow")
         MainWin.setWindowTitle(MainWin.tr("BDBag"))
-        MainWin.resize(700, 600)
+        MainWin.resize(800, 750)
         self.centralWidget = QWidget(MainWin)
         self.centralWidget.setObjectName("centralWidget")
         MainWin.setCentralWidget(self.centralWidget)
@@ -450,9 +879,51 @@ class MainWindowUI(object):
         self.actionValidateFull.setText(MainWin.tr("Validate: Full"))
         self.actionValidateFull.setToolTip(
             MainWin.tr("Perform full validation by calculating checksums for all files and comparing them against "
-                       "entries in the bag manifest(s)."))
+                       "entries in the bag manifest(s). If enabled in the options, files verified recently and "
+                       "unchanged since are checked against their cached checksums instead."))
         self.actionValidateFull.setShortcut(MainWin.tr("Ctrl+V"))
 
+        # Validate Full (Rehash)
+        self.actionValidateRehash = QAction(MainWin)
+        self.actionValidateRehash.setObjectName("actionValidateRehash")
+        self.actionValidateRehash.setText(MainWin.tr("Validate: Full (Rehash)"))
+        self.actionValidateRehash.setToolTip(
+            MainWin.tr("Perform full validation by reading every file, even if full validation has been set to "
+                       "trust recently verified checksums."))
+        self.actionValidateRehash.setShortcut(MainWin.tr("Ctrl+Shift+V"))
+
+        # Validate Archive
+        self.actionValidateArchive = QAction(MainWin)
+        self.actionValidateArchive.setObjectName("actionValidateArchive")
+        self.actionValidateArchive.setText(MainWin.tr("Validate: Archive"))
+        self.actionValidateArchive.setToolTip(
+            MainWin.tr("Perform full validation of a bag archive file by reading its contents directly from the "
+                       "archive, without extracting it to disk."))
+
+        # Validate Watch
+        self.actionValidateWatch = QAction(MainWin)
+        self.actionValidateWatch.setObjectName("actionValidateWatch")
+        self.actionValidateWatch.setText(MainWin.tr("Validate: Watch for Changes"))
+        self.actionValidateWatch.setCheckable(True)
+        self.actionValidateWatch.setToolTip(
+            MainWin.tr("Watch the bag in the background and rehash each payload file that changes, with an alert "
+                       "when it no longer matches the manifest."))
+
+        # Validate Report
+        self.actionValidateReport = QAction(MainWin)
+        self.actionValidateReport.setObjectName("actionValidateReport")
+        self.actionValidateReport.setText(MainWin.tr("Validate: Show Report..."))
+        self.actionValidateReport.setToolTip(
+            MainWin.tr("Show the per-file results and timings of a previous validation run."))
+
+        # Validate Sample
+        self.actionValidateSample = QAction(MainWin)
+        self.actionValidateSample.setObjectName("actionValidateSample")
+        self.actionValidateSample.setText(MainWin.tr("Validate: Sample"))
+        self.actionValidateSample.setToolTip(
+            MainWin.tr("Perform sample validation by calculating checksums for a size weighted random sample of the "
+                       "payload. Repeated samples rotate through files not yet covered."))
+
         # Fetch Missing
         self.actionFetchMissing = QAction(MainWin)
         self.actionFetchMissing.setObjectName("actionFetchMissing")
@@ -499,7 +970,7 @@ class MainWindowUI(object):
         self.actionCancel = QAction(MainWin)
         self.actionCancel.setObjectName("actionCancel")
         self.actionCancel.setText(MainWin.tr("Cancel"))
-        self.actionCancel.setToolTip(MainWin.tr("Cancel the current background task."))
+        self.actionCancel.setToolTip(MainWin.tr("Cancel all active background jobs that can be stopped."))
         self.actionCancel.setShortcut(MainWin.tr("Ctrl+C"))
 
         # Options
@@ -542,6 +1013,11 @@ class MainWindowUI(object):
             """)
         self.verticalLayout.addWidget(self.logTextBrowser.widget)
 
+        # Jobs Panel
+
+        self.jobsDock = jobs_widget.JobsDockWidget(MainWin.jobQueue, MainWin)
+        MainWin.addDockWidget(Qt.BottomDockWidgetArea, self.jobsDock)
+
         # Menu Bar
 
         self.menuBar = QMenuBar(MainWin)
@@ -565,7 +1041,13 @@ class MainWindowUI(object):
         self.menuValidate.setObjectName("menuValidate")
         self.menuValidate.setTitle(MainWin.tr("Validate"))
         self.menuValidate.addAction(self.actionValidateFast)
+        self.menuValidate.addAction(self.actionValidateSample)
         self.menuValidate.addAction(self.actionValidateFull)
+        self.menuValidate.addAction(self.actionValidateRehash)
+        self.menuValidate.addAction(self.actionValidateArchive)
+        self.menuValidate.addSeparator()
+        self.menuValidate.addAction(self.actionValidateWatch)
+        self.menuValidate.addAction(self.actionValidateReport)
 
         # Populate Bag menu
         self.menuBar.addAction(self.menuBag.menuAction())
@@ -579,6 +1061,13 @@ class MainWindowUI(object):
         self.menuBag.addAction(self.actionCancel)
         self.menuBag.addAction(self.actionOptions)
 
+        # View Menu
+        self.menuView = QMenu(self.menuBar)
+        self.menuView.setObjectName("menuView")
+        self.menuView.setTitle(MainWin.tr("View"))
+        self.menuView.addAction(self.jobsDock.toggleViewAction())
+        self.menuBar.addAction(self.menuView.menuAction())
+
         # Help Menu
         self.menuHelp = QMenu(self.menuBar)
         self.menuHelp.setObjectName("menuHelp")
@@ -652,6 +1141,8 @@ class MainWindowUI(object):
         self.statusBar.setStatusTip("")
         self.statusBar.setObjectName("statusBar")
         MainWin.setStatusBar(self.statusBar)
+        self.etaLabel = QLabel(MainWin)
+        self.statusBar.addPermanentWidget(self.etaLabel)
 
         # Progress Bar
 
@@ -2,16 +2,61 @@ import os
 import logging
 from PyQt5.QtCore import Qt, pyqtSlot
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, \
-    QGroupBox, QCheckBox, QRadioButton, QMessageBox, QDialogButtonBox, qApp
+    QGroupBox, QCheckBox, QRadioButton, QMessageBox, QDialogButtonBox, QSpinBox, QDoubleSpinBox, QComboBox, qApp
 from .json_editor import JSONEditor
+from .log_widget import DEFAULT_LOG_BUFFER_LINES
 from bdbag.bdbag_config import write_config, DEFAULT_CONFIG_PATH, DEFAULT_CONFIG_FILE, DEFAULT_KEYCHAIN_FILE
+from bdbag_gui.impl.async_task import Task, async_execute, DEFAULT_EXECUTOR_LIMITS, EXECUTOR_HASH, \
+    EXECUTOR_NETWORK, EXECUTOR_DISK
+from bdbag_gui.impl.bag_tasks import TASK_TYPES, TASK_TYPE_ARCHIVE, TASK_TYPE_EXTRACT, TASK_TYPE_MATERIALIZE
+from bdbag_gui.impl.hashing import DEFAULT_HASH_WORKERS, MAX_HASH_WORKERS, DEFAULT_HASH_ENGINE, HASH_ENGINE_READ, \
+    HASH_ENGINE_READINTO, HASH_ENGINE_MMAP, DEFAULT_ENGINE_BENCHMARK_BYTES, benchmark_engines
+from bdbag_gui.impl.digest_cache import DigestCache, DIGEST_CACHE_TRUST, DIGEST_CACHE_RECOMPUTE, DIGEST_CACHE_OFF, \
+    DEFAULT_DIGEST_TRUST_DAYS
+from bdbag_gui.impl.algorithms import BAG_ALGORITHMS, ALGORITHM_PRESETS, ALGORITHM_PRESET_CUSTOM, \
+    DEFAULT_BAG_ALGORITHMS, DEFAULT_BENCHMARK_BYTES, benchmark_algorithms, preset_name, supported_algorithms
+from bdbag_gui.impl.sampling import SAMPLE_RANDOM, SAMPLE_STRATIFIED, DEFAULT_SAMPLE_PERCENT
+from bdbag_gui.impl.bag_validate import VALIDATION_POLICY_COMPLETE, VALIDATION_POLICY_FAIL_FAST, \
+    VALIDATION_POLICY_BUDGET, DEFAULT_VALIDATION_POLICY, DEFAULT_ERROR_BUDGET
+from bdbag_gui.impl.fetch_engine import DEFAULT_FETCH_WORKERS, MAX_FETCH_WORKERS, DEFAULT_FETCH_PER_HOST
+from bdbag_gui.impl.progress import format_bytes
+
+HASH_ENGINE_NAMES = [
+    (HASH_ENGINE_READ, "Buffered reads"),
+    (HASH_ENGINE_READINTO, "Reused large buffer"),
+    (HASH_ENGINE_MMAP, "Memory mapped")
+]
+
+VALIDATION_POLICY_NAMES = [
+    (VALIDATION_POLICY_COMPLETE, "Run to completion"),
+    (VALIDATION_POLICY_FAIL_FAST, "Stop at the first failure"),
+    (VALIDATION_POLICY_BUDGET, "Stop after failures:")
+]
 
 DEFAULT_OPTIONS_FILE = os.path.join(DEFAULT_CONFIG_PATH, 'bdbag_gui.json')
 DEFAULT_OPTIONS = {
     "archive_format": "zip",
     "archive_extract_dir": "",
     "bag_config_file_path": DEFAULT_CONFIG_FILE,
-    "bag_keychain_file_path": DEFAULT_KEYCHAIN_FILE
+    "bag_keychain_file_path": DEFAULT_KEYCHAIN_FILE,
+    "bag_algorithms": list(DEFAULT_BAG_ALGORITHMS),
+    "max_concurrent_jobs": 4,
+    "executor_limits": DEFAULT_EXECUTOR_LIMITS,
+    "hash_workers": DEFAULT_HASH_WORKERS,
+    "fetch_workers": DEFAULT_FETCH_WORKERS,
+    "fetch_per_host": DEFAULT_FETCH_PER_HOST,
+    "digest_cache_mode": DIGEST_CACHE_TRUST,
+    "digest_trust_days": DEFAULT_DIGEST_TRUST_DAYS,
+    "validate_trust_cache": False,
+    "sample_percent": DEFAULT_SAMPLE_PERCENT,
+    "sample_budget_gb": 0,
+    "sample_method": SAMPLE_RANDOM,
+    "validation_policy": DEFAULT_VALIDATION_POLICY,
+    "validation_error_budget": DEFAULT_ERROR_BUDGET,
+    "hash_engine": DEFAULT_HASH_ENGINE,
+    "process_task_types": [TASK_TYPE_ARCHIVE, TASK_TYPE_EXTRACT, TASK_TYPE_MATERIALIZE],
+    "log_buffer_lines": DEFAULT_LOG_BUFFER_LINES,
+    "watched_bags": []
 }
 
 
@@ -30,7 +75,28 @@ class OptionsDialog(QDialog):
         self.config_file = parent.options.get("bag_config_file_path") or DEFAULT_OPTIONS["bag_config_file_path"]
         self.keychain_file = parent.options.get("bag_keychain_file_path") or DEFAULT_OPTIONS["bag_keychain_file_path"]
         self.archive_extract_dir = parent.options.get("archive_extract_dir") or ""
+        self.bag_algorithms = list(parent.options.get("bag_algorithms") or DEFAULT_OPTIONS["bag_algorithms"])
+        self.hash_engine = parent.options.get("hash_engine") or DEFAULT_OPTIONS["hash_engine"]
+        self.benchmarkTask = None
         self.archive_format = parent.options.get("archive_format") or DEFAULT_OPTIONS["archive_format"]
+        self.max_concurrent_jobs = parent.options.get("max_concurrent_jobs") or DEFAULT_OPTIONS["max_concurrent_jobs"]
+        self.executor_limits = dict(DEFAULT_OPTIONS["executor_limits"])
+        self.executor_limits.update(parent.options.get("executor_limits") or {})
+        self.hash_workers = parent.options.get("hash_workers") or DEFAULT_OPTIONS["hash_workers"]
+        self.fetch_workers = parent.options.get("fetch_workers") or DEFAULT_OPTIONS["fetch_workers"]
+        self.fetch_per_host = parent.options.get("fetch_per_host") or DEFAULT_OPTIONS["fetch_per_host"]
+        self.digest_cache_mode = parent.options.get("digest_cache_mode") or DEFAULT_OPTIONS["digest_cache_mode"]
+        self.digest_trust_days = parent.options.get("digest_trust_days", DEFAULT_OPTIONS["digest_trust_days"])
+        self.validate_trust_cache = parent.options.get("validate_trust_cache",
+                                                       DEFAULT_OPTIONS["validate_trust_cache"])
+        self.sample_percent = parent.options.get("sample_percent") or DEFAULT_OPTIONS["sample_percent"]
+        self.sample_budget_gb = parent.options.get("sample_budget_gb") or DEFAULT_OPTIONS["sample_budget_gb"]
+        self.sample_method = parent.options.get("sample_method") or DEFAULT_OPTIONS["sample_method"]
+        self.validation_policy = parent.options.get("validation_policy") or DEFAULT_OPTIONS["validation_policy"]
+        self.validation_error_budget = \
+            parent.options.get("validation_error_budget") or DEFAULT_OPTIONS["validation_error_budget"]
+        self.process_task_types = list(parent.options.get("process_task_types") or [])
+        self.log_buffer_lines = parent.options.get("log_buffer_lines") or DEFAULT_OPTIONS["log_buffer_lines"]
         self.setWindowTitle("Options")
         self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
         self.setMinimumWidth(600)
@@ -75,6 +141,71 @@ class OptionsDialog(QDialog):
         self.keychainFileLayout.addWidget(self.keychainFileEditButton)
         self.configGroupLayout.addLayout(self.keychainFileLayout)
 
+        # Checksum algorithms Group
+        self.algorithmsGroupLayout = QVBoxLayout()
+        self.algorithmsGroupBox = QGroupBox("Checksum algorithms:", self)
+        self.algorithmsGroupBox.setLayout(self.algorithmsGroupLayout)
+        layout.addWidget(self.algorithmsGroupBox)
+
+        # Algorithm presets
+        self.algorithmPresetLayout = QHBoxLayout()
+        self.algorithmPresetLabel = QLabel("Preset:")
+        self.algorithmPresetLayout.addWidget(self.algorithmPresetLabel)
+        self.algorithmPresetComboBox = QComboBox()
+        for name, algorithms in ALGORITHM_PRESETS:
+            self.algorithmPresetComboBox.addItem(name, algorithms)
+        self.algorithmPresetComboBox.addItem(ALGORITHM_PRESET_CUSTOM, None)
+        self.algorithmPresetComboBox.setCurrentText(preset_name(self.bag_algorithms))
+        self.algorithmPresetComboBox.activated.connect(self.onAlgorithmPresetChanged)
+        self.algorithmPresetLayout.addWidget(self.algorithmPresetComboBox)
+        self.algorithmPresetLayout.addStretch(1)
+        self.algorithmBenchmarkButton = QPushButton("Benchmark", parent)
+        self.algorithmBenchmarkButton.setToolTip("Measure the throughput of each algorithm on this machine and select "
+                                                 "the fastest set meeting the BagIt profile of the bag configuration.")
+        self.algorithmBenchmarkButton.clicked.connect(self.onAlgorithmBenchmark)
+        self.algorithmPresetLayout.addWidget(self.algorithmBenchmarkButton)
+        self.algorithmsGroupLayout.addLayout(self.algorithmPresetLayout)
+
+        # Algorithm selection
+        self.algorithmsLayout = QHBoxLayout()
+        self.algorithmCheckBoxes = dict()
+        for alg in BAG_ALGORITHMS:
+            checkBox = QCheckBox(alg)
+            checkBox.setChecked(alg in self.bag_algorithms)
+            checkBox.toggled.connect(self.onAlgorithmsChanged)
+            self.algorithmsLayout.addWidget(checkBox)
+            self.algorithmCheckBoxes[alg] = checkBox
+        self.algorithmsLayout.addStretch(1)
+        self.algorithmsGroupLayout.addLayout(self.algorithmsLayout)
+        self.algorithmBenchmarkLabel = QLabel("Algorithms used when creating bags or adding manifests to a bag.")
+        self.algorithmBenchmarkLabel.setWordWrap(True)
+        self.algorithmsGroupLayout.addWidget(self.algorithmBenchmarkLabel)
+
+        # Hashing engine
+        self.hashEngineLayout = QHBoxLayout()
+        self.hashEngineLabel = QLabel("File reading:")
+        self.hashEngineLayout.addWidget(self.hashEngineLabel)
+        self.hashEngineComboBox = QComboBox()
+        for engine, name in HASH_ENGINE_NAMES:
+            self.hashEngineComboBox.addItem(name, engine)
+        self.hashEngineComboBox.setCurrentIndex(max(0, self.hashEngineComboBox.findData(self.hash_engine)))
+        self.hashEngineComboBox.setToolTip("Reused large buffer and memory mapped reading hash very large files with "
+                                           "fewer system calls and copies, and keep them from flooding the page "
+                                           "cache. Memory mapped files must not be truncated while being hashed.")
+        self.hashEngineComboBox.activated.connect(self.onHashEngineChanged)
+        self.hashEngineLayout.addWidget(self.hashEngineComboBox)
+        self.hashEngineLayout.addStretch(1)
+        self.hashEngineBenchmarkButton = QPushButton("Benchmark Storage...", parent)
+        self.hashEngineBenchmarkButton.setToolTip("Compare the file reading methods with files from 1 KB to 1 GB "
+                                                  "written to a selected directory.")
+        self.hashEngineBenchmarkButton.clicked.connect(self.onHashEngineBenchmark)
+        self.hashEngineLayout.addWidget(self.hashEngineBenchmarkButton)
+        self.algorithmsGroupLayout.addLayout(self.hashEngineLayout)
+        self.hashEngineBenchmarkLabel = QLabel()
+        self.hashEngineBenchmarkLabel.setWordWrap(True)
+        self.hashEngineBenchmarkLabel.setVisible(False)
+        self.algorithmsGroupLayout.addWidget(self.hashEngineBenchmarkLabel)
+
         # Archive/Extract Group
         self.archiveGroupLayout = QVBoxLayout()
         self.archiveGroupBox = QGroupBox("Bag archiving and extraction:", self)
@@ -121,12 +252,217 @@ class OptionsDialog(QDialog):
         self.archiveFormatLayout.addWidget(self.archiveFormatTARButton)
         self.archiveGroupLayout.addLayout(self.archiveFormatLayout)
 
+        # Background jobs Group
+        self.jobsGroupLayout = QVBoxLayout()
+        self.jobsGroupBox = QGroupBox("Background jobs:", self)
+        self.jobsGroupBox.setLayout(self.jobsGroupLayout)
+        layout.addWidget(self.jobsGroupBox)
+
+        # Maximum concurrent jobs
+        self.maxJobsLayout = QHBoxLayout()
+        self.maxJobsLabel = QLabel("Maximum concurrent jobs:")
+        self.maxJobsLayout.addWidget(self.maxJobsLabel)
+        self.maxJobsSpinBox = QSpinBox()
+        self.maxJobsSpinBox.setRange(1, 64)
+        self.maxJobsSpinBox.setValue(self.max_concurrent_jobs)
+        self.maxJobsSpinBox.valueChanged.connect(self.onMaxJobsChanged)
+        self.maxJobsLayout.addWidget(self.maxJobsSpinBox)
+        self.maxJobsLayout.addStretch(1)
+        self.hashWorkersPerJobLabel = QLabel("Checksum threads per job:")
+        self.maxJobsLayout.addWidget(self.hashWorkersPerJobLabel)
+        self.hashWorkersPerJobSpinBox = QSpinBox()
+        self.hashWorkersPerJobSpinBox.setRange(1, MAX_HASH_WORKERS)
+        self.hashWorkersPerJobSpinBox.setValue(self.hash_workers)
+        self.hashWorkersPerJobSpinBox.setToolTip("Number of files hashed concurrently by a single bag create or "
+                                                 "update job.")
+        self.hashWorkersPerJobSpinBox.valueChanged.connect(self.onHashWorkersChanged)
+        self.maxJobsLayout.addWidget(self.hashWorkersPerJobSpinBox)
+        self.jobsGroupLayout.addLayout(self.maxJobsLayout)
+
+        # Worker pool sizes
+        self.executorsLayout = QHBoxLayout()
+        self.executorsLabel = QLabel("Worker threads:")
+        self.executorsLayout.addWidget(self.executorsLabel)
+        self.hashWorkersLabel = QLabel("Checksum")
+        self.executorsLayout.addWidget(self.hashWorkersLabel)
+        self.hashWorkersSpinBox = QSpinBox()
+        self.hashWorkersSpinBox.setRange(1, 256)
+        self.hashWorkersSpinBox.setValue(self.executor_limits[EXECUTOR_HASH])
+        self.hashWorkersSpinBox.setToolTip("Concurrent checksum-bound operations (create, update, full validation).")
+        self.hashWorkersSpinBox.valueChanged.connect(self.onExecutorLimitChanged)
+        self.executorsLayout.addWidget(self.hashWorkersSpinBox)
+        self.networkWorkersLabel = QLabel("Network")
+        self.executorsLayout.addWidget(self.networkWorkersLabel)
+        self.networkWorkersSpinBox = QSpinBox()
+        self.networkWorkersSpinBox.setRange(1, 256)
+        self.networkWorkersSpinBox.setValue(self.executor_limits[EXECUTOR_NETWORK])
+        self.networkWorkersSpinBox.setToolTip("Concurrent network-bound operations (fetch, materialize).")
+        self.networkWorkersSpinBox.valueChanged.connect(self.onExecutorLimitChanged)
+        self.executorsLayout.addWidget(self.networkWorkersSpinBox)
+        self.diskWorkersLabel = QLabel("Disk (per device)")
+        self.executorsLayout.addWidget(self.diskWorkersLabel)
+        self.diskWorkersSpinBox = QSpinBox()
+        self.diskWorkersSpinBox.setRange(1, 256)
+        self.diskWorkersSpinBox.setValue(self.executor_limits[EXECUTOR_DISK])
+        self.diskWorkersSpinBox.setToolTip("Concurrent disk-bound operations (archive, extract, revert, fast "
+                                           "validation) on each storage device.")
+        self.diskWorkersSpinBox.valueChanged.connect(self.onExecutorLimitChanged)
+        self.executorsLayout.addWidget(self.diskWorkersSpinBox)
+        self.executorsLayout.addStretch(1)
+        self.jobsGroupLayout.addLayout(self.executorsLayout)
+
+        # Fetch transfers
+        self.fetchLayout = QHBoxLayout()
+        self.fetchWorkersLabel = QLabel("Fetch: concurrent transfers per job:")
+        self.fetchLayout.addWidget(self.fetchWorkersLabel)
+        self.fetchWorkersSpinBox = QSpinBox()
+        self.fetchWorkersSpinBox.setRange(1, MAX_FETCH_WORKERS)
+        self.fetchWorkersSpinBox.setValue(self.fetch_workers)
+        self.fetchWorkersSpinBox.setToolTip("Number of remote files transferred at once over HTTP(S) by a single "
+                                            "fetch job.")
+        self.fetchWorkersSpinBox.valueChanged.connect(self.onFetchWorkersChanged)
+        self.fetchLayout.addWidget(self.fetchWorkersSpinBox)
+        self.fetchPerHostLabel = QLabel("of which per host:")
+        self.fetchLayout.addWidget(self.fetchPerHostLabel)
+        self.fetchPerHostSpinBox = QSpinBox()
+        self.fetchPerHostSpinBox.setRange(1, MAX_FETCH_WORKERS)
+        self.fetchPerHostSpinBox.setValue(self.fetch_per_host)
+        self.fetchPerHostSpinBox.setToolTip("Maximum number of keep-alive connections a fetch job opens to any one "
+                                            "server.")
+        self.fetchPerHostSpinBox.valueChanged.connect(self.onFetchPerHostChanged)
+        self.fetchLayout.addWidget(self.fetchPerHostSpinBox)
+        self.fetchLayout.addStretch(1)
+        self.jobsGroupLayout.addLayout(self.fetchLayout)
+
+        # Process backend per task type
+        self.processTasksLayout = QHBoxLayout()
+        self.processTasksLabel = QLabel("Run in separate process:")
+        self.processTasksLayout.addWidget(self.processTasksLabel)
+        self.processTaskCheckBoxes = dict()
+        for task_type in TASK_TYPES:
+            checkBox = QCheckBox(task_type.capitalize())
+            checkBox.setChecked(task_type in self.process_task_types)
+            checkBox.toggled.connect(self.onProcessTaskTypesChanged)
+            self.processTasksLayout.addWidget(checkBox)
+            self.processTaskCheckBoxes[task_type] = checkBox
+        self.processTasksLayout.addStretch(1)
+        self.jobsGroupLayout.addLayout(self.processTasksLayout)
+
+        # Checksum cache radio group
+        self.digestCacheLayout = QHBoxLayout()
+        self.digestCacheLabel = QLabel("Checksum cache:")
+        self.digestCacheLayout.addWidget(self.digestCacheLabel)
+        self.digestCacheTrustButton = QRadioButton("Trust cached")
+        self.digestCacheTrustButton.setChecked(self.digest_cache_mode == DIGEST_CACHE_TRUST)
+        self.digestCacheTrustButton.setToolTip("Reuse checksums of files whose device, inode, size and modification "
+                                               "time are unchanged since they were last hashed.")
+        self.digestCacheTrustButton.toggled.connect(self.onDigestCacheModeChanged)
+        self.digestCacheLayout.addWidget(self.digestCacheTrustButton)
+        self.digestCacheRecomputeButton = QRadioButton("Recompute")
+        self.digestCacheRecomputeButton.setChecked(self.digest_cache_mode == DIGEST_CACHE_RECOMPUTE)
+        self.digestCacheRecomputeButton.setToolTip("Always read and hash every file, refreshing the cache.")
+        self.digestCacheRecomputeButton.toggled.connect(self.onDigestCacheModeChanged)
+        self.digestCacheLayout.addWidget(self.digestCacheRecomputeButton)
+        self.digestCacheOffButton = QRadioButton("Off")
+        self.digestCacheOffButton.setChecked(self.digest_cache_mode == DIGEST_CACHE_OFF)
+        self.digestCacheOffButton.toggled.connect(self.onDigestCacheModeChanged)
+        self.digestCacheLayout.addWidget(self.digestCacheOffButton)
+        self.digestCacheLayout.addStretch(1)
+        self.validateTrustCacheCheckBox = QCheckBox("Validate: Full trusts cached checksums for:")
+        self.validateTrustCacheCheckBox.setChecked(self.validate_trust_cache)
+        self.validateTrustCacheCheckBox.setToolTip("A faster full validation that skips reading files whose "
+                                                   "signature is unchanged since they were last hashed. By default "
+                                                   "full validation reads every file.")
+        self.validateTrustCacheCheckBox.toggled.connect(self.onValidateTrustCacheChanged)
+        self.digestCacheLayout.addWidget(self.validateTrustCacheCheckBox)
+        self.digestTrustSpinBox = QSpinBox()
+        self.digestTrustSpinBox.setRange(0, 3650)
+        self.digestTrustSpinBox.setSuffix(" days")
+        self.digestTrustSpinBox.setSpecialValueText("Always")
+        self.digestTrustSpinBox.setValue(self.digest_trust_days)
+        self.digestTrustSpinBox.setEnabled(self.validate_trust_cache)
+        self.digestTrustSpinBox.setToolTip("Full validation skips reading files whose signature is unchanged since "
+                                           "they were last hashed, if that was within this many days. Use "
+                                           "\"Validate: Full (Rehash)\" to read every file regardless.")
+        self.digestTrustSpinBox.valueChanged.connect(self.onDigestTrustDaysChanged)
+        self.digestCacheLayout.addWidget(self.digestTrustSpinBox)
+        self.digestCacheClearButton = QPushButton("Clear Cache", parent)
+        self.digestCacheClearButton.clicked.connect(self.onDigestCacheClear)
+        self.digestCacheLayout.addWidget(self.digestCacheClearButton)
+        self.jobsGroupLayout.addLayout(self.digestCacheLayout)
+
+        # Validation error policy
+        self.validationPolicyLayout = QHBoxLayout()
+        self.validationPolicyLabel = QLabel("Validate: Full on failure:")
+        self.validationPolicyLayout.addWidget(self.validationPolicyLabel)
+        self.validationPolicyComboBox = QComboBox()
+        for policy, name in VALIDATION_POLICY_NAMES:
+            self.validationPolicyComboBox.addItem(name, policy)
+        self.validationPolicyComboBox.setCurrentIndex(
+            max(0, self.validationPolicyComboBox.findData(self.validation_policy)))
+        self.validationPolicyComboBox.setToolTip("Missing files and Payload-Oxum are checked before any file is read, "
+                                                 "so a policy that stops early rejects an obviously broken bag "
+                                                 "at once. Running to completion reports every failed file.")
+        self.validationPolicyComboBox.activated.connect(self.onValidationPolicyChanged)
+        self.validationPolicyLayout.addWidget(self.validationPolicyComboBox)
+        self.validationBudgetSpinBox = QSpinBox()
+        self.validationBudgetSpinBox.setRange(1, 1000000)
+        self.validationBudgetSpinBox.setSuffix(" files")
+        self.validationBudgetSpinBox.setValue(self.validation_error_budget)
+        self.validationBudgetSpinBox.setEnabled(self.validation_policy == VALIDATION_POLICY_BUDGET)
+        self.validationBudgetSpinBox.valueChanged.connect(self.onValidationErrorBudgetChanged)
+        self.validationPolicyLayout.addWidget(self.validationBudgetSpinBox)
+        self.validationPolicyLayout.addStretch(1)
+        self.jobsGroupLayout.addLayout(self.validationPolicyLayout)
+
+        # Sample validation
+        self.sampleLayout = QHBoxLayout()
+        self.sampleLabel = QLabel("Validate: Sample checks:")
+        self.sampleLayout.addWidget(self.sampleLabel)
+        self.samplePercentSpinBox = QDoubleSpinBox()
+        self.samplePercentSpinBox.setRange(0.1, 100.0)
+        self.samplePercentSpinBox.setDecimals(1)
+        self.samplePercentSpinBox.setSuffix(" %")
+        self.samplePercentSpinBox.setValue(self.sample_percent)
+        self.samplePercentSpinBox.setToolTip("Share of the payload bytes read by a sample validation.")
+        self.samplePercentSpinBox.valueChanged.connect(self.onSamplePercentChanged)
+        self.sampleLayout.addWidget(self.samplePercentSpinBox)
+        self.sampleBudgetLabel = QLabel("or at most:")
+        self.sampleLayout.addWidget(self.sampleBudgetLabel)
+        self.sampleBudgetSpinBox = QSpinBox()
+        self.sampleBudgetSpinBox.setRange(0, 1000000)
+        self.sampleBudgetSpinBox.setSuffix(" GB")
+        self.sampleBudgetSpinBox.setSpecialValueText("No limit")
+        self.sampleBudgetSpinBox.setValue(self.sample_budget_gb)
+        self.sampleBudgetSpinBox.setToolTip("A fixed number of bytes to read instead of a share of the payload.")
+        self.sampleBudgetSpinBox.valueChanged.connect(self.onSampleBudgetChanged)
+        self.sampleLayout.addWidget(self.sampleBudgetSpinBox)
+        self.sampleStratifiedCheckBox = QCheckBox("Stratify by file size")
+        self.sampleStratifiedCheckBox.setChecked(self.sample_method == SAMPLE_STRATIFIED)
+        self.sampleStratifiedCheckBox.setToolTip("Sample every size class of files in proportion to its bytes, so "
+                                                 "small files are checked even in bags dominated by a few huge ones.")
+        self.sampleStratifiedCheckBox.toggled.connect(self.onSampleMethodChanged)
+        self.sampleLayout.addWidget(self.sampleStratifiedCheckBox)
+        self.sampleLayout.addStretch(1)
+        self.jobsGroupLayout.addLayout(self.sampleLayout)
+
         # Miscellaneous Group
         self.miscGroupBox = QGroupBox("Miscellaneous:", self)
         self.miscLayout = QHBoxLayout()
         self.debugCheckBox = QCheckBox("Debug logging")
         self.debugCheckBox.setChecked(True if logging.getLogger().getEffectiveLevel() == logging.DEBUG else False)
         self.miscLayout.addWidget(self.debugCheckBox)
+        self.miscLayout.addStretch(1)
+        self.logBufferLabel = QLabel("Log view lines:")
+        self.miscLayout.addWidget(self.logBufferLabel)
+        self.logBufferSpinBox = QSpinBox()
+        self.logBufferSpinBox.setRange(1000, 1000000)
+        self.logBufferSpinBox.setSingleStep(1000)
+        self.logBufferSpinBox.setValue(self.log_buffer_lines)
+        self.logBufferSpinBox.setToolTip("Number of lines kept in the log view. The full session history is "
+                                         "written to disk and can be viewed from the log context menu.")
+        self.logBufferSpinBox.valueChanged.connect(self.onLogBufferLinesChanged)
+        self.miscLayout.addWidget(self.logBufferSpinBox)
         self.miscGroupBox.setLayout(self.miscLayout)
         layout.addWidget(self.miscGroupBox)
 
@@ -206,14 +542,222 @@ class OptionsDialog(QDialog):
             elif self.archiveFormatTARButton.isChecked():
                 self.archive_format = "tar"
 
+    @pyqtSlot(int)
+    def onAlgorithmPresetChanged(self, index):
+        algorithms = self.algorithmPresetComboBox.itemData(index)
+        if algorithms:
+            self.setAlgorithms(algorithms)
+
+    @pyqtSlot(bool)
+    def onAlgorithmsChanged(self, checked):
+        algorithms = [alg for alg in BAG_ALGORITHMS if self.algorithmCheckBoxes[alg].isChecked()]
+        if not algorithms:
+            # at least one manifest is required
+            self.sender().setChecked(True)
+            return
+        self.bag_algorithms = algorithms
+        self.algorithmPresetComboBox.setCurrentText(preset_name(algorithms))
+
+    def setAlgorithms(self, algorithms):
+        self.bag_algorithms = supported_algorithms(algorithms)
+        for alg, checkBox in self.algorithmCheckBoxes.items():
+            checkBox.blockSignals(True)
+            checkBox.setChecked(alg in self.bag_algorithms)
+            checkBox.blockSignals(False)
+        self.algorithmPresetComboBox.setCurrentText(preset_name(self.bag_algorithms))
+
+    @pyqtSlot()
+    def onAlgorithmBenchmark(self):
+        self.algorithmBenchmarkButton.setEnabled(False)
+        self.algorithmBenchmarkLabel.setText("Measuring checksum throughput, please wait...")
+        self.benchmarkTask = Task(benchmark_algorithms,
+                                  [self.config_file, None, DEFAULT_BENCHMARK_BYTES, self.benchmarkProgress],
+                                  self.onAlgorithmBenchmarkDone)
+        async_execute(self.benchmarkTask, EXECUTOR_HASH)
+
+    def benchmarkProgress(self, current, maximum):
+        task = self.benchmarkTask
+        return task is not None and not task.canceled
+
+    @pyqtSlot(object, bool)
+    def onAlgorithmBenchmarkDone(self, result, success):
+        self.benchmarkTask = None
+        self.algorithmBenchmarkButton.setEnabled(True)
+        if not success:
+            self.algorithmBenchmarkLabel.setText("Benchmark failed: %s" % result)
+            return
+        throughput = result["throughput"]
+        ranking = ", ".join(["%s %s/s" % (alg, format_bytes(throughput[alg]))
+                             for alg in sorted(throughput, key=throughput.get, reverse=True)])
+        requirements = "no BagIt profile requirements"
+        if result["profile"] and result["required"] is None:
+            requirements = "BagIt profile requirements unavailable"
+        elif result["required"]:
+            requirements = "required by BagIt profile: %s" % ", ".join(result["required"])
+        elif result["allowed"] is not None:
+            requirements = "allowed by BagIt profile: %s" % ", ".join(result["allowed"])
+        self.algorithmBenchmarkLabel.setText("%s.\nRecommended (%s): %s at %s/s." %
+                                             (ranking, requirements, ", ".join(result["recommended"]),
+                                              format_bytes(result["recommended_throughput"])))
+        self.setAlgorithms(result["recommended"])
+
+    @pyqtSlot(int)
+    def onHashEngineChanged(self, index):
+        self.hash_engine = self.hashEngineComboBox.itemData(index)
+
+    @pyqtSlot()
+    def onHashEngineBenchmark(self):
+        path = QFileDialog.getExistingDirectory(self, "Select a Directory on the Storage to Benchmark",
+                                                os.path.expanduser("~"), QFileDialog.ShowDirsOnly)
+        if not path:
+            return
+        self.hashEngineBenchmarkButton.setEnabled(False)
+        self.hashEngineBenchmarkLabel.setVisible(True)
+        self.hashEngineBenchmarkLabel.setText("Benchmarking file reading in [%s], please wait..." % path)
+        self.benchmarkTask = Task(benchmark_engines,
+                                  [path, None, None, self.bag_algorithms, DEFAULT_ENGINE_BENCHMARK_BYTES, 4096,
+                                   self.benchmarkProgress],
+                                  self.onHashEngineBenchmarkDone)
+        async_execute(self.benchmarkTask, EXECUTOR_HASH)
+
+    @pyqtSlot(object, bool)
+    def onHashEngineBenchmarkDone(self, result, success):
+        self.benchmarkTask = None
+        self.hashEngineBenchmarkButton.setEnabled(True)
+        if not success:
+            self.hashEngineBenchmarkLabel.setText("Benchmark failed: %s" % result)
+            return
+        names = dict(HASH_ENGINE_NAMES)
+        lines = list()
+        for size, throughput in sorted(result.items()):
+            fastest = max(throughput, key=throughput.get)
+            lines.append("%s files: %s (fastest: %s)" %
+                         (format_bytes(size),
+                          ", ".join(["%s %s/s" % (names[engine], format_bytes(rate))
+                                     for engine, rate in throughput.items()]),
+                          names[fastest]))
+        self.hashEngineBenchmarkLabel.setText("\n".join(lines))
+
+    def done(self, result):
+        if self.benchmarkTask is not None:
+            self.benchmarkTask.cancel()
+        super(OptionsDialog, self).done(result)
+
+    @pyqtSlot(int)
+    def onMaxJobsChanged(self, value):
+        self.max_concurrent_jobs = value
+
+    @pyqtSlot(int)
+    def onExecutorLimitChanged(self, value):
+        self.executor_limits = {
+            EXECUTOR_HASH: self.hashWorkersSpinBox.value(),
+            EXECUTOR_NETWORK: self.networkWorkersSpinBox.value(),
+            EXECUTOR_DISK: self.diskWorkersSpinBox.value()
+        }
+
+    @pyqtSlot(int)
+    def onHashWorkersChanged(self, value):
+        self.hash_workers = value
+
+    @pyqtSlot(int)
+    def onFetchWorkersChanged(self, value):
+        self.fetch_workers = value
+
+    @pyqtSlot(int)
+    def onFetchPerHostChanged(self, value):
+        self.fetch_per_host = value
+
+    @pyqtSlot(bool)
+    def onDigestCacheModeChanged(self, checked):
+        if checked:
+            if self.digestCacheTrustButton.isChecked():
+                self.digest_cache_mode = DIGEST_CACHE_TRUST
+            elif self.digestCacheRecomputeButton.isChecked():
+                self.digest_cache_mode = DIGEST_CACHE_RECOMPUTE
+            elif self.digestCacheOffButton.isChecked():
+                self.digest_cache_mode = DIGEST_CACHE_OFF
+
+    @pyqtSlot(int)
+    def onDigestTrustDaysChanged(self, value):
+        self.digest_trust_days = value
+
+    @pyqtSlot(bool)
+    def onValidateTrustCacheChanged(self, checked):
+        self.validate_trust_cache = checked
+        self.digestTrustSpinBox.setEnabled(checked)
+
+    @pyqtSlot(int)
+    def onValidationPolicyChanged(self, index):
+        self.validation_policy = self.validationPolicyComboBox.itemData(index)
+        self.validationBudgetSpinBox.setEnabled(self.validation_policy == VALIDATION_POLICY_BUDGET)
+
+    @pyqtSlot(int)
+    def onValidationErrorBudgetChanged(self, value):
+        self.validation_error_budget = value
+
+    @pyqtSlot(float)
+    def onSamplePercentChanged(self, value):
+        self.sample_percent = value
+
+    @pyqtSlot(int)
+    def onSampleBudgetChanged(self, value):
+        self.sample_budget_gb = value
+
+    @pyqtSlot(bool)
+    def onSampleMethodChanged(self, checked):
+        self.sample_method = SAMPLE_STRATIFIED if checked else SAMPLE_RANDOM
+
+    @pyqtSlot()
+    def onDigestCacheClear(self):
+        try:
+            with DigestCache() as cache:
+                cache.clear()
+            logging.info("Checksum cache cleared.")
+        except Exception as e:
+            warningMessageBox(self, "Unable to clear the checksum cache.", str(e))
+
+    @pyqtSlot(bool)
+    def onProcessTaskTypesChanged(self, checked):
+        self.process_task_types = [task_type for task_type in TASK_TYPES
+                                   if self.processTaskCheckBoxes[task_type].isChecked()]
+
+    @pyqtSlot(int)
+    def onLogBufferLinesChanged(self, value):
+        self.log_buffer_lines = value
+
     @pyqtSlot()
     def restoreDefaults(self):
         self.config_file = DEFAULT_OPTIONS["bag_config_file_path"]
         self.configFilePathTextBox.setText(self.config_file)
         self.keychain_file = DEFAULT_OPTIONS["bag_keychain_file_path"]
         self.keychainFilePathTextBox.setText(self.keychain_file)
+        self.setAlgorithms(DEFAULT_OPTIONS["bag_algorithms"])
+        self.hash_engine = DEFAULT_OPTIONS["hash_engine"]
+        self.hashEngineComboBox.setCurrentIndex(self.hashEngineComboBox.findData(self.hash_engine))
         self.archive_extract_dir = DEFAULT_OPTIONS["archive_extract_dir"]
         self.archive_format = DEFAULT_OPTIONS["archive_format"]
+        self.max_concurrent_jobs = DEFAULT_OPTIONS["max_concurrent_jobs"]
+        self.maxJobsSpinBox.setValue(self.max_concurrent_jobs)
+        self.hashWorkersSpinBox.setValue(DEFAULT_OPTIONS["executor_limits"][EXECUTOR_HASH])
+        self.networkWorkersSpinBox.setValue(DEFAULT_OPTIONS["executor_limits"][EXECUTOR_NETWORK])
+        self.diskWorkersSpinBox.setValue(DEFAULT_OPTIONS["executor_limits"][EXECUTOR_DISK])
+        self.hashWorkersPerJobSpinBox.setValue(DEFAULT_OPTIONS["hash_workers"])
+        self.fetchWorkersSpinBox.setValue(DEFAULT_OPTIONS["fetch_workers"])
+        self.fetchPerHostSpinBox.setValue(DEFAULT_OPTIONS["fetch_per_host"])
+        self.digest_cache_mode = DEFAULT_OPTIONS["digest_cache_mode"]
+        self.digestCacheTrustButton.setChecked(True)
+        self.digestTrustSpinBox.setValue(DEFAULT_OPTIONS["digest_trust_days"])
+        self.validateTrustCacheCheckBox.setChecked(DEFAULT_OPTIONS["validate_trust_cache"])
+        self.validationPolicyComboBox.setCurrentIndex(
+            self.validationPolicyComboBox.findData(DEFAULT_OPTIONS["validation_policy"]))
+        self.onValidationPolicyChanged(self.validationPolicyComboBox.currentIndex())
+        self.validationBudgetSpinBox.setValue(DEFAULT_OPTIONS["validation_error_budget"])
+        self.samplePercentSpinBox.setValue(DEFAULT_OPTIONS["sample_percent"])
+        self.sampleBudgetSpinBox.setValue(DEFAULT_OPTIONS["sample_budget_gb"])
+        self.sampleStratifiedCheckBox.setChecked(DEFAULT_OPTIONS["sample_method"] == SAMPLE_STRATIFIED)
+        for task_type, checkBox in self.processTaskCheckBoxes.items():
+            checkBox.setChecked(task_type in DEFAULT_OPTIONS["process_task_types"])
+        self.logBufferSpinBox.setValue(DEFAULT_OPTIONS["log_buffer_lines"])
 
     @staticmethod
     def getOptions(parent):
@@ -229,12 +773,63 @@ class OptionsDialog(QDialog):
             if dialog.keychain_file != parent.options["bag_keychain_file_path"]:
                 parent.options["bag_keychain_file_path"] = dialog.keychain_file
                 dirty = True
+            if dialog.bag_algorithms != parent.options["bag_algorithms"]:
+                parent.options["bag_algorithms"] = dialog.bag_algorithms
+                dirty = True
+            if dialog.hash_engine != parent.options["hash_engine"]:
+                parent.options["hash_engine"] = dialog.hash_engine
+                dirty = True
             if dialog.archive_extract_dir != parent.options["archive_extract_dir"]:
                 parent.options["archive_extract_dir"] = dialog.archive_extract_dir
                 dirty = True
             if dialog.archive_format != parent.options["archive_format"]:
                 parent.options["archive_format"] = dialog.archive_format
                 dirty = True
+            if dialog.max_concurrent_jobs != parent.options["max_concurrent_jobs"]:
+                parent.options["max_concurrent_jobs"] = dialog.max_concurrent_jobs
+                dirty = True
+            if dialog.executor_limits != parent.options["executor_limits"]:
+                parent.options["executor_limits"] = dialog.executor_limits
+                dirty = True
+            if dialog.hash_workers != parent.options["hash_workers"]:
+                parent.options["hash_workers"] = dialog.hash_workers
+                dirty = True
+            if dialog.fetch_workers != parent.options["fetch_workers"]:
+                parent.options["fetch_workers"] = dialog.fetch_workers
+                dirty = True
+            if dialog.fetch_per_host != parent.options["fetch_per_host"]:
+                parent.options["fetch_per_host"] = dialog.fetch_per_host
+                dirty = True
+            if dialog.digest_cache_mode != parent.options["digest_cache_mode"]:
+                parent.options["digest_cache_mode"] = dialog.digest_cache_mode
+                dirty = True
+            if dialog.digest_trust_days != parent.options["digest_trust_days"]:
+                parent.options["digest_trust_days"] = dialog.digest_trust_days
+                dirty = True
+            if dialog.validate_trust_cache != parent.options.get("validate_trust_cache"):
+                parent.options["validate_trust_cache"] = dialog.validate_trust_cache
+                dirty = True
+            if dialog.validation_policy != parent.options["validation_policy"]:
+                parent.options["validation_policy"] = dialog.validation_policy
+                dirty = True
+            if dialog.validation_error_budget != parent.options["validation_error_budget"]:
+                parent.options["validation_error_budget"] = dialog.validation_error_budget
+                dirty = True
+            if dialog.sample_percent != parent.options["sample_percent"]:
+                parent.options["sample_percent"] = dialog.sample_percent
+                dirty = True
+            if dialog.sample_budget_gb != parent.options["sample_budget_gb"]:
+                parent.options["sample_budget_gb"] = dialog.sample_budget_gb
+                dirty = True
+            if dialog.sample_method != parent.options["sample_method"]:
+                parent.options["sample_method"] = dialog.sample_method
+                dirty = True
+            if dialog.process_task_types != parent.options["process_task_types"]:
+                parent.options["process_task_types"] = dialog.process_task_types
+                dirty = True
+            if dialog.log_buffer_lines != parent.options["log_buffer_lines"]:
+                parent.options["log_buffer_lines"] = dialog.log_buffer_lines
+                dirty = True
             if dirty:
                 parent.saveOptions()
         del dialog
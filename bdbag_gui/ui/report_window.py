@@ -0,0 +1,208 @@
+import os
+import time
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSlot
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QCheckBox, QTableView, QPlainTextEdit, \
+    QAbstractItemView, QSplitter, QDialogButtonBox
+from bdbag_gui.impl.async_task import Task, async_execute
+from bdbag_gui.impl.progress import format_bytes, format_duration
+from bdbag_gui.impl.report import load_report, REPORT_OK
+
+REPORT_COLUMNS = [
+    ("Path", "path"),
+    ("Status", "status"),
+    ("Size", "size"),
+    ("Time (s)", "seconds"),
+    ("Throughput", "throughput"),
+    ("Cached", "cached")
+]
+
+
+class ReportTableModel(QAbstractTableModel):
+    # a report can hold millions of files, so rows are plain report records rather than items
+
+    def __init__(self, parent=None):
+        super(ReportTableModel, self).__init__(parent)
+        self.records = list()
+        self.rows = list()
+        self.problems_only = False
+        self.sort_column = 0
+        self.sort_order = Qt.AscendingOrder
+
+    def setRecords(self, records):
+        self.beginResetModel()
+        self.records = records
+        self.filterRows()
+        self.endResetModel()
+
+    def setProblemsOnly(self, problems_only):
+        self.beginResetModel()
+        self.problems_only = problems_only
+        self.filterRows()
+        self.endResetModel()
+
+    def filterRows(self):
+        self.rows = [record for record in self.records
+                     if not self.problems_only or record.get("status") != REPORT_OK]
+        self.sortRows()
+
+    def sortRows(self):
+        key = REPORT_COLUMNS[self.sort_column][1]
+        # files without a value (such as the time of a cached checksum) sort before every other file
+        self.rows.sort(key=lambda record: (record.get(key) is not None, record.get(key) or 0)
+                       if key not in ("path", "status") else record.get(key) or "",
+                       reverse=self.sort_order == Qt.DescendingOrder)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.sort_column = column
+        self.sort_order = order
+        self.sortRows()
+        self.layoutChanged.emit()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(REPORT_COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return REPORT_COLUMNS[section][0]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self.rows[index.row()]
+        key = REPORT_COLUMNS[index.column()][1]
+        value = record.get(key)
+        if role == Qt.DisplayRole:
+            if value is None:
+                return ""
+            if key == "size":
+                return format_bytes(value)
+            if key == "seconds":
+                return "%.3f" % value
+            if key == "throughput":
+                return "%s/s" % format_bytes(value)
+            if key == "cached":
+                return "Yes" if value else ""
+            return str(value)
+        if role == Qt.TextAlignmentRole and key in ("size", "seconds", "throughput"):
+            return Qt.AlignRight | Qt.AlignVCenter
+        if role == Qt.ForegroundRole and key == "status" and value != REPORT_OK:
+            return Qt.red
+        return None
+
+    def record(self, row):
+        return self.rows[row]
+
+
+class ReportDialog(QDialog):
+
+    def __init__(self, parent, report_path):
+        super(ReportDialog, self).__init__(parent)
+        self.report_path = report_path
+        self.loadTask = None
+        self.setWindowTitle("Validation Report - %s" % os.path.basename(report_path))
+        self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        self.resize(1000, 600)
+        layout = QVBoxLayout(self)
+
+        self.summaryLabel = QLabel("Loading %s..." % report_path)
+        self.summaryLabel.setWordWrap(True)
+        self.summaryLabel.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.summaryLabel)
+
+        filterLayout = QHBoxLayout()
+        self.problemsOnlyCheckBox = QCheckBox("Show failed files only")
+        self.problemsOnlyCheckBox.toggled.connect(self.onProblemsOnlyToggled)
+        filterLayout.addWidget(self.problemsOnlyCheckBox)
+        filterLayout.addStretch(1)
+        self.countLabel = QLabel("")
+        filterLayout.addWidget(self.countLabel)
+        layout.addLayout(filterLayout)
+
+        splitter = QSplitter(Qt.Vertical, self)
+        self.model = ReportTableModel(self)
+        self.tableView = QTableView(splitter)
+        self.tableView.setModel(self.model)
+        self.tableView.setSortingEnabled(True)
+        self.tableView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tableView.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.tableView.verticalHeader().setVisible(False)
+        self.tableView.horizontalHeader().setStretchLastSection(False)
+        self.tableView.setColumnWidth(0, 450)
+        self.tableView.selectionModel().currentRowChanged.connect(self.onCurrentRowChanged)
+        self.detailText = QPlainTextEdit(splitter)
+        self.detailText.setReadOnly(True)
+        splitter.setStretchFactor(0, 4)
+        splitter.setStretchFactor(1, 1)
+        layout.addWidget(splitter)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+        # parsing a report of millions of files takes a while, so it is loaded off the GUI thread; the default pool
+        # runs no jobs, so the report does not wait behind archive or extract jobs holding the disk workers
+        self.loadTask = Task(load_report, [report_path], self.onReportLoaded)
+        async_execute(self.loadTask)
+
+    @pyqtSlot(object, bool)
+    def onReportLoaded(self, result, success):
+        self.loadTask = None
+        if not success:
+            self.summaryLabel.setText("Unable to load %s: %s" % (self.report_path, result))
+            return
+        run, files, summary = result
+        run = run or dict()
+        text = "%s validation of [%s], started %s." % (
+            (run.get("mode") or "Unknown").capitalize(), run.get("bag", "?"),
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started"])) if run.get("started") else "?")
+        if summary is None:
+            text += " The run did not finish: the report holds the files checked before it ended."
+        else:
+            counts = ", ".join("%d %s" % (count, status) for status, count in sorted(summary["counts"].items()))
+            text += " %s after %s: %s." % ("Succeeded" if summary["success"] else "Failed",
+                                          format_duration(summary["seconds"]), counts or "no files")
+            if summary.get("message") and not summary["success"]:
+                text += "\n%s" % summary["message"]
+        hashed = [record for record in files if record.get("seconds")]
+        if hashed:
+            seconds = sum(record["seconds"] for record in hashed)
+            nbytes = sum(record.get("size") or 0 for record in hashed)
+            text += "\nHashing time summed over all files: %s for %s" % (format_duration(seconds), format_bytes(nbytes))
+        self.summaryLabel.setText(text)
+        self.model.setRecords(files)
+        self.problemsOnlyCheckBox.setChecked(summary is not None and not summary["success"])
+        self.updateCount()
+
+    @pyqtSlot(bool)
+    def onProblemsOnlyToggled(self, checked):
+        self.model.setProblemsOnly(checked)
+        self.updateCount()
+
+    def updateCount(self):
+        self.countLabel.setText("%d of %d files" % (len(self.model.rows), len(self.model.records)))
+
+    @pyqtSlot(QModelIndex, QModelIndex)
+    def onCurrentRowChanged(self, current, previous):
+        if not current.isValid():
+            self.detailText.clear()
+            return
+        record = self.model.record(current.row())
+        lines = ["%s: %s" % (record.get("path"), record.get("status"))]
+        expected = record.get("expected") or dict()
+        actual = record.get("actual") or dict()
+        for alg in sorted(set(expected) | set(actual)):
+            lines.append("%s expected: %s" % (alg, expected.get(alg, "")))
+            lines.append("%s found:    %s" % (alg, actual.get(alg, "")))
+        if record.get("error"):
+            lines.append("Error: %s" % record["error"])
+        self.detailText.setPlainText("\n".join(lines))
+
+    def done(self, result):
+        if self.loadTask is not None:
+            self.loadTask.cancel()
+        super(ReportDialog, self).done(result)
@@ -0,0 +1,104 @@
+from PyQt5.QtCore import Qt, QModelIndex, QIdentityProxyModel, pyqtSlot
+from PyQt5.QtGui import QIcon, QPixmap, QPainter
+from PyQt5.QtWidgets import QApplication, QStyle
+from bdbag_gui.impl.bag_detect import BagScanner, BAG_STATUS_BAG, BAG_STATUS_HOLEY_BAG, BAG_STATUS_ARCHIVE, \
+    BAG_STATUS_BAG_ARCHIVE
+
+STATUS_BADGES = {
+    BAG_STATUS_BAG: QStyle.SP_DialogApplyButton,
+    BAG_STATUS_HOLEY_BAG: QStyle.SP_ArrowDown,
+    BAG_STATUS_ARCHIVE: QStyle.SP_DialogSaveButton,
+    BAG_STATUS_BAG_ARCHIVE: QStyle.SP_DialogApplyButton
+}
+
+STATUS_TOOLTIPS = {
+    BAG_STATUS_BAG: "Bag",
+    BAG_STATUS_HOLEY_BAG: "Bag with remote file references (fetch.txt)",
+    BAG_STATUS_ARCHIVE: "Archive",
+    BAG_STATUS_BAG_ARCHIVE: "Bag archive"
+}
+
+
+class BagStatusProxyModel(QIdentityProxyModel):
+
+    def __init__(self, parent=None):
+        super(BagStatusProxyModel, self).__init__(parent)
+        self.icons = dict()
+        self.scanner = BagScanner(parent=self)
+        self.scanner.scanned_signal.connect(self.onScanned)
+
+    def setSourceModel(self, model):
+        super(BagStatusProxyModel, self).setSourceModel(model)
+        model.rowsInserted.connect(self.onSourceRowsChanged)
+        model.rowsRemoved.connect(self.onSourceRowsChanged)
+        model.dataChanged.connect(self.onSourceDataChanged)
+
+    def filePath(self, index):
+        return self.sourceModel().filePath(self.mapToSource(index))
+
+    def index_for_path(self, path):
+        return self.mapFromSource(self.sourceModel().index(path))
+
+    def data(self, index, role=Qt.DisplayRole):
+        value = super(BagStatusProxyModel, self).data(index, role)
+        if index.column() != 0 or role not in (Qt.DecorationRole, Qt.ToolTipRole):
+            return value
+        # the view only asks for decorations of rows it paints, so only visible rows are ever scanned
+        status = self.scanner.status(self.filePath(index)) if role == Qt.DecorationRole else \
+            self.scanner.cache.get(self.filePath(index))
+        if not status:
+            return value
+        if role == Qt.ToolTipRole:
+            return STATUS_TOOLTIPS[status]
+        return self.overlayIcon(value, status)
+
+    def overlayIcon(self, icon, status):
+        key = (status, icon.cacheKey() if isinstance(icon, QIcon) else None)
+        overlay = self.icons.get(key)
+        if overlay is None:
+            style = QApplication.style()
+            size = style.pixelMetric(QStyle.PM_SmallIconSize)
+            pixmap = QPixmap(size, size)
+            pixmap.fill(Qt.transparent)
+            painter = QPainter(pixmap)
+            if isinstance(icon, QIcon):
+                icon.paint(painter, 0, 0, size, size)
+            badge = style.standardIcon(STATUS_BADGES[status]).pixmap(size * 2 // 3, size * 2 // 3)
+            painter.drawPixmap(size - badge.width(), size - badge.height(), badge)
+            painter.end()
+            overlay = QIcon(pixmap)
+            self.icons[key] = overlay
+        return overlay
+
+    @pyqtSlot(str)
+    def invalidate(self, path):
+        source_index = self.sourceModel().index(path)
+        if not source_index.isValid():
+            return
+        path = self.sourceModel().filePath(source_index)
+        self.scanner.invalidate(path)
+        index = self.mapFromSource(source_index)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    @pyqtSlot(object)
+    def onScanned(self, results):
+        for path, status in results:
+            if not status:
+                continue
+            index = self.index_for_path(path)
+            if index.isValid():
+                self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    @pyqtSlot(QModelIndex, int, int)
+    def onSourceRowsChanged(self, parent, first, last):
+        # an entry added to or removed from a directory (e.g. bagit.txt or fetch.txt) may change its status
+        if parent.isValid():
+            self.invalidate(self.sourceModel().filePath(parent))
+
+    @pyqtSlot(QModelIndex, QModelIndex)
+    def onSourceDataChanged(self, top_left, bottom_right):
+        if top_left.parent() != bottom_right.parent():
+            return
+        model = self.sourceModel()
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self.scanner.invalidate(model.filePath(model.index(row, 0, top_left.parent())))
@@ -0,0 +1,113 @@
+# Times the log view handlers with a storm of log records: the original handler, which emits a signal and runs
+# processEvents for every record, against the batched queue of bdbag_gui.ui.log_widget.QPlainTextEditLogger.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmark/log_handler.py --records 1000000
+#
+# For each handler it prints how long logging the records took and how long until the view showed the last of them.
+# The original handler only runs on the GUI thread (its processEvents call is not safe anywhere else), so the storm is
+# logged from the GUI thread for both; --threads also logs it from that many worker threads with the batched handler.
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from PyQt5.Qt import qApp
+from PyQt5.QtCore import QEventLoop, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QPlainTextEdit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bdbag_gui.ui.log_widget import QPlainTextEditLogger, DEFAULT_LOG_BUFFER_LINES  # noqa: E402
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+class PerRecordLog(QPlainTextEdit):
+    log_update_signal = pyqtSignal(str)
+
+
+class PerRecordLogger(logging.Handler):
+    # the handler the batched queue replaced
+
+    def __init__(self):
+        super(PerRecordLogger, self).__init__()
+        self.widget = PerRecordLog()
+        self.widget.setMaximumBlockCount(DEFAULT_LOG_BUFFER_LINES)
+
+    def emit(self, record):
+        msg = self.format(record)
+        self.widget.log_update_signal.emit(msg)
+        qApp.processEvents()
+
+    def drain(self):
+        pass
+
+
+class BatchedLogger(QPlainTextEditLogger):
+
+    def __init__(self):
+        super(BatchedLogger, self).__init__(None)
+
+    def drain(self):
+        # the drain timer would do this every interval; here the queue is emptied as soon as the storm is over
+        while self.records or self.dropped:
+            super(BatchedLogger, self).drain()
+
+
+def run(app, handler, records, threads):
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.widget.log_update_signal.connect(handler.widget.appendPlainText)
+    logger = logging.getLogger("benchmark.%s.%d" % (type(handler).__name__, threads))
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+
+    def storm(count, offset):
+        for i in range(offset, offset + count):
+            logger.debug("record %d of %d", i + 1, records)
+
+    start = time.perf_counter()
+    if threads:
+        counts = [records // threads + (1 if i < records % threads else 0) for i in range(threads)]
+        workers = [threading.Thread(target=storm, args=(count, sum(counts[:i]))) for i, count in enumerate(counts)]
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            app.processEvents(QEventLoop.AllEvents, 50)
+    else:
+        storm(records, 0)
+    logged = time.perf_counter() - start
+    handler.drain()
+    app.processEvents()
+    displayed = time.perf_counter() - start
+    logger.removeHandler(handler)
+    handler.close()
+    return logged, displayed, handler.widget.document().lastBlock().text()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the log view handlers with a storm of log records.")
+    parser.add_argument("--records", type=int, default=1000000, help="Number of records to log (default: 1000000).")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Also log the records from this many worker threads with the batched handler.")
+    parser.add_argument("--handler", choices=["per-record", "batched", "both"], default="both",
+                        help="The handlers to time (default: both).")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    runs = list()
+    if args.handler in ("per-record", "both"):
+        runs.append(("per-record", PerRecordLogger, 0))
+    if args.handler in ("batched", "both"):
+        runs.append(("batched", BatchedLogger, 0))
+        if args.threads:
+            runs.append(("batched", BatchedLogger, args.threads))
+    for name, handler_class, threads in runs:
+        logged, displayed, last = run(app, handler_class(), args.records, threads)
+        print("%-10s %-16s logged in %8.2fs, displayed in %8.2fs (%9.0f records/s); last line: %s" %
+              (name, "%d threads" % threads if threads else "GUI thread", logged, displayed,
+               args.records / displayed, last[last.find("record"):]))
+
+
+if __name__ == "__main__":
+    main()
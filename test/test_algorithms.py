@@ -0,0 +1,25 @@
+import unittest
+from bdbag import bdbagit
+from bdbag_gui.impl.algorithms import BAG_ALGORITHMS, ALGORITHM_PRESETS, supported_algorithms, recommend_algorithms
+
+
+class TestAlgorithms(unittest.TestCase):
+
+    def test_offered_algorithms_are_supported_by_bdbag(self):
+        self.assertTrue(BAG_ALGORITHMS)
+        self.assertTrue(set(BAG_ALGORITHMS).issubset(bdbagit.CHECKSUM_ALGOS))
+        for name, algorithms in ALGORITHM_PRESETS:
+            self.assertEqual(supported_algorithms(algorithms), sorted(algorithms, key=BAG_ALGORITHMS.index), name)
+
+    def test_supported_algorithms(self):
+        self.assertEqual(supported_algorithms(["sha256", "blake2b", "md5", "sha3_256"]), ["md5", "sha256"])
+        self.assertEqual(supported_algorithms(["blake2b"]), [])
+
+    def test_recommendation_is_supported(self):
+        throughput = dict((alg, 100.0 + i) for i, alg in enumerate(BAG_ALGORITHMS))
+        self.assertEqual(recommend_algorithms(throughput), [BAG_ALGORITHMS[-1]])
+        self.assertEqual(recommend_algorithms(throughput, allowed=["md5", "blake2b"]), ["md5"])
+
+
+if __name__ == "__main__":
+    unittest.main()
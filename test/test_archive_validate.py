@@ -0,0 +1,78 @@
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+from bdbag import bdbagit, bdbag_api as bdb
+from bdbag_gui.impl import archive_validate
+from bdbag_gui.impl.report import load_report, REPORT_OK
+
+FILES = 10
+
+
+class TestArchiveValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.report_dir = os.path.join(self.tmpdir, "reports")
+        self.bag_path = os.path.join(self.tmpdir, "bag")
+        os.makedirs(self.bag_path)
+        for i in range(FILES):
+            with open(os.path.join(self.bag_path, "f%d.bin" % i), "wb") as f:
+                f.write(os.urandom(10000))
+        bdb.make_bag(self.bag_path, algs=["md5", "sha256"], config_file=os.path.join(self.tmpdir, "bdbag.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def archive(self, extension):
+        # an uncompressed archive, so a payload file can be damaged in place
+        archive_path = os.path.join(self.tmpdir, "bag" + extension)
+        names = sorted(os.path.relpath(os.path.join(dirpath, filename), self.tmpdir)
+                       for dirpath, dirnames, filenames in os.walk(self.bag_path) for filename in filenames)
+        if extension == ".zip":
+            with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED) as archive:
+                for name in names:
+                    archive.write(os.path.join(self.tmpdir, name), name)
+        else:
+            with tarfile.open(archive_path, "w") as archive:
+                for name in names:
+                    archive.add(os.path.join(self.tmpdir, name), name)
+        return archive_path
+
+    def report(self):
+        reports = os.listdir(self.report_dir)
+        self.assertEqual(len(reports), 1)
+        return load_report(os.path.join(self.report_dir, reports[0]))
+
+    def test_valid(self):
+        for extension in (".zip", ".tar"):
+            archive_validate.validate_archive(self.archive(extension), report_dir=self.report_dir)
+            run, files, summary = self.report()
+            self.assertTrue(summary["success"])
+            payload = [record for record in files if record["path"].startswith("data/")]
+            self.assertEqual(len(payload), FILES)
+            self.assertTrue(all(record["status"] == REPORT_OK for record in files))
+            shutil.rmtree(self.report_dir)
+
+    def test_files_reported_as_checked(self):
+        # the zip tag files are read first, so each payload file is in the report once hashed: a damaged member part
+        # way through the archive ends validation with the files before it already reported
+        archive_path = self.archive(".zip")
+        with zipfile.ZipFile(archive_path) as archive:
+            info = archive.getinfo("bag/data/f7.bin")
+        with open(archive_path, "r+b") as f:
+            f.seek(info.header_offset + 30 + len(info.filename) + len(info.extra) + 100)
+            data = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([data[0] ^ 0xff]))
+        with self.assertRaises(bdbagit.BagError):
+            archive_validate.validate_archive(archive_path, report_dir=self.report_dir)
+        run, files, summary = self.report()
+        self.assertFalse(summary["success"])
+        self.assertEqual(sorted(record["path"] for record in files), ["data/f%d.bin" % i for i in range(7)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,234 @@
+import os
+import gzip
+import time
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication, QFileSystemModel
+from bdbag import bdbag_api as bdb
+from bdbag_gui.impl.bag_detect import BagDetector, BagScanner, classify_path, detect_bag, sniff_archive, \
+    BAG_STATUS_NONE, BAG_STATUS_BAG, BAG_STATUS_HOLEY_BAG, BAG_STATUS_ARCHIVE, BAG_STATUS_BAG_ARCHIVE, \
+    ARCHIVE_FORMAT_ZIP, ARCHIVE_FORMAT_TAR, ARCHIVE_FORMAT_TGZ
+from bdbag_gui.ui.tree_model import BagStatusProxyModel
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+TIMEOUT = 10
+
+
+class BagDetectTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.config_file = os.path.join(self.tmpdir, "bdbag.json")
+        self.bag_path = self.make_dir("bag", {"a.txt": b"a"})
+        bdb.make_bag(self.bag_path, config_file=self.config_file)
+        self.dir_path = self.make_dir("dir", {"b.txt": b"b"})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_dir(self, name, files):
+        path = os.path.join(self.tmpdir, name)
+        os.makedirs(path)
+        for filename, data in files.items():
+            with open(os.path.join(path, filename), "wb") as f:
+                f.write(data)
+        return path
+
+    def make_archive(self, name, root, archive_format):
+        # archives are named without an extension: detection goes by their content
+        path = os.path.join(self.tmpdir, name)
+        names = sorted(os.path.relpath(os.path.join(dirpath, filename), self.tmpdir)
+                       for dirpath, dirnames, filenames in os.walk(root) for filename in filenames)
+        if archive_format == ARCHIVE_FORMAT_ZIP:
+            with zipfile.ZipFile(path, "w") as archive:
+                for member in names:
+                    archive.write(os.path.join(self.tmpdir, member), member)
+        else:
+            with tarfile.open(path, "w:gz" if archive_format == ARCHIVE_FORMAT_TGZ else "w") as archive:
+                for member in names:
+                    archive.add(os.path.join(self.tmpdir, member), member)
+        return path
+
+    def wait(self, condition):
+        deadline = time.monotonic() + TIMEOUT
+        while not condition() and time.monotonic() < deadline:
+            self.app.processEvents()
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+
+class TestClassify(BagDetectTestCase):
+
+    def test_directories(self):
+        self.assertEqual(classify_path(self.dir_path), BAG_STATUS_NONE)
+        self.assertEqual(classify_path(self.bag_path), BAG_STATUS_BAG)
+        self.assertEqual(detect_bag(self.bag_path), (self.bag_path, BAG_STATUS_BAG))
+        self.assertEqual(detect_bag(self.dir_path), (self.dir_path, BAG_STATUS_NONE))
+        with open(os.path.join(self.bag_path, "fetch.txt"), "w") as fetch_file:
+            fetch_file.write("http://example.org/c.txt\t1\tdata/c.txt\n")
+        self.assertEqual(classify_path(self.bag_path), BAG_STATUS_HOLEY_BAG)
+
+    def test_archives(self):
+        bag_zip = self.make_archive("bag_zip", self.bag_path, ARCHIVE_FORMAT_ZIP)
+        self.assertEqual(sniff_archive(bag_zip), (ARCHIVE_FORMAT_ZIP, "bag"))
+        self.assertEqual(classify_path(bag_zip), BAG_STATUS_BAG_ARCHIVE)
+        self.assertEqual(detect_bag(bag_zip), (bag_zip, BAG_STATUS_BAG_ARCHIVE))
+        dir_zip = self.make_archive("dir_zip", self.dir_path, ARCHIVE_FORMAT_ZIP)
+        self.assertEqual(classify_path(dir_zip), BAG_STATUS_ARCHIVE)
+        # only the central directory of a zip file is read, tar files are not searched for a bag root
+        bag_tar = self.make_archive("bag_tar", self.bag_path, ARCHIVE_FORMAT_TAR)
+        self.assertEqual(sniff_archive(bag_tar), (ARCHIVE_FORMAT_TAR, None))
+        self.assertEqual(classify_path(bag_tar), BAG_STATUS_ARCHIVE)
+        bag_tgz = self.make_archive("bag_tgz", self.bag_path, ARCHIVE_FORMAT_TGZ)
+        self.assertEqual(classify_path(bag_tgz), BAG_STATUS_ARCHIVE)
+
+    def test_not_archives(self):
+        # a gzip file that holds no tar cannot be extracted
+        gz = os.path.join(self.tmpdir, "text.gz")
+        with gzip.open(gz, "wb") as f:
+            f.write(b"not a tar file " * 100)
+        self.assertEqual(classify_path(gz), BAG_STATUS_NONE)
+        self.assertEqual(classify_path(os.path.join(self.dir_path, "b.txt")), BAG_STATUS_NONE)
+        self.assertEqual(classify_path(os.path.join(self.tmpdir, "missing")), BAG_STATUS_NONE)
+
+    def test_sniff_cache_follows_changes(self):
+        path = os.path.join(self.tmpdir, "file")
+        with open(path, "wb") as f:
+            f.write(b"plain text")
+        self.assertEqual(classify_path(path), BAG_STATUS_NONE)
+        os.remove(path)
+        shutil.move(self.make_archive("bag_zip", self.bag_path, ARCHIVE_FORMAT_ZIP), path)
+        self.assertEqual(classify_path(path), BAG_STATUS_BAG_ARCHIVE)
+
+
+class TestBagDetector(BagDetectTestCase):
+
+    def setUp(self):
+        super(TestBagDetector, self).setUp()
+        self.detector = BagDetector()
+        self.detected = list()
+        self.invalidated = list()
+        self.detector.bag_detected_signal.connect(lambda path, status: self.detected.append((path, status)))
+        self.detector.bag_invalidated_signal.connect(self.invalidated.append)
+
+    def tearDown(self):
+        self.detector.deleteLater()
+        super(TestBagDetector, self).tearDown()
+
+    def detect(self, path):
+        self.assertIsNone(self.detector.request(path))
+        self.wait(lambda: self.detector.cached(path) is not None)
+        return self.detector.cached(path)
+
+    def test_detect(self):
+        self.assertEqual(self.detect(self.bag_path), BAG_STATUS_BAG)
+        self.assertEqual(self.detect(self.dir_path), BAG_STATUS_NONE)
+        bag_zip = self.make_archive("bag_zip", self.bag_path, ARCHIVE_FORMAT_ZIP)
+        self.assertEqual(self.detect(bag_zip), BAG_STATUS_BAG_ARCHIVE)
+        self.assertEqual(self.detected, [(self.bag_path, BAG_STATUS_BAG), (self.dir_path, BAG_STATUS_NONE),
+                                         (bag_zip, BAG_STATUS_BAG_ARCHIVE)])
+        # cached results are answered at once
+        self.assertEqual(self.detector.request(self.bag_path), BAG_STATUS_BAG)
+
+    def test_invalidate(self):
+        self.detect(self.bag_path)
+        self.detector.invalidate(self.bag_path)
+        self.assertEqual(self.invalidated, [self.bag_path])
+        self.assertIsNone(self.detector.cached(self.bag_path))
+        bdb.revert_bag(self.bag_path)
+        self.assertEqual(self.detect(self.bag_path), BAG_STATUS_NONE)
+
+    def test_invalidated_while_pending(self):
+        # a result that arrives after its path was invalidated is detected again rather than cached
+        self.assertIsNone(self.detector.request(self.bag_path))
+        self.detector.invalidate(self.bag_path)
+        bdb.revert_bag(self.bag_path)
+        self.wait(lambda: self.detector.cached(self.bag_path) is not None)
+        self.assertEqual(self.detector.cached(self.bag_path), BAG_STATUS_NONE)
+
+    def test_watched_directory_change(self):
+        # the directory of a detected path is watched, so turning it into a bag invalidates it
+        self.assertEqual(self.detect(self.dir_path), BAG_STATUS_NONE)
+        bdb.make_bag(self.dir_path, config_file=self.config_file)
+        self.wait(lambda: self.dir_path in self.invalidated)
+        self.assertEqual(self.detect(self.dir_path), BAG_STATUS_BAG)
+
+
+class TestBagScanner(BagDetectTestCase):
+
+    def test_scan_and_invalidate(self):
+        scanner = BagScanner(batch_size=2)
+        scanned = list()
+        scanner.scanned_signal.connect(scanned.extend)
+        paths = [self.bag_path, self.dir_path, os.path.join(self.dir_path, "b.txt")]
+        self.assertEqual([scanner.status(path) for path in paths], [None] * 3)
+        self.wait(lambda: len(scanned) == 3)
+        self.assertEqual([scanner.status(path) for path in paths], [BAG_STATUS_BAG, BAG_STATUS_NONE, BAG_STATUS_NONE])
+        scanner.invalidate(self.bag_path)
+        bdb.revert_bag(self.bag_path)
+        self.assertIsNone(scanner.status(self.bag_path))
+        self.wait(lambda: scanner.cache.get(self.bag_path) is not None)
+        self.assertEqual(scanner.status(self.bag_path), BAG_STATUS_NONE)
+
+
+class TestBagStatusProxyModel(BagDetectTestCase):
+
+    def setUp(self):
+        super(TestBagStatusProxyModel, self).setUp()
+        self.model = QFileSystemModel()
+        loaded = list()
+        self.model.directoryLoaded.connect(loaded.append)
+        self.model.setRootPath(self.tmpdir)
+        self.wait(lambda: self.tmpdir in loaded)
+        self.proxy = BagStatusProxyModel()
+        self.proxy.setSourceModel(self.model)
+        self.changed = list()
+        self.proxy.dataChanged.connect(lambda top_left, bottom_right, roles: self.changed.append(
+            self.proxy.filePath(top_left)))
+
+    def tearDown(self):
+        self.proxy.deleteLater()
+        self.model.deleteLater()
+        super(TestBagStatusProxyModel, self).tearDown()
+
+    def scan(self, path):
+        index = self.proxy.index_for_path(path)
+        self.proxy.data(index, Qt.DecorationRole)
+        self.wait(lambda: self.proxy.scanner.cache.get(path) is not None)
+        return index
+
+    def test_status_overlay(self):
+        index = self.scan(self.bag_path)
+        self.assertIn(self.bag_path, self.changed)
+        self.assertEqual(self.proxy.data(index, Qt.ToolTipRole), "Bag")
+        self.assertNotEqual(self.proxy.data(index, Qt.DecorationRole).cacheKey(),
+                            self.model.data(self.proxy.mapToSource(index), Qt.DecorationRole).cacheKey())
+        index = self.scan(self.dir_path)
+        self.assertNotEqual(self.proxy.data(index, Qt.ToolTipRole), "Bag")
+
+    def test_invalidate(self):
+        self.scan(self.bag_path)
+        self.changed.clear()
+        self.proxy.invalidate(self.bag_path)
+        self.assertIsNone(self.proxy.scanner.cache.get(self.bag_path))
+        self.assertEqual(self.changed, [self.bag_path])
+
+    def test_source_data_changed(self):
+        # a renamed or otherwise changed row of the file system model is scanned again
+        index = self.scan(self.bag_path)
+        source_index = self.proxy.mapToSource(index)
+        self.model.dataChanged.emit(source_index, source_index, [])
+        self.assertIsNone(self.proxy.scanner.cache.get(self.bag_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from bdbag import bdbag_api as bdb
+from bdbag_gui.impl import bag_engine
+
+PAYLOAD = {
+    "a.txt": b"a",
+    "Z.txt": b"zz",
+    "B/empty": b"",
+    "sub/b b.txt": b"b" * 5000,
+    "sub/_x": b"1",
+    "sub/deeper/cé.bin": b"x" * 70000,
+}
+
+
+class TestBagEngineParity(unittest.TestCase):
+    # the engine writes its own manifests, bag-info.txt and tag manifests rather than going through bdbag, so every
+    # file of a bag it makes must be byte for byte the file bdbag would have written
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.config_file = os.path.join(self.tmpdir, "bdbag.json")
+        with open(self.config_file, "w") as config:
+            # fixed bagging times, so the two bag-info.txt files can be compared
+            json.dump({"bag_config": {"bag_algorithms": ["md5", "sha256"], "bag_processes": 1,
+                                      "bag_metadata": {"Bagging-Date": "2020-01-01",
+                                                       "Bagging-Time": "00:00:00 UTC"}}}, config)
+        self.expected = os.path.join(self.tmpdir, "expected")
+        self.actual = os.path.join(self.tmpdir, "actual")
+        for bag_path in (self.expected, self.actual):
+            self.write_files(bag_path, PAYLOAD)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def write_files(root, files):
+        for name, data in files.items():
+            path = os.path.join(root, *name.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def assertSameBag(self):
+        expected_files = set()
+        for dirpath, dirnames, filenames in os.walk(self.expected):
+            for filename in filenames:
+                expected_files.add(os.path.relpath(os.path.join(dirpath, filename), self.expected))
+        actual_files = set()
+        for dirpath, dirnames, filenames in os.walk(self.actual):
+            for filename in filenames:
+                actual_files.add(os.path.relpath(os.path.join(dirpath, filename), self.actual))
+        self.assertEqual(expected_files, actual_files)
+        for name in sorted(expected_files):
+            with open(os.path.join(self.expected, name), "rb") as expected, \
+                    open(os.path.join(self.actual, name), "rb") as actual:
+                self.assertEqual(expected.read(), actual.read(), name)
+        bdb.validate_bag(self.actual)
+
+    def make_bags(self, algorithms=None, update=False):
+        bdb.make_bag(self.expected, algs=algorithms, update=update, config_file=self.config_file)
+        bag_engine.make_bag(self.actual, algorithms, update=update, config_file=self.config_file)
+
+    def test_create(self):
+        self.make_bags()
+        self.assertSameBag()
+
+    def test_update(self):
+        self.make_bags()
+        for bag_path in (self.expected, self.actual):
+            self.write_files(os.path.join(bag_path, "data"), {"a.txt": b"changed", "sub/new.txt": b"new"})
+            os.remove(os.path.join(bag_path, "data", "Z.txt"))
+            # a tag file in a tag directory is listed in the tag manifests
+            self.write_files(bag_path, {"metadata/extra.txt": b"tag"})
+        self.make_bags(update=True)
+        self.assertSameBag()
+
+    def test_add_algorithms(self):
+        # an update that adds algorithms rehashes the whole payload with every algorithm of the bag
+        self.make_bags()
+        for bag_path in (self.expected, self.actual):
+            self.write_files(os.path.join(bag_path, "data"), {"sub/new.txt": b"new"})
+        self.make_bags(["md5", "sha256", "sha512"], update=True)
+        self.assertTrue(os.path.isfile(os.path.join(self.actual, "manifest-sha512.txt")))
+        self.assertTrue(os.path.isfile(os.path.join(self.actual, "tagmanifest-sha512.txt")))
+        self.assertSameBag()
+
+    def test_idempotent(self):
+        # an idempotent configuration drops the bagging time, including the one set in the configured metadata
+        with open(self.config_file) as config:
+            bdbag_config = json.load(config)
+        bdbag_config["bag_config"]["bag_archive_idempotent"] = True
+        with open(self.config_file, "w") as config:
+            json.dump(bdbag_config, config)
+        self.make_bags()
+        self.assertSameBag()
+        for bag_path in (self.expected, self.actual):
+            self.write_files(os.path.join(bag_path, "data"), {"sub/new.txt": b"new"})
+        self.make_bags(update=True)
+        self.assertSameBag()
+        with open(os.path.join(self.actual, "bag-info.txt")) as bag_info:
+            self.assertNotIn("Bagging-", bag_info.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from bdbag import bdbagit, bdbag_api as bdb
+from bdbag_gui.impl import bag_validate
+from bdbag_gui.impl.report import load_report, REPORT_OK, REPORT_MISMATCH, REPORT_UNREADABLE
+
+FILES = 10
+ALGORITHMS = ["md5", "sha256"]
+
+
+class TestBagValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.report_dir = os.path.join(self.tmpdir, "reports")
+        self.bag_path = os.path.join(self.tmpdir, "bag")
+        os.makedirs(self.bag_path)
+        for i in range(FILES):
+            with open(os.path.join(self.bag_path, "f%d.bin" % i), "wb") as f:
+                f.write(os.urandom(1000 * (i + 1)))
+        bdb.make_bag(self.bag_path, algs=ALGORITHMS, config_file=os.path.join(self.tmpdir, "bdbag.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, i):
+        return os.path.join(self.bag_path, "data", "f%d.bin" % i)
+
+    def damage(self, i):
+        # same size, so Payload-Oxum still matches
+        with open(self.path(i), "r+b") as f:
+            data = f.read(1)
+            f.seek(0)
+            f.write(bytes([data[0] ^ 0xff]))
+
+    def report(self):
+        reports = os.listdir(self.report_dir)
+        self.assertEqual(len(reports), 1)
+        run, files, summary = load_report(os.path.join(self.report_dir, reports[0]))
+        return dict((record["path"], record["status"]) for record in files)
+
+    def test_every_mismatch(self):
+        # validation does not stop at the first mismatch: every damaged file fails, once per algorithm
+        for i in (2, 5, 9):
+            self.damage(i)
+        bag = bdbagit.BDBag(self.bag_path)
+        errors = bag_validate.validate_entries(bag, workers=2)
+        self.assertTrue(all(isinstance(e, bdbagit.ChecksumMismatch) for e in errors))
+        self.assertEqual(sorted((e.path, e.algorithm) for e in errors),
+                         sorted(("data/f%d.bin" % i, alg) for i in (2, 5, 9) for alg in ALGORITHMS))
+        self.assertEqual(bag_validate.failure_count(errors), 3)
+
+    def test_unreadable(self):
+        # a file that cannot be read (here a directory) or stat (a dangling symlink) fails like a mismatch
+        self.damage(1)
+        os.remove(self.path(4))
+        os.mkdir(self.path(4))
+        os.remove(self.path(7))
+        os.symlink("missing.bin", self.path(7))
+        report = bag_validate.ValidationReport.create(self.bag_path, "full", self.report_dir)
+        errors = bag_validate.validate_entries(bdbagit.BDBag(self.bag_path), workers=2, report=report)
+        report.close(False, 0)
+        failed = dict((e.path, e.found) for e in errors)
+        self.assertEqual(sorted(failed), ["data/f1.bin", "data/f4.bin", "data/f7.bin"])
+        self.assertTrue(failed["data/f4.bin"].startswith("Could not read"))
+        self.assertTrue(failed["data/f7.bin"].startswith("Could not read"))
+        statuses = self.report()
+        self.assertEqual(statuses["data/f1.bin"], REPORT_MISMATCH)
+        self.assertEqual(statuses["data/f4.bin"], REPORT_UNREADABLE)
+        self.assertEqual(statuses["data/f7.bin"], REPORT_UNREADABLE)
+        # the tag files are checked too
+        self.assertEqual(set(status for path, status in statuses.items()
+                             if path not in ("data/f1.bin", "data/f4.bin", "data/f7.bin")), {REPORT_OK})
+        self.assertEqual(len(statuses), len(bdbagit.BDBag(self.bag_path).entries))
+
+    def validate(self, policy, error_budget=bag_validate.DEFAULT_ERROR_BUDGET):
+        with self.assertRaises(bag_validate.PayloadValidationError) as context:
+            bag_validate.validate_bag(self.bag_path, workers=1, report_dir=self.report_dir, policy=policy,
+                                      error_budget=error_budget)
+        return context.exception
+
+    def test_error_limit(self):
+        self.assertIsNone(bag_validate.error_limit(bag_validate.VALIDATION_POLICY_COMPLETE))
+        self.assertEqual(bag_validate.error_limit(bag_validate.VALIDATION_POLICY_FAIL_FAST, 50), 1)
+        self.assertEqual(bag_validate.error_limit(bag_validate.VALIDATION_POLICY_BUDGET, 50), 50)
+        self.assertEqual(bag_validate.error_limit(bag_validate.VALIDATION_POLICY_BUDGET, 0), 1)
+
+    def test_failure_count(self):
+        # a file failing the manifests of several algorithms is one failure
+        errors = [bdbagit.ChecksumMismatch("data/f1.bin", alg, "0", "1") for alg in ALGORITHMS] + \
+            [bdbagit.ChecksumMismatch("data/f2.bin", "md5", "0", "1"), bdbagit.FileMissing("data/f3.bin"),
+             bag_validate.PayloadOxumMismatch("1.1", "2.2")]
+        self.assertEqual(bag_validate.failure_count(errors), 4)
+        self.assertEqual(bag_validate.failure_count([]), 0)
+
+    def test_complete(self):
+        for i in range(FILES):
+            self.damage(i)
+        e = self.validate(bag_validate.VALIDATION_POLICY_COMPLETE)
+        self.assertEqual(bag_validate.failure_count(e.details), FILES)
+
+    def test_stop_at_limit(self):
+        # the files not yet read once the limit is reached are not read at all
+        for i in range(FILES):
+            self.damage(i)
+        for policy, error_budget, limit in ((bag_validate.VALIDATION_POLICY_FAIL_FAST, 5, 1),
+                                            (bag_validate.VALIDATION_POLICY_BUDGET, 3, 3)):
+            e = self.validate(policy, error_budget)
+            self.assertIn("stopped after %d failure" % limit, str(e))
+            self.assertEqual(bag_validate.failure_count(e.details), limit)
+            self.assertLess(len([path for path in self.report() if path.startswith("data/")]), FILES)
+            shutil.rmtree(self.report_dir)
+
+    def test_missing_file_fails_before_hashing(self):
+        os.remove(self.path(3))
+        with mock.patch.object(bag_validate, "hash_payload") as hash_payload:
+            e = self.validate(bag_validate.VALIDATION_POLICY_FAIL_FAST)
+        hash_payload.assert_not_called()
+        self.assertIn("before reading the payload", str(e))
+        self.assertEqual([type(error) for error in e.details], [bdbagit.FileMissing])
+
+    def test_payload_oxum_fails_before_hashing(self):
+        with open(self.path(3), "ab") as f:
+            f.write(b"more")
+        with mock.patch.object(bag_validate, "hash_payload") as hash_payload:
+            e = self.validate(bag_validate.VALIDATION_POLICY_BUDGET, 1)
+        hash_payload.assert_not_called()
+        self.assertIn("before reading the payload", str(e))
+        self.assertEqual([type(error) for error in e.details], [bag_validate.PayloadOxumMismatch])
+        # a validation that runs to completion goes on to find the file that changed
+        shutil.rmtree(self.report_dir)
+        e = self.validate(bag_validate.VALIDATION_POLICY_COMPLETE)
+        self.assertEqual(sorted(getattr(error, "path", "") for error in e.details),
+                         ["", "data/f3.bin", "data/f3.bin"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from bdbag_gui.impl import bag_engine
+from bdbag_gui.impl.digest_cache import DigestCache, DIGEST_CACHE_TRUST, DIGEST_CACHE_RECOMPUTE, digest_key
+
+DAY = 24 * 60 * 60
+
+
+class TestDigestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.cache_file = os.path.join(self.tmpdir, "digests.db")
+        self.data_file = os.path.join(self.tmpdir, "data.txt")
+        with open(self.data_file, "wb") as f:
+            f.write(b"payload")
+        # backdated, so the file is not inside the window in which it could still change unnoticed
+        mtime = time.time() - DAY
+        os.utime(self.data_file, (mtime, mtime))
+        patcher = mock.patch.object(bag_engine, "open_digest_cache",
+                                    lambda mode: None if mode == "off" else DigestCache(self.cache_file).open())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def verified(self):
+        with DigestCache(self.cache_file) as cache:
+            return cache.connection.execute("SELECT verified FROM digests").fetchone()[0]
+
+    def set_verified(self, verified):
+        with DigestCache(self.cache_file) as cache:
+            with cache.connection:
+                cache.connection.execute("UPDATE digests SET verified=?", (verified,))
+
+    def hash(self, cache_mode, max_age=None):
+        with mock.patch.object(bag_engine, "hash_files", wraps=bag_engine.hash_files) as hash_files:
+            results = bag_engine.hash_payload([self.data_file], ["sha256"], 1, cache_mode=cache_mode, max_age=max_age)
+        self.assertEqual(results[0][1], 7)
+        # nothing is read for checksums served from the cache
+        return not hash_files.call_args[0][0]
+
+    def test_store_records_when_reading_began(self):
+        start = int(time.time())
+        self.assertFalse(self.hash(DIGEST_CACHE_TRUST))
+        self.assertGreaterEqual(self.verified(), start)
+        self.assertLessEqual(self.verified(), int(time.time()))
+
+    def test_cache_hit_does_not_refresh_verified(self):
+        self.hash(DIGEST_CACHE_TRUST)
+        verified = int(time.time()) - 10 * DAY
+        self.set_verified(verified)
+        self.assertTrue(self.hash(DIGEST_CACHE_TRUST, max_age=30 * DAY))
+        self.assertEqual(self.verified(), verified)
+        # without a trust window the cache serves create and update, which must not refresh it either
+        self.assertTrue(self.hash(DIGEST_CACHE_TRUST))
+        self.assertEqual(self.verified(), verified)
+
+    def test_expired_checksum_is_read_again(self):
+        self.hash(DIGEST_CACHE_TRUST)
+        self.set_verified(int(time.time()) - 10 * DAY)
+        start = int(time.time())
+        self.assertFalse(self.hash(DIGEST_CACHE_TRUST, max_age=5 * DAY))
+        self.assertGreaterEqual(self.verified(), start)
+
+    def test_recompute_refreshes_verified(self):
+        self.hash(DIGEST_CACHE_TRUST)
+        self.set_verified(int(time.time()) - 10 * DAY)
+        start = int(time.time())
+        self.assertFalse(self.hash(DIGEST_CACHE_RECOMPUTE))
+        self.assertGreaterEqual(self.verified(), start)
+
+    def test_changed_file_is_not_served(self):
+        self.hash(DIGEST_CACHE_TRUST)
+        with open(self.data_file, "wb") as f:
+            f.write(b"changed")
+        mtime = time.time() - DAY / 2
+        os.utime(self.data_file, (mtime, mtime))
+        self.assertFalse(self.hash(DIGEST_CACHE_TRUST))
+        with DigestCache(self.cache_file) as cache:
+            self.assertIsNotNone(cache.lookup([digest_key(os.stat(self.data_file))], ["sha256"])[0])
+
+
+
+class TestDigestCacheEviction(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.cache = DigestCache(os.path.join(self.tmpdir, "digests.db"), max_entries=20).open()
+        self.counts = list()
+        self.cache.connection.set_trace_callback(
+            lambda statement: self.counts.append(statement) if "COUNT(*)" in statement else None)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def store(self, first, count):
+        # files used in the order of their inode numbers
+        keys = [(1, ino, 100, 1000) for ino in range(first, first + count)]
+        self.cache.store([(key, {"md5": "a%d" % key[1], "sha256": "b%d" % key[1]}) for key in keys])
+        with self.cache.connection:
+            self.cache.connection.executemany("UPDATE digests SET last_used=? WHERE ino=?",
+                                              [(key[1], key[1]) for key in keys])
+
+    def cached_files(self):
+        rows = self.cache.connection.execute("SELECT ino, COUNT(*) FROM digests GROUP BY ino").fetchall()
+        # no file is left with only some of its checksums
+        self.assertTrue(all(count == 2 for ino, count in rows))
+        return sorted(ino for ino, count in rows)
+
+    def test_evicts_least_recently_used_files(self):
+        self.store(1, 8)
+        self.assertEqual(self.cached_files(), list(range(1, 9)))
+        self.store(9, 4)
+        # 24 entries, evicted down to 18: the oldest files go with all of their checksums
+        self.assertEqual(self.cached_files(), list(range(4, 13)))
+
+    def test_counts_only_when_full(self):
+        self.store(1, 2)
+        self.assertEqual(len(self.counts), 1)
+        for first in range(3, 8, 2):
+            self.store(first, 2)
+        # 16 entries, counted on the first store only
+        self.assertEqual(len(self.counts), 1)
+        # the count is kept for the next connection to the same cache
+        with DigestCache(self.cache.path, max_entries=20) as cache:
+            counts = list()
+            cache.connection.set_trace_callback(
+                lambda statement: counts.append(statement) if "COUNT(*)" in statement else None)
+            cache.store([((1, 100, 100, 1000), {"md5": "a", "sha256": "b"})])
+            self.assertEqual(counts, [])
+        # 22 entries may be more than the cache holds: counted again, and evicted down to 18
+        self.store(11, 2)
+        self.assertGreater(len(self.counts), 1)
+        self.assertEqual(len(self.cached_files()), 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from bdbag import bdbag_api as bdb
+from bdbag_gui.impl import fetch_engine
+
+PER_HOST = 2
+SLOW_FILE = "slow.bin"
+BROKEN_FILE = "broken.bin"
+
+
+class PayloadHandler(SimpleHTTPRequestHandler):
+    # serves the payload with keep-alive and counts the connections open at once. Files are served slowly, so the
+    # transfers overlap; /broken/ cuts a file short, and the slow file pauses halfway to look at the bag.
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, state=None, **kwargs):
+        self.state = state
+        super(PayloadHandler, self).__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super(PayloadHandler, self).setup()
+        with self.state["lock"]:
+            self.state["open"] += 1
+            self.state["max_open"] = max(self.state["max_open"], self.state["open"])
+
+    def finish(self):
+        with self.state["lock"]:
+            self.state["open"] -= 1
+        super(PayloadHandler, self).finish()
+
+    def do_GET(self):
+        with self.state["lock"]:
+            self.state["requests"].append(self.path)
+        time.sleep(0.05)
+        if self.path.startswith("/broken/"):
+            # a body shorter than the file, ended by closing the connection
+            with open(os.path.join(self.directory, self.path[len("/broken/"):]), "rb") as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 3])
+            self.close_connection = True
+            return
+        if self.path == "/" + SLOW_FILE:
+            with open(os.path.join(self.directory, SLOW_FILE), "rb") as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.wfile.flush()
+            time.sleep(0.5)
+            output_path = os.path.join(self.state["bag_path"], "data", SLOW_FILE)
+            self.state["partial_seen"] = (os.path.isfile(output_path + fetch_engine.PARTIAL_SUFFIX) and
+                                          not os.path.exists(output_path))
+            self.wfile.write(data[len(data) // 2:])
+            return
+        super(PayloadHandler, self).do_GET()
+
+
+class TestFetchEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.config_file = os.path.join(self.tmpdir, "bdbag.json")
+        self.keychain_file = os.path.join(self.tmpdir, "keychain.json")
+        self.bag_path = os.path.join(self.tmpdir, "bag")
+        self.served = os.path.join(self.tmpdir, "served")
+        self.files = dict()
+        for i in range(12):
+            self.files["f%02d.bin" % i] = os.urandom(1000 * (i + 1))
+        self.files[SLOW_FILE] = os.urandom(200000)
+        self.files[BROKEN_FILE] = os.urandom(300000)
+        os.makedirs(self.bag_path)
+        for name, data in self.files.items():
+            with open(os.path.join(self.bag_path, name), "wb") as f:
+                f.write(data)
+        bdb.make_bag(self.bag_path, algs=["sha256"], config_file=self.config_file)
+        shutil.copytree(os.path.join(self.bag_path, "data"), self.served)
+
+        self.state = {"lock": threading.Lock(), "open": 0, "max_open": 0, "requests": list(),
+                      "partial_seen": None, "bag_path": self.bag_path}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                          partial(PayloadHandler, directory=self.served, state=self.state))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = "http://127.0.0.1:%d/" % self.server.server_port
+        # every payload file is remote; the broken file is listed first with a URL that fails, then with one that works
+        with open(os.path.join(self.bag_path, "fetch.txt"), "w") as fetch_file:
+            for name, data in sorted(self.files.items()):
+                if name == BROKEN_FILE:
+                    fetch_file.write("%sbroken/%s\t%d\tdata/%s\n" % (base_url, name, len(data), name))
+                fetch_file.write("%s%s\t%d\tdata/%s\n" % (base_url, name, len(data), name))
+                os.remove(os.path.join(self.bag_path, "data", name))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def fetch(self, callback):
+        return fetch_engine.fetch_bag(self.bag_path, callback=callback, keychain_file=self.keychain_file,
+                                      config_file=self.config_file, workers=8, per_host=PER_HOST)
+
+    def partials(self):
+        return [name for dirpath, dirnames, filenames in os.walk(self.bag_path) for name in filenames
+                if name.endswith(fetch_engine.PARTIAL_SUFFIX)]
+
+    def test_fetch(self):
+        progress = list()
+        self.assertTrue(self.fetch(lambda *args: progress.append(args)))
+        self.assertLessEqual(self.state["max_open"], PER_HOST)
+        self.assertGreater(self.state["max_open"], 1)
+        # the slow file was written next to its output path and renamed into place once complete
+        self.assertTrue(self.state["partial_seen"])
+        self.assertEqual(self.partials(), [])
+        for name, data in self.files.items():
+            with open(os.path.join(self.bag_path, "data", name), "rb") as f:
+                self.assertEqual(f.read(), data, name)
+        # the bytes of the failed attempt were taken back, so the broken file is counted once
+        total_bytes = sum(len(data) for data in self.files.values())
+        self.assertIn("/broken/" + BROKEN_FILE, self.state["requests"])
+        self.assertEqual(progress[-1], (total_bytes, total_bytes, len(self.files)))
+        self.assertTrue(all(done <= total_bytes + len(self.files[BROKEN_FILE]) // 3 for done, total, files in progress))
+        bdb.validate_bag(self.bag_path, fast=False, config_file=self.config_file)
+
+    def test_stop(self):
+        # returning False from the callback stops the fetch: no further files are requested, and none are left partial
+        self.assertFalse(self.fetch(lambda *args: False))
+        self.assertLess(len(self.state["requests"]), len(self.files))
+        self.assertEqual(self.partials(), [])
+        for name, data in self.files.items():
+            path = os.path.join(self.bag_path, "data", name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), data, name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from bdbag_gui.impl import hashing
+from bdbag_gui.impl.hashing import hash_file, hash_files, hash_small_file, HASH_ENGINES, SMALL_FILE_SIZE, \
+    MIN_MMAP_SIZE, LARGE_HASH_BLOCK_SIZE
+
+ALGORITHMS = ["md5", "sha1", "sha256", "sha512"]
+BLOCK_SIZE = 4096
+# empty, one byte, around the block size, several blocks, around the small file size and around the size from which
+# files are mapped
+SIZES = [0, 1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 3 * BLOCK_SIZE + 7, SMALL_FILE_SIZE - 1, SMALL_FILE_SIZE,
+         SMALL_FILE_SIZE + 1, MIN_MMAP_SIZE - 1, MIN_MMAP_SIZE, MIN_MMAP_SIZE + BLOCK_SIZE + 1]
+
+
+class TestHashingParity(unittest.TestCase):
+    # every engine, the small-file path and the batched runs of hash_files must give the digests hashlib gives
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        cls.files = list()
+        for size in SIZES:
+            cls.files.append(cls.write("f%d.bin" % size, os.urandom(size)))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    @classmethod
+    def write(cls, name, data):
+        path = os.path.join(cls.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path, len(data), dict((alg, hashlib.new(alg, data).hexdigest()) for alg in ALGORITHMS)
+
+    def test_engines(self):
+        for engine in HASH_ENGINES:
+            for path, size, expected in self.files:
+                for block_size in (BLOCK_SIZE, hashing.engine_block_size(engine)):
+                    self.assertEqual(hash_file(path, ALGORITHMS, block_size, engine=engine), (expected, size),
+                                     "%s %d bytes, %d byte blocks" % (engine, size, block_size))
+
+    def test_engines_multiple_default_blocks(self):
+        path, size, expected = self.write("large.bin", os.urandom(2 * LARGE_HASH_BLOCK_SIZE + 1))
+        for engine in HASH_ENGINES:
+            self.assertEqual(hash_file(path, ALGORITHMS, hashing.engine_block_size(engine), engine=engine),
+                             (expected, size), engine)
+
+    def test_small_files(self):
+        for path, size, expected in self.files:
+            if size <= SMALL_FILE_SIZE:
+                self.assertEqual(hash_small_file(path, ALGORITHMS, size), (expected, size), size)
+        # a file that grew past the small file size since it was stat'ed is still read whole
+        for path, size, expected in self.files:
+            if size > SMALL_FILE_SIZE:
+                self.assertEqual(hash_small_file(path, ALGORITHMS, 1), (expected, size), size)
+
+    def test_hash_files(self):
+        paths = [path for path, size, expected in self.files]
+        stats = [os.stat(path) for path in paths]
+        expected = [(digests, size) for path, size, digests in self.files]
+        for engine in HASH_ENGINES:
+            for workers in (1, 4):
+                # with stats the small files are hashed in batches
+                self.assertEqual(hash_files(paths, ALGORITHMS, workers, engine=engine, stats=stats), expected,
+                                 "%s, %d workers" % (engine, workers))
+                self.assertEqual(hash_files(paths, ALGORITHMS, workers, engine=engine), expected,
+                                 "%s, %d workers, without stats" % (engine, workers))
+
+
+if __name__ == "__main__":
+    unittest.main()
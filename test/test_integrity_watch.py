@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from bdbag import bdbag_api as bdb
+from bdbag_gui.impl import integrity_watch
+from bdbag_gui.impl.integrity_watch import BagWatch, check_watch, DRIFT_MISMATCH, DRIFT_MISSING, DRIFT_UNEXPECTED
+
+
+class TestCheckWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.bag_path = os.path.join(self.tmpdir, "bag")
+        os.makedirs(os.path.join(self.bag_path, "sub"))
+        self.payload = {"a.txt": b"a", "b.txt": b"b", os.path.join("sub", "c.txt"): b"c"}
+        for name, data in self.payload.items():
+            self.write(os.path.join(self.bag_path, name), data)
+        bdb.make_bag(self.bag_path, algs=["md5", "sha256"], config_file=os.path.join(self.tmpdir, "bdbag.json"))
+        self.data_dir = os.path.join(self.bag_path, "data")
+        self.watch = self.check(BagWatch(self.bag_path), reload=True).watch
+        self.assertEqual(self.watch.algorithm, "sha256")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def write(path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def check(self, watch, dirty_dirs=(), dirty_files=(), reload=False):
+        return check_watch(watch, set(dirty_dirs), set(dirty_files), reload, 0, lambda: False)
+
+    def test_loaded(self):
+        self.assertEqual(self.watch.drift, {})
+        self.assertEqual(sorted(self.watch.snapshot),
+                         sorted(os.path.join(self.data_dir, name) for name in self.payload))
+
+    def test_modified_removed_added(self):
+        modified = os.path.join(self.data_dir, "a.txt")
+        removed = os.path.join(self.data_dir, "sub", "c.txt")
+        added = os.path.join(self.data_dir, "sub", "d.txt")
+        self.write(modified, b"changed")
+        os.remove(removed)
+        self.write(added, b"d")
+        # the file watch reports the modified file, the directory watch the removed and added ones
+        result = self.check(self.watch, [os.path.dirname(removed)], [modified])
+        drift = {"data/a.txt": DRIFT_MISMATCH, "data/sub/c.txt": DRIFT_MISSING, "data/sub/d.txt": DRIFT_UNEXPECTED}
+        self.assertEqual(result.new_drift(), drift)
+        self.assertEqual(self.watch.drift, drift)
+        self.assertIn(removed, result.removed)
+        self.assertIn(added, result.added)
+        self.assertEqual(result.unsettled, [])
+
+        # putting the files back clears the drift
+        self.write(modified, b"a")
+        self.write(removed, b"c")
+        os.remove(added)
+        result = self.check(self.watch, [os.path.dirname(removed)], [modified])
+        self.assertEqual(result.cleared(), sorted(drift))
+        self.assertEqual(result.new_drift(), {})
+        self.assertEqual(self.watch.drift, {})
+
+    def test_unchanged_file_is_not_read(self):
+        # a reported file whose size and modification time did not change is not hashed again
+        with mock.patch.object(integrity_watch, "hash_file") as hash_file:
+            result = self.check(self.watch, [self.data_dir], [os.path.join(self.data_dir, "b.txt")])
+        hash_file.assert_not_called()
+        self.assertEqual(result.new_drift(), {})
+
+    def test_unsettled_file_is_checked_later(self):
+        modified = os.path.join(self.data_dir, "b.txt")
+        self.write(modified, b"changed")
+        result = check_watch(self.watch, set(), {modified}, False, 60 * 10 ** 9, lambda: False)
+        self.assertEqual(result.unsettled, [modified])
+        self.assertEqual(self.watch.drift, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import os
+import time
+import unittest
+from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtWidgets import QApplication
+from bdbag_gui.impl.async_task import BACKEND_THREAD, BACKEND_PROCESS
+from bdbag_gui.impl.bag_tasks import BagTask, BagArchiveTask, BagExtractTask, BagRevertTask, BagValidateTask
+from bdbag_gui.impl.job_queue import JobQueue, JOB_QUEUED, JOB_RUNNING, JOB_CANCELING, JOB_COMPLETED, JOB_FAILED, \
+    JOB_CANCELED
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+class FakeTask(object):
+
+    def __init__(self):
+        self.canceled = False
+
+
+class FakeBagTask(QObject):
+    # stands in for a BagTask: records when the queue runs it, and finishes when told to
+    status_update_signal = pyqtSignal(str, bool)
+    progress_update_signal = pyqtSignal(int, int)
+    throughput_update_signal = pyqtSignal(float, float)
+
+    def __init__(self, runs):
+        super(FakeBagTask, self).__init__()
+        self.runs = runs
+        self.task = FakeTask()
+        self.path = None
+        self.cancelable = True
+
+    def start(self):
+        self.job_queue.schedule(self)
+
+    def run(self):
+        self.runs.append(self)
+
+    def can_cancel(self):
+        return self.cancelable
+
+    def cancel(self):
+        self.task.canceled = True
+
+    def finish(self, success=True):
+        self.status_update_signal.emit("done", success)
+
+
+class WaitTask(BagTask):
+
+    def wait(self, seconds):
+        self.task = self.create_task(time.sleep, [seconds])
+        self.start()
+
+
+class TestJobQueue(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        self.queue = JobQueue(2)
+        self.runs = list()
+
+    def submit(self, count):
+        tasks = [FakeBagTask(self.runs) for i in range(count)]
+        jobs = [self.queue.submit(task, "job %d" % i) for i, task in enumerate(tasks)]
+        for task in tasks:
+            task.start()
+        return tasks, jobs
+
+    def test_order_and_limit(self):
+        tasks, jobs = self.submit(5)
+        self.assertEqual(self.runs, tasks[:2])
+        self.assertEqual([job.state for job in jobs], [JOB_RUNNING] * 2 + [JOB_QUEUED] * 3)
+        # a finished job frees its slot for the job queued longest
+        tasks[1].finish(False)
+        self.assertEqual(jobs[1].state, JOB_FAILED)
+        self.assertEqual(self.runs, tasks[:3])
+        tasks[0].finish()
+        self.assertEqual(jobs[0].state, JOB_COMPLETED)
+        self.assertEqual(self.runs, tasks[:4])
+        self.assertEqual(len(self.queue.running), 2)
+        # raising the limit starts queued jobs at once
+        self.queue.set_max_concurrent_jobs(3)
+        self.assertEqual(self.runs, tasks)
+        self.assertEqual([job.state for job in self.queue.active_jobs()], [JOB_RUNNING] * 3)
+
+    def test_cancel(self):
+        tasks, jobs = self.submit(3)
+        # a queued job is canceled at once and never runs
+        self.queue.cancel(jobs[2])
+        self.assertEqual(jobs[2].state, JOB_CANCELED)
+        self.assertNotIn(jobs[2], self.queue.pending)
+        # a running job is canceling until its task stops, and only then frees its slot
+        self.queue.cancel(jobs[0])
+        self.assertTrue(tasks[0].task.canceled)
+        self.assertEqual(jobs[0].state, JOB_CANCELING)
+        self.assertEqual(len(self.queue.running), 2)
+        tasks[0].finish(False)
+        self.assertEqual(jobs[0].state, JOB_CANCELED)
+        self.assertEqual(self.queue.running, [jobs[1]])
+        self.assertEqual(self.runs, tasks[:2])
+        # finished jobs can be cleared, active ones cannot
+        self.queue.clear_finished()
+        self.assertEqual(self.queue.jobs, [jobs[1]])
+
+    def test_cannot_cancel(self):
+        # a running job whose task cannot stop part way runs to completion, a queued one can still be canceled
+        tasks, jobs = self.submit(3)
+        for task in tasks:
+            task.cancelable = False
+        self.assertEqual([job.can_cancel() for job in jobs], [False, False, True])
+        self.queue.cancel_all()
+        self.assertEqual([job.state for job in jobs], [JOB_RUNNING, JOB_RUNNING, JOB_CANCELED])
+        self.assertFalse(tasks[0].task.canceled)
+        tasks[0].finish()
+        self.assertEqual(jobs[0].state, JOB_COMPLETED)
+
+    def test_bag_tasks_can_cancel(self):
+        # bdbag archives, extracts and reverts without a way to stop part way: only a worker process can be stopped,
+        # and a revert not even then
+        for task_class, thread, process in ((BagArchiveTask, False, True), (BagExtractTask, False, True),
+                                            (BagRevertTask, False, False), (BagValidateTask, True, True)):
+            task = task_class()
+            task.backend = BACKEND_THREAD
+            self.assertEqual(task.can_cancel(), thread, task_class.__name__)
+            task.backend = BACKEND_PROCESS
+            self.assertEqual(task.can_cancel(), process, task_class.__name__)
+
+    def test_progress_timer(self):
+        # the progress timer of a bag task runs only while the task runs: not while it is queued, and not once it
+        # was canceled from the queue or has finished
+        self.queue.set_max_concurrent_jobs(1)
+        tasks, jobs = self.submit(1)
+        queued = [WaitTask(), WaitTask()]
+        queued_jobs = [self.queue.submit(task, "wait") for task in queued]
+        for task in queued:
+            task.wait(0)
+        self.assertEqual([job.state for job in queued_jobs], [JOB_QUEUED] * 2)
+        self.assertFalse(any(task.progress.timer.isActive() for task in queued))
+        self.queue.cancel(queued_jobs[0])
+        self.assertEqual(queued_jobs[0].state, JOB_CANCELED)
+        self.assertFalse(queued[0].progress.timer.isActive())
+
+        tasks[0].finish()
+        self.assertEqual(queued_jobs[1].state, JOB_RUNNING)
+        self.assertTrue(queued[1].progress.timer.isActive())
+        deadline = time.monotonic() + 10
+        while queued_jobs[1].is_active() and time.monotonic() < deadline:
+            self.app.processEvents()
+            time.sleep(0.01)
+        self.assertEqual(queued_jobs[1].state, JOB_COMPLETED)
+        self.assertFalse(queued[1].progress.timer.isActive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from logging.handlers import RotatingFileHandler
+from PyQt5.QtWidgets import QApplication
+from bdbag_gui.ui.log_widget import QPlainTextEditLogger, SessionLogHistory
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+class TestSessionLogHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.filename = os.path.join(self.tmpdir, "session.log")
+        self.handler = RotatingFileHandler(self.filename, maxBytes=1000, backupCount=3, encoding="utf-8")
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.line = 0
+
+    def tearDown(self):
+        self.handler.close()
+        shutil.rmtree(self.tmpdir)
+
+    def log(self, count):
+        for i in range(count):
+            self.line += 1
+            self.handler.emit(logging.makeLogRecord({"msg": "line %05d" % self.line}))
+        self.handler.flush()
+
+    def history(self):
+        history = SessionLogHistory(self.filename, 3, page_lines=40)
+        history.set_index(*history.index())
+        return history
+
+    def test_pages(self):
+        self.log(250)
+        history = self.history()
+        lines = "\n".join(history.read_page(page) for page in range(len(history.pages))).split("\n")
+        # the oldest lines were rotated out, the rest read back in order
+        self.assertEqual(lines[-1], "line 00250")
+        self.assertEqual([int(line.split()[1]) for line in lines],
+                         list(range(250 - len(lines) + 1, 251)))
+        self.assertEqual(len(lines), history.total_lines)
+
+    def test_rollover_after_index(self):
+        self.log(150)
+        history = self.history()
+        pages = [history.read_page(page) for page in range(len(history.pages))]
+        # each file moves to the next backup: the pages still read the lines they were indexed with
+        backup = os.stat(self.filename + ".1").st_ino
+        self.log(100)
+        self.assertNotEqual(os.stat(self.filename + ".1").st_ino, backup)
+        for page, text in enumerate(pages[:-1]):
+            self.assertEqual(history.read_page(page), text)
+        # a page whose file was rotated out is reported as such rather than read from another file
+        self.log(200)
+        self.assertIsNone(history.read_page(0))
+
+
+class TestQPlainTextEditLogger(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        self.handler = QPlainTextEditLogger(None)
+        self.handler.timer.stop()
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.text = list()
+        self.handler.widget.log_update_signal.connect(self.text.append)
+
+    def tearDown(self):
+        self.handler.close()
+        self.handler.widget.deleteLater()
+
+    def log(self, count):
+        for i in range(count):
+            self.handler.handle(logging.makeLogRecord({"msg": "line %d" % i}))
+
+    def test_queue_is_bounded(self):
+        self.handler.set_buffer_lines(100)
+        self.log(250)
+        self.assertEqual(len(self.handler.records), 100)
+        self.assertEqual(self.handler.dropped, 150)
+        self.handler.drain()
+        lines = self.text[0].split("\n")
+        self.assertIn("150 log lines", lines[0])
+        self.assertEqual(lines[1:], ["line %d" % i for i in range(150, 250)])
+        self.assertEqual(self.handler.dropped, 0)
+        self.assertEqual(self.handler.widget.maximumBlockCount(), 100)
+
+    def test_resize_keeps_newest(self):
+        self.log(50)
+        self.handler.set_buffer_lines(20)
+        self.assertEqual(list(self.handler.records), ["line %d" % i for i in range(30, 50)])
+        self.assertEqual(self.handler.dropped, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
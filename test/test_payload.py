@@ -0,0 +1,59 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from bdbag import bdbagit, bdbag_api as bdb
+from bdbag_gui.impl import bag_engine, payload
+from bdbag_gui.impl.payload import diff_payload, PAYLOAD_ADDED, PAYLOAD_CHANGED, PAYLOAD_UNCHANGED
+
+DAY = 24 * 60 * 60
+
+
+class TestDiffPayload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="bdbag_gui_test_")
+        self.config_file = os.path.join(self.tmpdir, "bdbag.json")
+        self.bag_path = os.path.join(self.tmpdir, "bag")
+        os.makedirs(self.bag_path)
+        # backdated, and without the racy window, so the payload is unchanged right after the bag is made
+        mtime = time.time() - 2 * DAY
+        for name in ("a.txt", "b.txt", "c.txt"):
+            path = os.path.join(self.bag_path, name)
+            with open(path, "w") as f:
+                f.write(name)
+            os.utime(path, (mtime, mtime))
+        patcher = mock.patch.object(payload, "RACY_WINDOW_NS", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        bag_engine.make_bag(self.bag_path, ["sha256"], config_file=self.config_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def states(self):
+        diff = diff_payload(bdbagit.BDBag(self.bag_path))
+        return dict((name, state) for name, path, size, state in diff.files)
+
+    def test_unchanged(self):
+        self.assertEqual(set(self.states().values()), {PAYLOAD_UNCHANGED})
+
+    def test_backdated_copy(self):
+        # a file replaced with a copy that keeps the copy's older mtime (cp -p, rsync -t) is still changed
+        source = os.path.join(self.tmpdir, "source.txt")
+        with open(source, "w") as f:
+            f.write("new")
+        mtime = time.time() - DAY
+        os.utime(source, (mtime, mtime))
+        shutil.copy2(source, os.path.join(self.bag_path, "data", "b.txt"))
+        shutil.copy2(source, os.path.join(self.bag_path, "data", "d.txt"))
+        self.assertEqual(self.states(), {"data/a.txt": PAYLOAD_UNCHANGED, "data/b.txt": PAYLOAD_CHANGED,
+                                         "data/c.txt": PAYLOAD_UNCHANGED, "data/d.txt": PAYLOAD_ADDED})
+        bag_engine.make_bag(self.bag_path, update=True, config_file=self.config_file)
+        bdb.validate_bag(self.bag_path, fast=False, config_file=self.config_file)
+
+
+if __name__ == "__main__":
+    unittest.main()